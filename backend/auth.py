@@ -1,9 +1,17 @@
 # логика токенов
 # Токен сохраняется у клиента в LocalStorage браузера / Cookies
 # Токен состоит из 3 частей | sub - владелец, exp - время истечения, iat - время создания
+import time
 from jose import jwt
 from datetime import datetime, timedelta
 from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from config import TOKEN_CACHE_MAX_SIZE, PRINCIPAL_CACHE_MAX_SIZE, PRINCIPAL_CACHE_TTL_SECONDS
+from cache import TTLCache
+
+# token -> (username, exp) | чтобы не проверять HMAC повторно для "горячих" токенов
+token_cache = TTLCache(max_size=TOKEN_CACHE_MAX_SIZE, default_ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+# username -> (id, username, email) | чтобы не ходить в БД за пользователем на каждом запросе
+principal_cache = TTLCache(max_size=PRINCIPAL_CACHE_MAX_SIZE, default_ttl=PRINCIPAL_CACHE_TTL_SECONDS)
 
 def create_access_token(data: dict):
     to_encode = data.copy() # Создаем КОПИЮ данных, чтобы не испортить оригинал
@@ -19,11 +27,37 @@ def create_access_token(data: dict):
 #     except jwt.JWTError:
 #         return None
 
-def decode_token(token: str):
+def decode_token_payload(token: str):
+    # -> (username, exp) или None | результат кэшируется до истечения токена
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        return username
     except Exception:
         return None
+    username = payload.get("sub")
+    expires_at = payload.get("exp")
+    if username is None or expires_at is None:
+        return None
+    token_cache.set(token, (username, expires_at), ttl=expires_at - time.time())
+    return username, expires_at
+
+def decode_token(token: str):
+    decoded = decode_token_payload(token)
+    return decoded[0] if decoded else None
+
+def cache_principal(username: str, principal: tuple, expires_at: float):
+    principal_cache.set(username, principal, ttl=expires_at - time.time()) # не дольше, чем живет токен
+
+def get_cached_principal(username: str):
+    return principal_cache.get(username)
+
+def invalidate_token(token: str):
+    # logout: забываем токен и закэшированного по нему пользователя
+    decoded = token_cache.pop(token)
+    if decoded is not None:
+        principal_cache.pop(decoded[0])
 
+def invalidate_principal(username: str):
+    principal_cache.pop(username)
@@ -0,0 +1,117 @@
+# 📡 Раздача живых цен подписчикам (SSE): один общий источник цен -> любое число клиентов
+# У каждого клиента ограниченная очередь: не больше одной ожидающей цены на символ.
+# Медленный клиент получает только последнюю цену, устаревшие заменяются (и считаются в dropped).
+import asyncio
+import json
+
+from config import STREAM_POLL_INTERVAL_SECONDS
+from crypto_service import get_crypto_prices_async, publish_polled_prices
+from market_data import price_table
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def portfolio_update(holdings: dict, prices: dict, changed) -> dict:
+    # Пересчет стоимости портфеля по последним ценам; в ответе только изменившиеся символы
+    total = sum(quantity * prices[symbol] for symbol, quantity in holdings.items() if symbol in prices)
+    return {
+        "assets": {
+            symbol: {"current_price": prices[symbol], "total_value": holdings[symbol] * prices[symbol]}
+            for symbol in changed if symbol in prices
+        },
+        "total_portfolio_value": total,
+        "total_portfolio_value_display": f"{total:,.2f}",
+    }
+
+
+class Subscription:
+    __slots__ = ("symbols", "_pending", "_event", "dropped")
+
+    def __init__(self, symbols):
+        self.symbols = frozenset(symbols)
+        self._pending = {}  # symbol -> последняя еще не отправленная цена
+        self._event = asyncio.Event()
+        self.dropped = 0
+
+    def offer(self, symbol: str, price: float):
+        if symbol in self._pending:
+            self.dropped += 1 # клиент не успел забрать прошлую цену - она уже устарела
+        self._pending[symbol] = price
+        self._event.set()
+
+    async def next_batch(self, timeout: float):
+        # -> {symbol: price} или {} по таймауту (для пинга)
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self._event.clear()
+        batch, self._pending = self._pending, {}
+        return batch
+
+
+class PriceBroadcaster:
+    def __init__(self, table, poll_interval: float):
+        self.table = table
+        self.poll_interval = poll_interval
+        self._by_symbol = {}  # symbol -> set(Subscription)
+        self._task = None
+        table.add_listener(self._on_tick)
+
+    def subscribe(self, symbols) -> Subscription:
+        subscription = Subscription(symbols)
+        for symbol in subscription.symbols:
+            self._by_symbol.setdefault(symbol, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for symbol in subscription.symbols:
+            subscribers = self._by_symbol.get(symbol)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._by_symbol[symbol]
+
+    def subscriber_count(self) -> int:
+        return len({subscription for subscribers in self._by_symbol.values() for subscription in subscribers})
+
+    def _on_tick(self, symbol: str, price: float, updated_at: float):
+        # O(подписчиков символа), без await - тик не ждет медленных клиентов
+        for subscription in self._by_symbol.get(symbol, ()):
+            subscription.offer(symbol, price)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _poll(self):
+        # Символы, которых нет в потоке рыночных данных, опрашиваются одним пакетным запросом на всех подписчиков
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            stale = []
+            for symbol in self._by_symbol:
+                staleness = self.table.staleness(symbol)
+                if staleness is None or staleness > self.poll_interval:
+                    stale.append(symbol)
+            if not stale:
+                continue
+            try:
+                prices = await get_crypto_prices_async(stale, max_age=self.poll_interval)
+            except Exception as e:
+                print(f"Price poll failed: {e}")
+                continue
+            publish_polled_prices(prices) # запись в таблицу разошлет цену подписчикам
+
+
+price_broadcaster = PriceBroadcaster(price_table, STREAM_POLL_INTERVAL_SECONDS)
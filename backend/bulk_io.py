@@ -0,0 +1,382 @@
+# 📦 Потоковый импорт/экспорт позиций (CSV / JSONL) для переноса счетов на платформу
+# Одна строка = одна позиция пользователя:
+#   username, email, password, available_money, total_added_money, symbol, quantity, price
+# Пользователь без активов - строка с пустым symbol. Деньги берутся из первой строки пользователя.
+# Пароль: хэш из экспорта переносится без изменений, открытый текст хэшируется scrypt при импорте (пачкой, в пуле потоков).
+# Импорт идет пачками по BULK_IO_CHUNK_SIZE строк: несколько executemany и один commit на пачку,
+# в памяти только текущая пачка. Строка с неизвестным символом или занятым email нового пользователя
+# не импортируется и попадает в отчет (rejected/errors), остальная пачка проходит. Экспорт листает таблицы по ключу (WHERE id > :last ORDER BY id LIMIT n).
+# Перенос с журналом: import positions.csv --no-ledger, затем import transactions.csv --kind transactions
+# (без --no-ledger импорт позиций пишет в журнал по одному deposit и buy на позицию).
+# Запуск: python bulk_io.py import positions.csv [--kind transactions] | python bulk_io.py export positions.jsonl [--kind transactions]
+import argparse
+import csv
+import json
+import sys
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import select, insert, update
+
+from config import BULK_IO_CHUNK_SIZE
+from models import User, Portfolio, Asset, AssetLot, Transaction
+from passwords import password_pool, is_hashed
+from storage import upsert
+from symbols import symbol_registry, normalize_symbol
+
+POSITION_FIELDS = ["username", "email", "password", "available_money", "total_added_money", "symbol", "quantity", "price"]
+TRANSACTION_FIELDS = ["id", "username", "transaction_type", "symbol", "quantity", "price", "timestamp"]
+TRANSACTION_TYPES = ("deposit", "buy", "sell")
+MAX_REPORTED_ERRORS = 100
+
+
+def read_records(stream, fmt: str):
+    # Построчное чтение: файл целиком в память не загружается
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def write_records(stream, fmt: str, fields: list, records):
+    if fmt == "csv":
+        writer = csv.DictWriter(stream, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(records)
+        return
+    for record in records:
+        stream.write(json.dumps(record, default=str) + "\n")
+
+
+def format_of(path: str) -> str:
+    return "csv" if path.endswith(".csv") else "jsonl"
+
+
+def _number(value) -> float:
+    return float(value) if value not in (None, "") else 0.0
+
+
+def parse_position(record: dict) -> dict:
+    symbol = normalize_symbol(record.get("symbol") or "") or None
+    if symbol is not None and not symbol_registry.is_known(symbol):
+        raise ValueError(f"Unknown symbol: {symbol}") # иначе мусорный символ потом ломал бы оценку портфеля
+    position = {
+        "username": record["username"],
+        "email": record["email"],
+        "password": record.get("password") or "",
+        "available_money": _number(record.get("available_money")),
+        "total_added_money": _number(record.get("total_added_money")),
+        "symbol": symbol,
+        "quantity": _number(record.get("quantity")),
+        "price": _number(record.get("price")),
+    }
+    if symbol is not None and position["quantity"] <= 0:
+        raise ValueError(f"Quantity must be positive: {record}")
+    return position
+
+
+def chunks(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _ensure_portfolios(connection, positions: list, ledger: bool = True) -> tuple:
+    # Новые пользователи и портфели - пакетными INSERT, существующие только находятся
+    # -> ({username: portfolio_id}, {username: причина отказа}) - email нового пользователя должен быть свободен, как при регистрации
+    users = {}
+    for position in positions:
+        users.setdefault(position["username"], position)
+
+    user_ids = dict(connection.execute(select(User.username, User.id).where(User.username.in_(users))).all())
+    new_users = [user for username, user in users.items() if username not in user_ids]
+
+    taken = set(connection.execute(select(User.email).where(User.email.in_({user["email"] for user in new_users}))).scalars())
+    rejected = {}
+    for user in new_users:
+        if user["email"] in taken:
+            rejected[user["username"]] = f"Email already registered: {user['email']}"
+        elif not user["password"]:
+            rejected[user["username"]] = "Empty password" # хэшировать нечего: такой аккаунт открывался бы пустым паролем
+        taken.add(user["email"]) # второй новый пользователь с тем же email в файле тоже отклоняется
+    if rejected:
+        new_users = [user for user in new_users if user["username"] not in rejected]
+        users = {username: user for username, user in users.items() if username not in rejected}
+    if new_users:
+        # Хэш из экспорта переносится как есть, открытый текст хэшируется до записи - вся пачка параллельно в пуле scrypt
+        plain = [user for user in new_users if not is_hashed(user["password"])]
+        hashed = dict(zip((user["username"] for user in plain), password_pool.hash_many([user["password"] for user in plain])))
+        connection.execute(insert(User), [
+            {"username": user["username"], "email": user["email"], "password": hashed.get(user["username"], user["password"])}
+            for user in new_users
+        ])
+        user_ids.update(connection.execute(
+            select(User.username, User.id).where(User.username.in_([user["username"] for user in new_users]))
+        ).all())
+
+    portfolio_of_user = dict(connection.execute(
+        select(Portfolio.user_id, Portfolio.id).where(Portfolio.user_id.in_(user_ids.values()))
+    ).all())
+    # Деньги из файла получают только создаваемые портфели - у существующих баланс не трогаем
+    new_portfolios = [user for username, user in users.items() if user_ids[username] not in portfolio_of_user]
+    if new_portfolios:
+        connection.execute(insert(Portfolio), [
+            {
+                "user_id": user_ids[user["username"]],
+                "available_money": user["available_money"],
+                "total_added_money": user["total_added_money"],
+                "version": 0,
+            }
+            for user in new_portfolios
+        ])
+        portfolio_of_user.update(connection.execute(
+            select(Portfolio.user_id, Portfolio.id)
+            .where(Portfolio.user_id.in_([user_ids[user["username"]] for user in new_portfolios]))
+        ).all())
+
+    portfolios = {username: portfolio_of_user[user_id] for username, user_id in user_ids.items()}
+    deposits = [
+        {"portfolio_id": portfolios[user["username"]], "transaction_type": "deposit", "symbol": None, "quantity": user["total_added_money"], "price": 1.0}
+        for user in new_portfolios if ledger and user["total_added_money"] > 0
+    ]
+    if deposits:
+        connection.execute(insert(Transaction), deposits)
+    return portfolios, rejected
+
+
+def _add_assets(connection, rows: list):
+    # rows: [{portfolio_id, symbol, quantity, cost_basis}] - по одной строке на (портфель, символ)
+    statement = upsert(connection.dialect.name, Asset, ["portfolio_id", "symbol"], lambda new: {
+        "quantity": Asset.quantity + new.quantity,
+        "cost_basis": Asset.cost_basis + new.cost_basis, # неизвестный (NULL) cost basis не превращается в 0
+    })
+    if statement is not None:
+        connection.execute(statement, rows)
+        return
+
+    keys = {(row["portfolio_id"], row["symbol"]) for row in rows}
+    portfolio_ids = {portfolio_id for portfolio_id, _ in keys}
+    existing = {
+        (portfolio_id, symbol)
+        for portfolio_id, symbol in connection.execute(
+            select(Asset.portfolio_id, Asset.symbol).where(Asset.portfolio_id.in_(portfolio_ids))
+        ).all()
+    } & keys
+    for row in rows:
+        if (row["portfolio_id"], row["symbol"]) in existing:
+            connection.execute(
+                update(Asset)
+                .where(Asset.portfolio_id == row["portfolio_id"], Asset.symbol == row["symbol"])
+                .values(quantity=Asset.quantity + row["quantity"], cost_basis=Asset.cost_basis + row["cost_basis"])
+            )
+    new_rows = [row for row in rows if (row["portfolio_id"], row["symbol"]) not in existing]
+    if new_rows:
+        connection.execute(insert(Asset), new_rows)
+
+
+def import_chunk(connection, positions: list, ledger: bool = True) -> int:
+    # ledger=False - журнал придет отдельным импортом (--kind transactions), синтетические deposit/buy не пишем
+    # -> (сколько позиций импортировано, {username: причина отказа})
+    portfolios, rejected = _ensure_portfolios(connection, positions, ledger)
+
+    bought = [position for position in positions if position["symbol"] is not None and position["username"] in portfolios]
+    if not bought:
+        return 0, rejected
+
+    assets = {}
+    lots = []
+    buys = []
+    for position in bought:
+        portfolio_id = portfolios[position["username"]]
+        symbol, quantity, price = position["symbol"], position["quantity"], position["price"]
+        asset = assets.setdefault((portfolio_id, symbol), {"portfolio_id": portfolio_id, "symbol": symbol, "quantity": 0.0, "cost_basis": 0.0})
+        asset["quantity"] += quantity
+        asset["cost_basis"] += quantity * price
+        lots.append({"portfolio_id": portfolio_id, "symbol": symbol, "quantity": quantity, "price": price})
+        buys.append({"portfolio_id": portfolio_id, "transaction_type": "buy", "symbol": symbol, "quantity": quantity, "price": price})
+
+    _add_assets(connection, list(assets.values()))
+    connection.execute(insert(AssetLot), lots)
+    if ledger:
+        connection.execute(insert(Transaction), buys)
+    # Изменились активы уже существующих портфелей - меняется их ETag
+    connection.execute(
+        update(Portfolio)
+        .where(Portfolio.id.in_({asset["portfolio_id"] for asset in assets.values()}))
+        .values(version=Portfolio.version + 1)
+    )
+    return len(bought), rejected
+
+
+def _reject(stats: dict, row: int, error: str):
+    # Плохая строка не останавливает импорт: считается и попадает в отчет (первые MAX_REPORTED_ERRORS)
+    stats["rejected"] += 1
+    if len(stats["errors"]) < MAX_REPORTED_ERRORS:
+        stats["errors"].append({"row": row, "error": error})
+
+
+def import_positions(engine, records, chunk_size: int = BULK_IO_CHUNK_SIZE, ledger: bool = True) -> dict:
+    stats = {"rows": 0, "positions": 0, "chunks": 0, "rejected": 0, "errors": []}
+    for chunk in chunks(records, chunk_size):
+        positions, rows, errors = [], [], []
+        for number, record in enumerate(chunk, start=stats["rows"] + 1):
+            try:
+                positions.append(parse_position(record))
+                rows.append(number)
+            except (KeyError, ValueError) as e:
+                errors.append((number, f"{type(e).__name__}: {e}"))
+        with engine.begin() as connection: # один commit на пачку
+            imported, rejected = import_chunk(connection, positions, ledger)
+        stats["positions"] += imported
+        errors.extend((number, rejected[position["username"]]) for number, position in zip(rows, positions) if position["username"] in rejected)
+        for number, error in sorted(errors):
+            _reject(stats, number, error)
+        stats["rows"] += len(chunk)
+        stats["chunks"] += 1
+    return stats
+
+
+def parse_transaction(record: dict) -> dict:
+    # Строка экспорта --kind transactions: время операции сохраняется исходное
+    transaction_type = record["transaction_type"]
+    if transaction_type not in TRANSACTION_TYPES:
+        raise ValueError(f"Unknown transaction type: {record}")
+    symbol = (record.get("symbol") or "").strip().upper() or None
+    if (symbol is None) != (transaction_type == "deposit"):
+        raise ValueError(f"Symbol is required for buy/sell and not allowed for deposit: {record}")
+    timestamp = record["timestamp"]
+    return {
+        "username": record["username"],
+        "transaction_type": transaction_type,
+        "symbol": symbol,
+        "quantity": _number(record.get("quantity")),
+        "price": _number(record.get("price")),
+        "timestamp": timestamp if isinstance(timestamp, datetime) else datetime.fromisoformat(timestamp),
+    }
+
+
+def import_transactions(engine, records, chunk_size: int = BULK_IO_CHUNK_SIZE) -> dict:
+    # Журнал после импорта позиций с --no-ledger: пользователь ищется по username, порядок и время операций - из файла.
+    # Позиции и балансы не пересчитываются - они пришли импортом позиций; строки неизвестных пользователей пропускаются
+    stats = {"rows": 0, "transactions": 0, "unknown_users": 0, "chunks": 0}
+    for chunk in chunks(records, chunk_size):
+        parsed = [parse_transaction(record) for record in chunk]
+        with engine.begin() as connection:
+            portfolios = dict(connection.execute(
+                select(User.username, Portfolio.id)
+                .join(Portfolio, Portfolio.user_id == User.id)
+                .where(User.username.in_({transaction["username"] for transaction in parsed}))
+            ).all())
+            rows = [
+                {**{key: value for key, value in transaction.items() if key != "username"}, "portfolio_id": portfolios[transaction["username"]]}
+                for transaction in parsed if transaction["username"] in portfolios
+            ]
+            if rows:
+                connection.execute(insert(Transaction), rows)
+        stats["rows"] += len(chunk)
+        stats["transactions"] += len(rows)
+        stats["unknown_users"] += len(parsed) - len(rows)
+        stats["chunks"] += 1
+    return stats
+
+
+def iter_positions(engine, page_size: int = BULK_IO_CHUNK_SIZE):
+    # Keyset пагинация по портфелям: каждая страница - один запрос с WHERE portfolio.id > :last, без OFFSET
+    last_id = 0
+    while True:
+        with engine.connect() as connection:
+            page = connection.execute(
+                select(Portfolio.id, User.username, User.email, User.password, Portfolio.available_money, Portfolio.total_added_money)
+                .join(User, User.id == Portfolio.user_id)
+                .where(Portfolio.id > last_id)
+                .order_by(Portfolio.id)
+                .limit(page_size)
+            ).all()
+            if not page:
+                return
+            assets = {}
+            for portfolio_id, symbol, quantity, cost_basis in connection.execute(
+                select(Asset.portfolio_id, Asset.symbol, Asset.quantity, Asset.cost_basis)
+                .where(Asset.portfolio_id.in_([row[0] for row in page]))
+                .order_by(Asset.portfolio_id, Asset.symbol)
+            ):
+                assets.setdefault(portfolio_id, []).append((symbol, quantity, cost_basis))
+
+        for portfolio_id, username, email, password, available_money, total_added_money in page:
+            user = {
+                "username": username,
+                "email": email,
+                "password": password,
+                "available_money": available_money or 0.0,
+                "total_added_money": total_added_money or 0.0,
+            }
+            held = assets.get(portfolio_id)
+            if not held:
+                yield {**user, "symbol": "", "quantity": 0.0, "price": 0.0}
+                continue
+            for symbol, quantity, cost_basis in held:
+                # Цена позиции = средняя цена покупки, повторный импорт дает тот же cost basis
+                yield {**user, "symbol": symbol, "quantity": quantity, "price": (cost_basis or 0.0) / quantity if quantity else 0.0}
+        last_id = page[-1][0]
+
+
+def iter_transactions(engine, page_size: int = BULK_IO_CHUNK_SIZE):
+    last_id = 0
+    while True:
+        with engine.connect() as connection:
+            page = connection.execute(
+                select(Transaction.id, User.username, Transaction.transaction_type, Transaction.symbol,
+                       Transaction.quantity, Transaction.price, Transaction.timestamp)
+                .join(Portfolio, Portfolio.id == Transaction.portfolio_id)
+                .join(User, User.id == Portfolio.user_id)
+                .where(Transaction.id > last_id)
+                .order_by(Transaction.id)
+                .limit(page_size)
+            ).all()
+        if not page:
+            return
+        for row in page:
+            yield dict(zip(TRANSACTION_FIELDS, row))
+        last_id = page[-1][0]
+
+
+EXPORTS = {
+    "positions": (iter_positions, POSITION_FIELDS),
+    "transactions": (iter_transactions, TRANSACTION_FIELDS),
+}
+IMPORTS = {
+    "positions": import_positions,
+    "transactions": import_transactions,
+}
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    symbol_registry.load_snapshot() # символы проверяются по снимку exchangeInfo, сеть не нужна
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("path", help="файл .csv или .jsonl, '-' - stdin/stdout (JSONL)")
+    parser.add_argument("--kind", choices=list(EXPORTS), default="positions", help="что импортировать / экспортировать")
+    parser.add_argument("--chunk-size", type=int, default=BULK_IO_CHUNK_SIZE)
+    parser.add_argument("--no-ledger", action="store_true", help="импорт позиций без синтетических deposit/buy в журнале")
+    args = parser.parse_args()
+
+    fmt = format_of(args.path)
+    if args.command == "import":
+        stream = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+        options = {"ledger": not args.no_ledger} if args.kind == "positions" else {}
+        with stream:
+            print(IMPORTS[args.kind](engine, read_records(stream, fmt), args.chunk_size, **options), file=sys.stderr)
+    else:
+        iterate, fields = EXPORTS[args.kind]
+        stream = sys.stdout if args.path == "-" else open(args.path, "w", newline="", encoding="utf-8")
+        with stream:
+            write_records(stream, fmt, fields, iterate(engine, args.chunk_size))
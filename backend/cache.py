@@ -0,0 +1,249 @@
+# Кэши в памяти процесса
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    # Потокобезопасный кэш: у каждой записи свой срок жизни, при переполнении вытесняется самая давно использованная
+    def __init__(self, max_size: int, default_ttl: float):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.default_ttl if ttl is None else min(ttl, self.default_ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _Flight:
+    # Один запрос к источнику, результат которого ждут все параллельные промахи по символу
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class PriceCache:
+    # Кэш цен: TTL по символу, ограниченный размер, single-flight и отдача устаревшей цены в grace-окне
+    def __init__(self, default_ttl: float, max_size: int, stale_grace: float, symbol_ttls: dict = None):
+        self.default_ttl = default_ttl
+        self.max_size = max_size
+        self.stale_grace = stale_grace
+        self.symbol_ttls = dict(symbol_ttls or {})
+        self._entries = OrderedDict()  # symbol -> (price, fetched_at)
+        self._in_flight = {}  # symbol -> _Flight (потоки)
+        self._in_flight_async = {}  # symbol -> asyncio.Future (event loop)
+        self._loads = set()  # идущие задачи загрузки (event loop)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_serves = 0
+
+    def ttl_for(self, symbol: str) -> float:
+        return self.symbol_ttls.get(symbol, self.default_ttl)
+
+    def _lookup(self, symbol: str, now: float):
+        # -> (price, is_fresh) | None ; вызывать под self._lock
+        entry = self._entries.get(symbol)
+        if entry is None:
+            return None
+        price, fetched_at = entry
+        age = now - fetched_at
+        ttl = self.ttl_for(symbol)
+        if age <= ttl:
+            self._entries.move_to_end(symbol)
+            return price, True
+        if age <= ttl + self.stale_grace:
+            return price, False
+        return None
+
+    def _store(self, symbol: str, price: float, now: float):
+        # вызывать под self._lock
+        self._entries[symbol] = (price, now)
+        self._entries.move_to_end(symbol)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def put(self, symbol: str, price: float):
+        with self._lock:
+            self._store(symbol, price, time.monotonic())
+
+    def _claim(self, symbols, flights: dict, new_flight):
+        # Разбирает символы на: готовые цены, свои промахи (мы идем к источнику) и чужие (ждем другой запрос)
+        result = {}
+        own = {}
+        waiting = {}
+        with self._lock:
+            now = time.monotonic()
+            for symbol in dict.fromkeys(symbols):
+                cached = self._lookup(symbol, now)
+                if cached is not None and cached[1]:
+                    self.hits += 1
+                    result[symbol] = cached[0]
+                    continue
+                flight = self._in_flight.get(symbol) or self._in_flight_async.get(symbol)
+                if flight is not None and cached is not None:
+                    # Обновление уже идет - отдаем последнюю известную цену, пока она в grace-окне
+                    self.stale_serves += 1
+                    result[symbol] = cached[0]
+                    continue
+                self.misses += 1
+                flight = flights.get(symbol)
+                if flight is None:
+                    flight = flights[symbol] = new_flight()
+                    own[symbol] = flight
+                else:
+                    waiting[symbol] = flight
+        return result, own, waiting
+
+    def _store_loaded(self, own: dict, prices: dict, flights: dict) -> list:
+        # Найденные цены - в кэш, полеты снимаются со всех символов пачки -> символы, которых источник не вернул
+        with self._lock:
+            now = time.monotonic()
+            for symbol in own:
+                flights.pop(symbol, None)
+                if symbol in prices:
+                    self._store(symbol, prices[symbol], now)
+        return [symbol for symbol in own if symbol not in prices]
+
+    def get_or_load(self, symbol: str, loader) -> float:
+        # loader(symbol) -> float вызывается только одним потоком на символ, остальные ждут его результат
+        return self.get_many_or_load([symbol], lambda symbols: {symbol: loader(symbol)})[symbol]
+
+    def get_many_or_load(self, symbols, loader_many) -> dict:
+        # loader_many(list[symbol]) -> {symbol: price} - все промахи одной пачкой, один запрос к источнику
+        result, own, waiting = self._claim(symbols, self._in_flight, _Flight)
+
+        missing = []
+        if own:
+            try:
+                prices = loader_many(list(own))
+                missing = self._store_loaded(own, prices, self._in_flight)
+                # Частичный промах: ожидающие найденных символов получают цену, KeyError - только ожидающие недостающих
+                for symbol, flight in own.items():
+                    if symbol in prices:
+                        flight.value = result[symbol] = prices[symbol]
+                    else:
+                        flight.error = KeyError(f"No price for {symbol}")
+            except Exception as e:
+                with self._lock:
+                    for symbol in own:
+                        self._in_flight.pop(symbol, None)
+                for flight in own.values():
+                    flight.error = e
+                raise
+            finally:
+                for flight in own.values():
+                    flight.event.set()
+
+        for symbol, flight in waiting.items():
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            result[symbol] = flight.value
+        if missing:
+            raise KeyError(f"No price for {', '.join(missing)}")
+        return result
+
+    async def get_many_or_load_async(self, symbols, loader_many) -> dict:
+        # То же самое для event loop: await loader_many(list[symbol]), ожидание через asyncio.Future без блокировки потока
+        # Загрузка идет отдельной задачей: отмена запроса, который ее начал, не отменяет ее для остальных ожидающих
+        loop = asyncio.get_running_loop()
+        result, own, waiting = self._claim(symbols, self._in_flight_async, loop.create_future)
+
+        if own:
+            load = asyncio.ensure_future(self._load_async(own, loader_many))
+            self._loads.add(load) # event loop держит задачи по слабой ссылке
+            load.add_done_callback(self._loads.discard)
+            waiting.update(own)
+
+        for symbol, future in waiting.items():
+            result[symbol] = await asyncio.shield(future)
+        return result
+
+    async def _load_async(self, own: dict, loader_many):
+        try:
+            prices = await loader_many(list(own))
+            self._store_loaded(own, prices, self._in_flight_async)
+            for symbol, future in own.items():
+                if symbol in prices:
+                    future.set_result(prices[symbol])
+                else:
+                    future.set_exception(KeyError(f"No price for {symbol}"))
+                    future.exception()  # помечаем как полученное, если никто не ждал
+        except BaseException as e:
+            with self._lock:
+                for symbol in own:
+                    self._in_flight_async.pop(symbol, None)
+            for future in own.values():
+                if future.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel() # отменили саму загрузку (остановка event loop)
+                else:
+                    future.set_exception(e)
+                    future.exception()  # помечаем как полученное, если никто не ждал
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            # Ошибка доставлена ожидающим через future - из задачи не поднимаем
+
+    def fetched_at(self, symbol: str):
+        # -> (цена, time.time() получения) последнего ответа источника или None
+        with self._lock:
+            entry = self._entries.get(symbol)
+        if entry is None:
+            return None
+        price, fetched_at = entry
+        return price, time.time() - (time.monotonic() - fetched_at)
+
+    def invalidate(self, symbol: str = None):
+        with self._lock:
+            if symbol is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(symbol, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_serves": self.stale_serves,
+                "in_flight": len(self._in_flight) + len(self._in_flight_async),
+            }
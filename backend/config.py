@@ -1,4 +1,90 @@
+import os
+
 # Настройки JWT токена
 SECRET_KEY = 'your-super-secret-key-here-make-it-very-long'
 ALGORITHM = 'HS256'
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
\ No newline at end of file
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+
+# Настройки кэша цен
+PRICE_CACHE_TTL_SECONDS = 5 # сколько секунд цена считается свежей
+PRICE_CACHE_SYMBOL_TTLS = {} # индивидуальный TTL для отдельных символов, например {"BTC": 2}
+PRICE_CACHE_MAX_SIZE = 1024 # сколько символов держим в памяти
+PRICE_CACHE_STALE_GRACE_SECONDS = 10 # сколько можно отдавать старую цену, пока идет обновление
+
+# Настройки клиента Binance API
+BINANCE_API_URL = os.getenv("BINANCE_API_URL", "https://api.binance.com") # можно направить на локальную заглушку для тестов
+PRICE_HTTP_TIMEOUT_SECONDS = 5 # таймаут одного запроса цены
+PRICE_HTTP_MAX_CONNECTIONS = 20 # размер пула keep-alive соединений
+PRICE_HTTP_MAX_CONCURRENCY = 10 # сколько запросов к Binance одновременно в полете
+
+# Поток рыночных данных: "binance" - websocket Binance, "file:путь.jsonl" - проигрывание файла, "" - выключен
+MARKET_FEED = os.getenv("MARKET_FEED", "")
+MARKET_FEED_WS_URL = os.getenv("MARKET_FEED_WS_URL", "wss://stream.binance.com:9443/ws/!miniTicker@arr")
+MARKET_FEED_REPLAY_INTERVAL_SECONDS = 1 # пауза между строками файла, если в них нет времени
+MARKET_PRICE_MAX_AGE_SECONDS = 10 # цена из потока старше этого считается устаревшей
+
+# Общая доска цен для нескольких воркеров uvicorn (shared memory): имя сегмента, "" - выключена (один процесс)
+PRICE_BOARD_NAME = os.getenv("PRICE_BOARD_NAME", "")
+PRICE_BOARD_SLOTS = int(os.getenv("PRICE_BOARD_SLOTS", "1024")) # сколько символов помещается на доску
+PRICE_BOARD_REFRESH_SECONDS = 1 # как часто писатель обновляет запрошенные символы
+PRICE_BOARD_WANT_TTL_SECONDS = 60 # символ обновляется, пока его запрашивали не раньше этого
+PRICE_BOARD_RENEW_SECONDS = 15 # как часто воркер, читающий символ с доски, продлевает запрос (меньше TTL выше)
+
+# Реестр символов: снимок exchangeInfo Binance на диске (работает без сети), обновляется в фоне
+SYMBOL_SEED_SNAPSHOT_PATH = "./exchange_info.json" # снимок из репозитория, только читается
+SYMBOL_SNAPSHOT_PATH = os.getenv("SYMBOL_SNAPSHOT_PATH", "./exchange_info.runtime.json") # пишет фоновое обновление, не в git
+SYMBOL_QUOTE_ASSET = "USDT" # цены берутся в паре {symbol}USDT
+SYMBOL_REFRESH_SECONDS = 3600
+SYMBOL_NEGATIVE_TTL_SECONDS = 600 # сколько помнить символ, который Binance не знает
+SYMBOL_NEGATIVE_CACHE_MAX_SIZE = 10000
+
+# Кэш аутентификации (TTL никогда не превышает оставшееся время жизни токена)
+TOKEN_CACHE_MAX_SIZE = 10000 # расшифрованные токены
+PRINCIPAL_CACHE_MAX_SIZE = 10000 # пользователи, прошедшие проверку
+PRINCIPAL_CACHE_TTL_SECONDS = 300
+
+# Хранилище: URL базы из окружения (sqlite:///..., postgresql://..., mysql://...)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10")) # постоянные соединения в пуле
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20")) # сколько можно открыть сверх пула при пиковой нагрузке
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800")) # пересоздаем соединения старше этого (серверные БД рвут простаивающие)
+DB_POOL_TIMEOUT_SECONDS = int(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30")) # сколько ждать свободное соединение
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")) # кэш страниц SQLite (64 МБ)
+SQLITE_MMAP_SIZE_BYTES = int(os.getenv("SQLITE_MMAP_SIZE_BYTES", str(256 * 1024 * 1024))) # чтение файла БД через mmap
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")) # ждать блокировку, а не падать с "database is locked"
+
+# Журнал сделок: строка пишется в транзакции сделки, долговечность - один fsync WAL на пачку сделок (group commit)
+LEDGER_MAX_BATCH = 256 # максимум сделок на один fsync
+LEDGER_MAX_FLUSH_LATENCY_MS = 5 # сколько максимум ждем попутчиков для пачки
+
+# История стоимости портфелей: снимок раз в SNAPSHOT_INTERVAL_SECONDS, сразу сворачивается в минуты/часы/дни
+SNAPSHOT_INTERVAL_SECONDS = 60
+SNAPSHOT_RETENTION_SECONDS = {60: 2 * 86400, 3600: 90 * 86400, 86400: None} # сколько хранить каждое разрешение (None - всегда)
+
+# ETag для /api/portfolio: цены внутри одной эпохи считаются одинаковыми
+PRICE_EPOCH_SECONDS = PRICE_CACHE_TTL_SECONDS
+PORTFOLIO_RESPONSE_CACHE_SIZE = 10000 # готовые JSON ответы по ETag
+
+# Server-Sent Events: живые цены и стоимость портфеля
+SSE_HEARTBEAT_SECONDS = 15 # комментарий-пинг, чтобы прокси не закрывали соединение
+STREAM_POLL_INTERVAL_SECONDS = 2 # как часто опрашивать Binance за символы, которых нет в потоке рыночных данных
+
+# Пакетные ордера
+BATCH_ORDER_MAX_LEGS = 100
+
+# Потоковый импорт/экспорт позиций (bulk_io.py)
+BULK_IO_CHUNK_SIZE = 5000 # строк в одной транзакции импорта / на странице экспорта
+
+# Рейтинг портфелей
+LEADERBOARD_MAX_SIZE = 100 # сколько мест можно запросить за раз
+LEADERBOARD_REBUILD_SECONDS = 300 # полный пересчет - учитывает изменения в обход API (скрипты, bulk импорт)
+
+# Отложенные limit/stop ордера
+ORDER_EXECUTION_WORKERS = 4 # параллельных исполнителей сработавших ордеров
+
+# Хэширование паролей (scrypt): n - стоимость по CPU и памяти (128 * n * r байт), пул потоков и лимит очереди
+PASSWORD_SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 14))) # 16 МБ памяти на хэш
+PASSWORD_SCRYPT_R = 8
+PASSWORD_SCRYPT_P = 1
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 4)))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64")) # сверх этого вход/регистрация сразу получают 503
@@ -6,8 +6,13 @@ from sqlalchemy.testing.suite.test_reflection import users
 
 from models import User, Portfolio, Asset, Transaction
 from schemas import UserCreate, AddMoney, TradeAsset
-from crypto_service import get_crypto_price
+from crypto_service import get_crypto_prices
+from valuation import build_portfolio_valuation
+import trades
+from pnl import fifo_consume
 #from auth import verify_token
+from auth import invalidate_principal
+from passwords import hash_password, verify_password
 
 
 class UserCRUD:
@@ -15,9 +20,15 @@ class UserCRUD:
     @staticmethod
     def log_in_user(db: Session, username: str, password: str):
         user = db.query(User).filter(User.username == username).first()
-        if user and user.password == password:
-            return user
-        return None
+        if user is None:
+            return None
+        ok, needs_rehash = verify_password(password, user.password)
+        if not ok:
+            return None
+        if needs_rehash:
+            user.password = hash_password(password)
+            db.commit()
+        return user
 
     @staticmethod
     def get_user(db: Session, user_id: int):
@@ -34,6 +45,7 @@ class UserCRUD:
             raise HTTPException(status_code=404, detail="User not found")
         db.delete(user)
         db.commit()
+        invalidate_principal(user.username) # удаленный пользователь не должен проходить check_auth из кэша
         return {"message": "User deleted successfully"}
 
     @staticmethod
@@ -52,7 +64,7 @@ class UserCRUD:
         new_user = User(
             username=user.username,
             email=user.email,
-            password=user.password
+            password=hash_password(user.password)
         )
         db.add(new_user)
         db.commit()
@@ -79,123 +91,99 @@ class PortfolioCRUD:
         return db.query(Portfolio).filter(Portfolio.user_id == user_id).first()
 
     @staticmethod
-    def get_user_portfolio_data(db: Session, user_id: int):
-
-        portfolio = db.query(Portfolio).filter(Portfolio.user_id == user_id).first() #из таблицы portfolio Отфильтруй только те записи, где user_id равен переданному user_id
-        if not portfolio:
-            return {"portfolio": None, "assets": [], "total_portfolio_value": 0}
-
-
-        assets = db.query(Asset).filter(Asset.portfolio_id == portfolio.id).all()  #Отфильтруй активы, которые принадлежат найденному портфелю
-
-        # Создаем список активов с дополнительными данными
-        asset_with_data = []
-
-        for asset in assets:
-            current_price = get_crypto_price(asset.symbol)
-            total_value = asset.quantity * current_price
+    def get_portfolio_valuation(db: Session, user_id: int):
+        # Портфель и активы одним запросом (outer join), все цены одним запросом - дальше шаблон читает только снимок
+        rows = (
+            db.query(Portfolio, Asset)
+            .outerjoin(Asset, Asset.portfolio_id == Portfolio.id)
+            .filter(Portfolio.user_id == user_id)
+            .all()
+        )
+        if not rows:
+            return None
 
-            asset_with_data.append({
-                "symbol": asset.symbol,
-                "quantity": asset.quantity,
-                "current_price": current_price,
-                "total_value": total_value,
-                "performance_usd":  "****",
-                "performance_percent":  "****"
-            })
+        portfolio = rows[0][0]
+        assets = [asset for _, asset in rows if asset is not None]
 
+        prices = get_crypto_prices([asset.symbol for asset in assets]) # Все цены одним запросом к Binance
 
-        return {
-            "portfolio": portfolio,
-            "assets": asset_with_data
-        }
+        return build_portfolio_valuation(portfolio, assets, prices)
 
     @staticmethod
     def add_money_to_portfolio(db: Session, user_id: int, amount: float):
 
-        portfolio = db.query(Portfolio).filter(Portfolio.user_id == user_id).first()
-        if not portfolio:
+        # Одна команда UPDATE: параллельная сделка не перезапишется, версия (ETag в /api/portfolio) растет атомарно
+        deposited = trades.deposit(db, user_id, amount)
+        if deposited is None:
+            db.rollback()
             return None
 
-        portfolio.total_added_money += amount
-        portfolio.available_money += amount
+        portfolio_id, _ = deposited
+        db.add(Transaction(portfolio_id=portfolio_id, transaction_type="deposit", symbol=None, quantity=amount, price=1.0))
 
         db.commit()
-        db.refresh(portfolio)
 
-        return portfolio
+        return db.get(Portfolio, portfolio_id)
 
 
     @staticmethod
     def buy_asset(db: Session, user_id: int, symbol: str, quantity: float, price: float):
-        portfolio = db.query(Portfolio).filter(Portfolio.user_id == user_id).first()
-        if not portfolio:
-            raise HTTPException(status_code=404, detail="Portfolio not found")
-
-        # Проверяем достаточно ли денег
+        # Списание денег с проверкой баланса и зачисление актива - в одной короткой транзакции, без refresh
+        if quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be positive")
         total_cost = quantity * price
-        if portfolio.available_money < total_cost:
+        debited = trades.debit(db, user_id, total_cost)
+        if debited is None:
+            db.rollback()
+            if db.execute(trades.portfolio_exists(user_id)).first() is None:
+                raise HTTPException(status_code=404, detail="Portfolio not found")
             raise HTTPException(status_code=400, detail="Not enough money")
 
-        # Ищем существующий актив
-        existing_asset = db.query(Asset).filter(Asset.portfolio_id == portfolio.id, Asset.symbol == symbol).first()
+        portfolio_id, _ = debited
+        upsert = trades.upsert_asset(db.get_bind().dialect.name, portfolio_id, symbol, quantity, total_cost)
+        if upsert is not None:
+            db.execute(upsert)
+        elif db.execute(trades.add_quantity(portfolio_id, symbol, quantity, total_cost)).rowcount == 0:
+            db.execute(trades.insert_asset(portfolio_id, symbol, quantity, total_cost))
+        db.execute(trades.insert_lot(portfolio_id, symbol, quantity, price)) # новый FIFO лот
 
-        if existing_asset:
-            print("Asset already exists")
-            existing_asset.quantity += quantity
-        else:
-            print("Creating new asset")
-            new_asset = Asset(
-                portfolio_id=portfolio.id,
-                symbol=symbol,
-                quantity=quantity
-            )
-            db.add(new_asset)
-
-        # Списываем деньги
-        portfolio.available_money -= total_cost
-
-        # Создаем запись о транзакции
-        # transaction = Transaction(
-        #     portfolio_id=portfolio.id,
-        #     transaction_type = "buy",
-        #     symbol=symbol,
-        #     quantity=quantity,
-        #     price=price,
-        #     date= "01.01.01"
-        #     )
-        # db.add(transaction)
+        # Создаем запись о транзакции (в той же транзакции, что и сделка)
+        db.add(Transaction(portfolio_id=portfolio_id, transaction_type="buy", symbol=symbol, quantity=quantity, price=price))
         db.commit()
-        db.refresh(portfolio)
 
         return {"message": "Asset bought successfully"}
 
 
     @staticmethod
-    def sell_asset(db: Session, user_id: int, symbol: str, quantity: float):
-        portfolio = db.query(Portfolio).filter(Portfolio.user_id == user_id).first()
-        if not portfolio:
+    def sell_asset(db: Session, user_id: int, symbol: str, quantity: float, price: float):
+        # Списание количества с проверкой остатка и зачисление денег - в одной короткой транзакции, без refresh
+        if quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be positive")
+        credited = trades.credit(db, user_id, price * quantity) # сначала строка портфеля, как в покупке
+        if credited is None:
+            db.rollback()
             raise HTTPException(status_code=404, detail="Portfolio not found")
 
-        asset = db.query(Asset).filter(Asset.portfolio_id == portfolio.id, Asset.symbol == symbol).first()
-        asset_quantity = asset.quantity
-
-        if asset_quantity < quantity:
+        portfolio_id, _ = credited
+        row = trades.take(db, portfolio_id, symbol, quantity)
+        if row is None:
+            db.rollback() # откатывает и зачисление денег
             raise HTTPException(status_code=400, detail="Not enough asset quantity")
 
-
-        value = get_crypto_price(symbol) * quantity
-        portfolio.available_money += value
-        asset.quantity -= quantity
-
-        if asset.quantity == 0:
-            db.delete(asset)
+        asset_id, remaining = row
+        if remaining <= 0:
+            db.execute(trades.delete_asset(asset_id))
+            db.execute(trades.delete_all_lots(portfolio_id, symbol))
+        else:
+            # Закрываем FIFO лоты от самого старого к новому
+            lots = db.execute(trades.open_lots(portfolio_id, symbol)).all()
+            closed, partial, _ = fifo_consume(lots, quantity)
+            if closed:
+                db.execute(trades.delete_lots(closed))
+            if partial:
+                db.execute(trades.set_lot_quantity(*partial))
+        db.add(Transaction(portfolio_id=portfolio_id, transaction_type="sell", symbol=symbol, quantity=quantity, price=price))
 
         db.commit()
-        db.refresh(portfolio)
 
         return {"message": "Asset sold successfully"}
-
-
-
-
@@ -0,0 +1,335 @@
+#⚡ Асинхронные операции с БД (AsyncSession) - для async эндпоинтов, чтобы запросы не блокировали event loop
+# Синхронные версии в crud.py остаются для скриптов
+
+from datetime import datetime
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import HTTPException
+
+from models import User, Portfolio, Asset, Order
+from schemas import UserCreate, OrderCreate
+from crypto_service import get_crypto_prices_async
+from valuation import build_portfolio_valuation
+import trades
+from pnl import fifo_consume
+from ledger import ledger_sync, ledger_entry
+from leaderboard import leaderboard
+from auth import invalidate_principal
+from passwords import password_pool
+
+
+class AsyncUserCRUD:
+
+    @staticmethod
+    async def log_in_user(db: AsyncSession, username: str, password: str):
+        user = await db.scalar(select(User).where(User.username == username))
+        # scrypt в пуле потоков, event loop не блокируется; при переполненном пуле - HTTPException 503
+        ok, needs_rehash = await password_pool.verify(password, user.password if user else None)
+        if not ok:
+            return None
+        if needs_rehash: # старый пароль открытым текстом (или старые параметры scrypt) - сохраняем новый хэш
+            user.password = await password_pool.hash(password)
+            await db.commit()
+        return user
+
+    @staticmethod
+    async def get_user(db: AsyncSession, user_id: int):
+        return await db.scalar(select(User).where(User.id == user_id))
+
+    @staticmethod
+    async def get_user_by_username(db: AsyncSession, username: str):
+        return await db.scalar(select(User).where(User.username == username))
+
+    @staticmethod
+    async def get_user_by_email(db: AsyncSession, email: str):
+        return await db.scalar(select(User).where(User.email == email))
+
+    @staticmethod
+    async def delete_user(db: AsyncSession, user_id: int):
+        user = await db.scalar(select(User).where(User.id == user_id))
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        await db.delete(user)
+        await db.commit()
+        invalidate_principal(user.username) # удаленный пользователь не должен проходить check_auth из кэша
+        return {"message": "User deleted successfully"}
+
+    @staticmethod
+    async def get_all_users(db: AsyncSession):
+        return (await db.scalars(select(User))).all()
+
+    @staticmethod
+    async def create_user(db: AsyncSession, user: UserCreate):
+
+        existing_user = await db.scalar(select(User).where(User.email == user.email))
+        if existing_user:
+            print("User already exists")
+            return None # <- используем None для обработки return RedirectResponse в основном коде
+
+        # Создаем пользователя
+        new_user = User(
+            username=user.username,
+            email=user.email,
+            password=await password_pool.hash(user.password)
+        )
+        db.add(new_user)
+        await db.flush() # получаем new_user.id без отдельного commit
+
+        # Создаем портфель для пользователя
+        db.add(Portfolio(
+            user_id=new_user.id,
+            total_added_money=0,
+            available_money=0
+        ))
+        await db.commit()
+
+        print("User created successfully")
+        return new_user
+
+
+class AsyncPortfolioCRUD:
+
+    @staticmethod
+    async def get_portfolio_by_userd_id(db: AsyncSession, user_id: int):
+        return await db.scalar(select(Portfolio).where(Portfolio.user_id == user_id))
+
+    @staticmethod
+    async def get_portfolio_version(db: AsyncSession, user_id: int):
+        # Дешевая проверка для ETag: -> (portfolio_id, version) или None
+        return (await db.execute(select(Portfolio.id, Portfolio.version).where(Portfolio.user_id == user_id))).first()
+
+    @staticmethod
+    async def get_holdings(db: AsyncSession, user_id: int) -> dict:
+        # -> {symbol: quantity} одним запросом
+        rows = await db.execute(
+            select(Asset.symbol, Asset.quantity)
+            .join(Portfolio, Portfolio.id == Asset.portfolio_id)
+            .where(Portfolio.user_id == user_id)
+        )
+        return {symbol: quantity for symbol, quantity in rows}
+
+    @staticmethod
+    async def get_portfolio_valuation(db: AsyncSession, user_id: int):
+        # Портфель и активы одним запросом (outer join), все цены одним запросом - дальше шаблон читает только снимок
+        rows = (await db.execute(
+            select(Portfolio, Asset)
+            .outerjoin(Asset, Asset.portfolio_id == Portfolio.id)
+            .where(Portfolio.user_id == user_id)
+        )).all()
+        if not rows:
+            return None
+
+        portfolio = rows[0][0]
+        assets = [asset for _, asset in rows if asset is not None]
+
+        prices = await get_crypto_prices_async([asset.symbol for asset in assets]) # Все цены одним запросом к Binance, не блокируя event loop
+
+        return build_portfolio_valuation(portfolio, assets, prices)
+
+    @staticmethod
+    async def add_money_to_portfolio(db: AsyncSession, user_id: int, amount: float):
+
+        # Одна команда UPDATE: параллельная сделка не перезапишется, версия (ETag в /api/portfolio) растет атомарно
+        deposited = await db.run_sync(trades.deposit, user_id, amount)
+        if deposited is None:
+            await db.rollback()
+            return None
+
+        portfolio_id, version = deposited
+        await db.execute(ledger_entry(portfolio_id, "deposit", None, amount, 1.0)) # журнал - в той же транзакции
+
+        await db.commit()
+        leaderboard.on_trade(portfolio_id, version, cash=amount)
+        await ledger_sync.wait() # ответ только после того, как commit долговечен
+
+        return {"message": "Money added successfully"}
+
+    @staticmethod
+    async def _execute_buy(db: AsyncSession, user_id: int, symbol: str, quantity: float, price: float) -> tuple:
+        # Шаги покупки внутри текущей транзакции, без commit -> (portfolio_id, новая версия портфеля). При отказе транзакция откатывается
+        if quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be positive")
+        total_cost = quantity * price
+        debited = await db.run_sync(trades.debit, user_id, total_cost)
+        if debited is None:
+            await db.rollback()
+            if (await db.execute(trades.portfolio_exists(user_id))).first() is None:
+                raise HTTPException(status_code=404, detail="Portfolio not found")
+            raise HTTPException(status_code=400, detail="Not enough money")
+
+        portfolio_id, version = debited
+        upsert = trades.upsert_asset(db.get_bind().dialect.name, portfolio_id, symbol, quantity, total_cost)
+        if upsert is not None:
+            await db.execute(upsert)
+        elif (await db.execute(trades.add_quantity(portfolio_id, symbol, quantity, total_cost))).rowcount == 0:
+            await db.execute(trades.insert_asset(portfolio_id, symbol, quantity, total_cost))
+        await db.execute(trades.insert_lot(portfolio_id, symbol, quantity, price)) # новый FIFO лот
+        await db.execute(ledger_entry(portfolio_id, "buy", symbol, quantity, price)) # журнал фиксируется вместе со сделкой
+        return portfolio_id, version
+
+    @staticmethod
+    async def _execute_sell(db: AsyncSession, user_id: int, symbol: str, quantity: float, price: float) -> tuple:
+        # Шаги продажи внутри текущей транзакции, без commit -> (portfolio_id, новая версия портфеля). При отказе транзакция откатывается
+        if quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be positive")
+        credited = await db.run_sync(trades.credit, user_id, price * quantity) # сначала строка портфеля, как в покупке
+        if credited is None:
+            await db.rollback()
+            raise HTTPException(status_code=404, detail="Portfolio not found")
+
+        portfolio_id, version = credited
+        row = await db.run_sync(trades.take, portfolio_id, symbol, quantity)
+        if row is None:
+            await db.rollback() # откатывает и зачисление денег
+            raise HTTPException(status_code=400, detail="Not enough asset quantity")
+
+        asset_id, remaining = row
+        if remaining <= 0:
+            await db.execute(trades.delete_asset(asset_id))
+            await db.execute(trades.delete_all_lots(portfolio_id, symbol))
+        else:
+            # Закрываем FIFO лоты от самого старого к новому
+            lots = (await db.execute(trades.open_lots(portfolio_id, symbol))).all()
+            closed, partial, _ = fifo_consume(lots, quantity)
+            if closed:
+                await db.execute(trades.delete_lots(closed))
+            if partial:
+                await db.execute(trades.set_lot_quantity(*partial))
+        await db.execute(ledger_entry(portfolio_id, "sell", symbol, quantity, price))
+        return portfolio_id, version
+
+    @staticmethod
+    async def buy_asset(db: AsyncSession, user_id: int, symbol: str, quantity: float, price: float):
+        # Списание денег с проверкой баланса и зачисление актива - в одной короткой транзакции, без refresh
+        portfolio_id, version = await AsyncPortfolioCRUD._execute_buy(db, user_id, symbol, quantity, price)
+        await db.commit()
+        leaderboard.on_trade(portfolio_id, version, symbol, quantity, -quantity * price, price)
+        await ledger_sync.wait() # ответ только после того, как сделка и запись журнала долговечны
+
+        return {"message": "Asset bought successfully"}
+
+    @staticmethod
+    async def sell_asset(db: AsyncSession, user_id: int, symbol: str, quantity: float, price: float):
+        # Списание количества с проверкой остатка и зачисление денег - в одной короткой транзакции, без refresh
+        portfolio_id, version = await AsyncPortfolioCRUD._execute_sell(db, user_id, symbol, quantity, price)
+        await db.commit()
+        leaderboard.on_trade(portfolio_id, version, symbol, -quantity, quantity * price, price)
+        await ledger_sync.wait()
+
+        return {"message": "Asset sold successfully"}
+
+    @staticmethod
+    async def execute_batch(db: AsyncSession, user_id: int, legs: list, prices: dict):
+        # Все ноги в одной транзакции: все исполнены или ни одной. -> (успех, результаты по ногам)
+        results = [
+            {"side": leg.side, "symbol": leg.symbol, "quantity": leg.quantity, "price": prices[leg.symbol], "status": "not_executed"}
+            for leg in legs
+        ]
+        executors = {"buy": AsyncPortfolioCRUD._execute_buy, "sell": AsyncPortfolioCRUD._execute_sell}
+        portfolio_id = None
+        for leg, result in zip(legs, results):
+            try:
+                portfolio_id, version = await executors[leg.side](db, user_id, leg.symbol, leg.quantity, result["price"])
+            except HTTPException as e:
+                result["status"] = "rejected"
+                result["detail"] = e.detail
+                for previous in results:
+                    if previous["status"] == "filled":
+                        previous["status"] = "rolled_back" # транзакция уже откатилась - предыдущие ноги не применены
+                return False, results
+            result["status"] = "filled"
+
+        await db.commit() # один commit (один fsync) на весь пакет
+        changes = []
+        for leg in legs:
+            signed = leg.quantity if leg.side == "buy" else -leg.quantity
+            changes.append((leg.symbol, signed, -signed * prices[leg.symbol], prices[leg.symbol]))
+        leaderboard.on_trades(portfolio_id, version, changes) # все ноги - одна транзакция с итоговой версией портфеля
+        await ledger_sync.wait()
+        return True, results
+
+
+class AsyncOrderCRUD:
+    # Отложенные ордера: хранение в БД, исполнение - через шаги сделок AsyncPortfolioCRUD
+
+    @staticmethod
+    async def create_order(db: AsyncSession, user_id: int, order: OrderCreate):
+        new_order = Order(
+            user_id=user_id,
+            symbol=order.symbol, # уже нормализован эндпоинтом
+            side=order.side,
+            order_type=order.order_type,
+            quantity=order.quantity,
+            trigger_price=order.trigger_price,
+            status="open",
+        )
+        db.add(new_order)
+        await db.commit()
+        return new_order
+
+    @staticmethod
+    async def get_open_orders(db: AsyncSession, user_id: int):
+        return (await db.scalars(
+            select(Order).where(Order.user_id == user_id, Order.status == "open").order_by(Order.id)
+        )).all()
+
+    @staticmethod
+    async def cancel_order(db: AsyncSession, user_id: int, order_id: int):
+        # Условный UPDATE: уже исполненный или чужой ордер не отменяется
+        cancelled = (await db.execute(
+            update(Order)
+            .where(Order.id == order_id, Order.user_id == user_id, Order.status == "open")
+            .values(status="cancelled", closed_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )).rowcount
+        if cancelled == 0:
+            await db.rollback()
+            raise HTTPException(status_code=404, detail="Open order not found")
+        await db.commit()
+        return {"message": "Order cancelled"}
+
+    @staticmethod
+    async def stream_open_orders(db: AsyncSession, batch_size: int = 10000):
+        # Открытые ордера пачками (серверный курсор) - загрузка индекса при старте без списка на весь миллион ORM объектов
+        result = await db.stream(
+            select(Order.id, Order.user_id, Order.symbol, Order.side, Order.order_type, Order.quantity, Order.trigger_price)
+            .where(Order.status == "open")
+            .execution_options(yield_per=batch_size)
+        )
+        async for rows in result.partitions():
+            yield rows
+
+    @staticmethod
+    async def execute_order(db: AsyncSession, order, price: float):
+        # Пометка ордера и сделка - одна транзакция: после сбоя ордер не исполнится второй раз
+        # -> "filled" / "rejected" / None (ордер уже отменен или исполнен)
+        claimed = (await db.execute(
+            update(Order)
+            .where(Order.id == order.id, Order.status == "open")
+            .values(status="filled", fill_price=price, closed_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )).rowcount
+        if claimed == 0:
+            await db.rollback()
+            return None
+
+        execute = AsyncPortfolioCRUD._execute_buy if order.side == "buy" else AsyncPortfolioCRUD._execute_sell
+        try:
+            portfolio_id, version = await execute(db, order.user_id, order.symbol, order.quantity, price)
+        except HTTPException as e:
+            # Сделка откатилась вместе с пометкой filled - записываем отказ (нет денег / актива)
+            await db.execute(
+                update(Order)
+                .where(Order.id == order.id, Order.status == "open")
+                .values(status="rejected", detail=e.detail, closed_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            return "rejected"
+
+        await db.commit()
+        signed = order.quantity if order.side == "buy" else -order.quantity
+        leaderboard.on_trade(portfolio_id, version, order.symbol, signed, -signed * price, price)
+        await ledger_sync.wait()
+        return "filled"
@@ -1,11 +1,258 @@
 #работа с внешними API:
+import asyncio
+import json
+import time
+
+import httpx
 import requests
 from fastapi import HTTPException
 
-#Получение цены криптовалюты с Binance API |  symbol: Символ криптовалюты (BTC, ETH, etc)
-def get_crypto_price(symbol: str) -> float:
+from cache import PriceCache
+from config import PRICE_CACHE_TTL_SECONDS, PRICE_CACHE_SYMBOL_TTLS, PRICE_CACHE_MAX_SIZE, PRICE_CACHE_STALE_GRACE_SECONDS
+from config import BINANCE_API_URL, PRICE_HTTP_TIMEOUT_SECONDS, PRICE_HTTP_MAX_CONNECTIONS, PRICE_HTTP_MAX_CONCURRENCY
+from config import MARKET_PRICE_MAX_AGE_SECONDS, PRICE_EPOCH_SECONDS
+from market_data import price_table
+from price_board import price_board
+from symbols import symbol_registry
+from metrics import span, count
+
+TICKER_PRICE_PATH = "/api/v3/ticker/price"
+EXCHANGE_INFO_PATH = "/api/v3/exchangeInfo"
+INVALID_SYMBOL_CODE = -1121  # ответ Binance 400 {"code": -1121, "msg": "Invalid symbol."}
+
+# Общий на весь процесс кэш цен - одинаковые запросы к Binance схлопываются в один
+price_cache = PriceCache(
+    default_ttl=PRICE_CACHE_TTL_SECONDS,
+    max_size=PRICE_CACHE_MAX_SIZE,
+    stale_grace=PRICE_CACHE_STALE_GRACE_SECONDS,
+    symbol_ttls=PRICE_CACHE_SYMBOL_TTLS,
+)
+
+# Синхронный путь (скрипты) - одна сессия, чтобы не открывать TCP+TLS на каждый запрос
+_session = requests.Session()
+
+
+def _pairs_param(symbols: list) -> str:
+    # ["BTC", "ETH"] -> '["BTCUSDT","ETHUSDT"]'
+    return json.dumps([f"{symbol}USDT" for symbol in symbols], separators=(",", ":"))
+
+
+def _parse_prices(symbols: list, payload) -> dict:
+    prices = {item["symbol"]: float(item["price"]) for item in payload}
+    for symbol in symbols:
+        if f"{symbol}USDT" not in prices:
+            symbol_registry.mark_unknown(symbol) # Binance не вернул пару - больше не спрашиваем
+    return {symbol: prices[f"{symbol}USDT"] for symbol in symbols if f"{symbol}USDT" in prices}
+
+
+def _is_invalid_symbol(response) -> bool:
+    try:
+        return response.status_code == 400 and response.json().get("code") == INVALID_SYMBOL_CODE
+    except ValueError:
+        return False
+
+
+def _unknown_symbol(symbol: str) -> HTTPException:
+    symbol_registry.mark_unknown(symbol)
+    return HTTPException(status_code=400, detail=f"Unknown symbol: {symbol}")
+
+
+def _fetch_crypto_price(symbol: str) -> float:
+    count("price_fetches")
+    try:
+        resource = _session.get(f"{BINANCE_API_URL}{TICKER_PRICE_PATH}", params={"symbol": f"{symbol}USDT"}, timeout=PRICE_HTTP_TIMEOUT_SECONDS)
+    except:
+        raise HTTPException(status_code=500, detail="Error while getting price from Binance API")
+    if _is_invalid_symbol(resource):
+        raise _unknown_symbol(symbol)
     try:
-        resource = requests.get(f"https://api.binance.com/api/v3/ticker/price?symbol={symbol}USDT")
         return float(resource.json()["price"])
     except:
         raise HTTPException(status_code=500, detail="Error while getting price from Binance API")
+
+
+def _fetch_crypto_prices(symbols: list) -> dict:
+    # Один запрос на все символы: /ticker/price?symbols=["BTCUSDT","ETHUSDT"]
+    count("price_fetches")
+    try:
+        resource = _session.get(f"{BINANCE_API_URL}{TICKER_PRICE_PATH}", params={"symbols": _pairs_param(symbols)}, timeout=PRICE_HTTP_TIMEOUT_SECONDS)
+        return _parse_prices(symbols, resource.json())
+    except:
+        raise HTTPException(status_code=500, detail="Error while getting price from Binance API")
+
+
+class AsyncPriceClient:
+    # Асинхронный клиент Binance: пул keep-alive соединений, таймауты и ограничение одновременных запросов
+    def __init__(self, base_url: str, timeout: float, max_connections: int, max_concurrency: int):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self._client = None
+        self._semaphore = None
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _get_json(self, params: dict):
+        await self.start() # на случай вызова вне жизненного цикла приложения (скрипты, тесты)
+        count("price_fetches")
+        async with self._semaphore:
+            response = await self._client.get(TICKER_PRICE_PATH, params=params)
+        if _is_invalid_symbol(response):
+            raise KeyError(params)
+        response.raise_for_status()
+        return response.json()
+
+    async def fetch_price(self, symbol: str) -> float:
+        try:
+            payload = await self._get_json({"symbol": f"{symbol}USDT"})
+            return float(payload["price"])
+        except KeyError:
+            raise _unknown_symbol(symbol)
+        except Exception:
+            raise HTTPException(status_code=500, detail="Error while getting price from Binance API")
+
+    async def fetch_prices(self, symbols: list) -> dict:
+        try:
+            payload = await self._get_json({"symbols": _pairs_param(symbols)})
+            return _parse_prices(symbols, payload)
+        except KeyError:
+            # Binance отклоняет весь список, не называя символ - какой из них неизвестен, выяснят одиночные запросы
+            raise HTTPException(status_code=400, detail=f"Unknown symbol among: {', '.join(symbols)}")
+        except Exception:
+            raise HTTPException(status_code=500, detail="Error while getting price from Binance API")
+
+    async def fetch_exchange_info(self) -> dict:
+        # Список торгуемых пар для реестра символов (несколько МБ, запрашивается редко)
+        await self.start()
+        response = await self._client.get(EXCHANGE_INFO_PATH, params={"permissions": "SPOT"})
+        response.raise_for_status()
+        return response.json()
+
+
+price_client = AsyncPriceClient(
+    base_url=BINANCE_API_URL,
+    timeout=PRICE_HTTP_TIMEOUT_SECONDS,
+    max_connections=PRICE_HTTP_MAX_CONNECTIONS,
+    max_concurrency=PRICE_HTTP_MAX_CONCURRENCY,
+)
+
+
+async def _fetch_one_async(symbols: list) -> dict:
+    return {symbols[0]: await price_client.fetch_price(symbols[0])}
+
+
+def _streamed_price(symbol: str, max_age: float):
+    # Поток рыночных данных этого процесса, затем общая доска воркеров (ее обновляет один процесс на всех)
+    price = price_table.get(symbol, max_age)
+    if price is None:
+        price = price_board.get(symbol, max_age)
+    return price
+
+
+def _from_price_table(symbols, max_age: float):
+    # Цены из потока рыночных данных: -> ({symbol: price}, [символы, которых нет или они слишком старые])
+    found = {}
+    missing = []
+    for symbol in dict.fromkeys(symbols):
+        price = _streamed_price(symbol, max_age)
+        if price is None:
+            missing.append(symbol)
+        else:
+            found[symbol] = price
+    return found, missing
+
+def publish_polled_prices(prices: dict):
+    # Цены, полученные опросом (HTTP/кэш/общая доска), -> price_table для слушателей (рейтинг, ордера, SSE)
+    # Время - когда цена реально получена, а не момент записи: проверки max_age/staleness видят настоящий возраст.
+    # Неизменившаяся цена не рассылается как новый тик.
+    for symbol, price in prices.items():
+        if price_table.get(symbol) == price:
+            continue
+        sources = [entry for entry in (price_cache.fetched_at(symbol), price_board.entry(symbol)) if entry and entry[0] == price]
+        price_table.update(symbol, price, max(updated_at for _, updated_at in sources) if sources else None)
+
+# Номер "эпохи" цен: внутри эпохи оценки портфеля считаются неизменными (ETag, кэш ответов)
+def price_epoch() -> int:
+    return int(time.time() // PRICE_EPOCH_SECONDS)
+
+# Сколько секунд назад обновлялась цена в потоке (None - поток этот символ не передает)
+def get_price_staleness(symbol: str):
+    return price_table.staleness(symbol)
+
+#Получение цены криптовалюты | сначала таблица потока и общая доска, HTTP к Binance только если символа в потоке нет
+def get_crypto_price(symbol: str, max_age: float = MARKET_PRICE_MAX_AGE_SECONDS) -> float:
+    symbol_registry.check(symbol) # неизвестный символ - 400 без запроса к Binance
+    price = _streamed_price(symbol, max_age)
+    if price is not None:
+        return price
+    with span("price"):
+        return price_cache.get_or_load(symbol, _fetch_crypto_price)
+
+#Получение цен сразу для нескольких символов одним запросом | symbols: ["BTC", "ETH", ...] -> {"BTC": 65000.0, ...}
+# Неизвестные символы (опечатка, снят с торгов) в результат не попадают: один такой актив не ломает оценку остальных
+def get_crypto_prices(symbols, max_age: float = MARKET_PRICE_MAX_AGE_SECONDS) -> dict:
+    symbols, _ = symbol_registry.partition(symbols)
+    prices, missing = _from_price_table(symbols, max_age)
+    if not missing:
+        return prices
+    try:
+        with span("price"):
+            try:
+                prices.update(price_cache.get_many_or_load(missing, _fetch_crypto_prices))
+            except KeyError:
+                # Binance не вернул часть пар - они уже в отрицательном кэше, найденные цены уже в кэше цен
+                prices.update(price_cache.get_many_or_load(symbol_registry.partition(missing)[0], _fetch_crypto_prices))
+        return prices
+    except KeyError:
+        raise HTTPException(status_code=500, detail="Error while getting price from Binance API")
+
+# Неблокирующие версии для async эндпоинтов
+async def get_crypto_price_async(symbol: str, max_age: float = MARKET_PRICE_MAX_AGE_SECONDS) -> float:
+    symbol_registry.check(symbol)
+    price = _streamed_price(symbol, max_age)
+    if price is not None:
+        return price
+    with span("price"):
+        prices = await price_cache.get_many_or_load_async([symbol], _fetch_one_async)
+    return prices[symbol]
+
+async def _get_each_async(symbols: list, max_age: float) -> dict:
+    # Binance отклонил пакет целиком из-за неизвестного символа: по одному, неизвестные попадут в отрицательный кэш
+    results = await asyncio.gather(*(get_crypto_price_async(symbol, max_age) for symbol in symbols), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException) and not (isinstance(result, HTTPException) and result.status_code == 400):
+            raise result # недоступен сам Binance - это не "неизвестный символ"
+    return {symbol: result for symbol, result in zip(symbols, results) if not isinstance(result, BaseException)}
+
+async def get_crypto_prices_async(symbols, max_age: float = MARKET_PRICE_MAX_AGE_SECONDS) -> dict:
+    symbols, _ = symbol_registry.partition(symbols)
+    prices, missing = _from_price_table(symbols, max_age)
+    if not missing:
+        return prices
+    try:
+        with span("price"):
+            try:
+                prices.update(await price_cache.get_many_or_load_async(missing, price_client.fetch_prices))
+            except KeyError:
+                known, _ = symbol_registry.partition(missing)
+                prices.update(await price_cache.get_many_or_load_async(known, price_client.fetch_prices))
+            except HTTPException as e:
+                if e.status_code != 400:
+                    raise
+                prices.update(await _get_each_async(missing, max_age))
+        return prices
+    except KeyError:
+        raise HTTPException(status_code=500, detail="Error while getting price from Binance API")
@@ -1,19 +1,35 @@
 # 🔗 Подключение к БД
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker,declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
-# 🔗 Подключение к SQLite
-SQLALCHEMY_DATABASE_URL = "sqlite:///./database.db" # SQLite не рекомендуется для production
+from config import DATABASE_URL
+from storage import async_url, is_sqlite, engine_options, apply_sqlite_pragmas
+from metrics import instrument_engine
+
+# 🔗 Подключение к БД: URL из окружения (DATABASE_URL), по умолчанию SQLite (не рекомендуется для production)
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+ASYNC_SQLALCHEMY_DATABASE_URL = async_url(DATABASE_URL) # та же база через async драйвер (aiosqlite, asyncpg, ...)
 
 # 🚀 Создаем движок БД
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False} # ✅ Разрешает использовать одно соединение из разных потоков
-)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL, is_async=False))
 
 # 🎭 Фабрика сессий
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine) # autoflush=False - Изменения накапливаются и отправляются одной командой
 
+# ⚡ Асинхронный движок и фабрика сессий (AsyncSession) - запросы не блокируют event loop
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, **engine_options(ASYNC_SQLALCHEMY_DATABASE_URL, is_async=True))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False) # expire_on_commit=False - объекты читаются после commit без нового запроса
+
+# ⚙️ WAL, synchronous=NORMAL, кэш страниц, mmap и busy_timeout на каждом соединении SQLite
+if is_sqlite(SQLALCHEMY_DATABASE_URL):
+    apply_sqlite_pragmas(engine)
+    apply_sqlite_pragmas(async_engine.sync_engine)
+
+# 📊 Число и время SQL запросов на каждый HTTP запрос (metrics.py)
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
 # 🏗️ Базовый класс для моделей
 Base = declarative_base()
 
@@ -27,4 +43,14 @@ def get_db():
         db.rollback() # Откат при ошибках и сохранение целостности данных 🔒
         raise
     finally:
-        db.close() # Всегда закрываем соединение
\ No newline at end of file
+        db.close() # Всегда закрываем соединение
+
+
+# 🔄 Async dependency для FastAPI (синхронная get_db остается для скриптов)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except Exception:
+            await db.rollback()
+            raise
@@ -0,0 +1,24 @@
+# 🏷️ ETag для JSON API портфеля: версия портфеля + эпоха цен. Совпал - 304 без оценки и сериализации
+import hashlib
+
+from cache import TTLCache
+from config import PORTFOLIO_RESPONSE_CACHE_SIZE, PRICE_EPOCH_SECONDS
+
+# ETag -> готовое тело ответа: один ETag всегда отдает одни и те же байты (сильный ETag)
+portfolio_response_cache = TTLCache(max_size=PORTFOLIO_RESPONSE_CACHE_SIZE, default_ttl=PRICE_EPOCH_SECONDS)
+
+
+def portfolio_etag(portfolio_id: int, version: int, epoch: int) -> str:
+    digest = hashlib.blake2b(f"{portfolio_id}:{version}:{epoch}".encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    # If-None-Match: "a", W/"b" | *
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
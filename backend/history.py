@@ -0,0 +1,185 @@
+# 📉 История стоимости портфелей: фоновый снимок + свертка в минуты/часы/дни + быстрые запросы по диапазону
+# Каждый снимок сразу обновляет корзины всех разрешений, поэтому запрос за год читает ~365 строк, а не 500 тысяч
+import asyncio
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+from sqlalchemy import select, delete, case
+
+try:
+    import fcntl
+except ImportError:  # Windows: без выбора, снимок делает каждый процесс
+    fcntl = None
+
+from config import SNAPSHOT_INTERVAL_SECONDS, SNAPSHOT_RETENTION_SECONDS
+from crypto_service import get_crypto_prices_async
+from database import AsyncSessionLocal
+from models import Portfolio, Asset, PortfolioSnapshot
+from storage import upsert
+
+RESOLUTIONS = (60, 3600, 86400)
+
+# Диапазон запроса -> (длина в секундах, разрешение). Число точек ограничено при любом диапазоне
+RANGES = {
+    "1d": (86400, 60),
+    "7d": (7 * 86400, 3600),
+    "30d": (30 * 86400, 3600),
+    "1y": (365 * 86400, 86400),
+    "all": (None, 86400),
+}
+
+
+async def value_all_portfolios(db) -> dict:
+    # Один запрос на все портфели и активы + один пакетный запрос цен -> {portfolio_id: деньги + стоимость активов}
+    rows = (await db.execute(
+        select(Portfolio.id, Portfolio.available_money, Asset.symbol, Asset.quantity)
+        .outerjoin(Asset, Asset.portfolio_id == Portfolio.id)
+    )).all()
+
+    symbols = {symbol for _, _, symbol, _ in rows if symbol is not None}
+    prices = await get_crypto_prices_async(sorted(symbols)) # только известные символы: снятые с торгов в ответе отсутствуют
+
+    values = {}
+    holdings = defaultdict(float)
+    for portfolio_id, cash, symbol, quantity in rows:
+        values[portfolio_id] = cash or 0.0
+        if symbol is not None and symbol in prices:
+            holdings[portfolio_id] += quantity * prices[symbol]
+    for portfolio_id, assets_value in holdings.items():
+        values[portfolio_id] += assets_value
+
+    unpriced = symbols - prices.keys()
+    if unpriced:
+        print(f"Portfolio snapshot: no price for {', '.join(sorted(unpriced))}, valued without them")
+    return values
+
+
+def upsert_snapshots(dialect_name: str, rows: list):
+    # INSERT ... ON CONFLICT (portfolio_id, resolution, bucket_start) DO UPDATE: последнее значение, min, max
+    # value_min/value_max читают старые min/max своей же колонки - порядок присваиваний (важен в MySQL) не влияет
+    statement = upsert(dialect_name, PortfolioSnapshot, ["portfolio_id", "resolution", "bucket_start"], lambda new: {
+        "value": new.value,
+        "value_min": case((new.value < PortfolioSnapshot.value_min, new.value), else_=PortfolioSnapshot.value_min),
+        "value_max": case((new.value > PortfolioSnapshot.value_max, new.value), else_=PortfolioSnapshot.value_max),
+    })
+    if statement is None:
+        raise RuntimeError(f"Portfolio history needs upsert support, {dialect_name} has none")
+    return statement.values(rows)
+
+
+def snapshot_rows(values: dict, now: float) -> list:
+    rows = []
+    for resolution in RESOLUTIONS:
+        bucket_start = int(now // resolution * resolution)
+        for portfolio_id, value in values.items():
+            rows.append({
+                "portfolio_id": portfolio_id,
+                "resolution": resolution,
+                "bucket_start": bucket_start,
+                "value": value,
+                "value_min": value,
+                "value_max": value,
+            })
+    return rows
+
+
+async def take_snapshot(session_factory=AsyncSessionLocal, now: float = None, chunk_size: int = 500):
+    now = time.time() if now is None else now
+    async with session_factory() as db:
+        values = await value_all_portfolios(db)
+        rows = snapshot_rows(values, now)
+        dialect_name = db.get_bind().dialect.name
+        for start in range(0, len(rows), chunk_size):
+            await db.execute(upsert_snapshots(dialect_name, rows[start:start + chunk_size]))
+
+        # Мелкие корзины старше срока хранения больше не нужны - их данные уже в крупных
+        for resolution, retention in SNAPSHOT_RETENTION_SECONDS.items():
+            if retention is not None:
+                await db.execute(
+                    delete(PortfolioSnapshot)
+                    .where(PortfolioSnapshot.resolution == resolution, PortfolioSnapshot.bucket_start < now - retention)
+                    .execution_options(synchronize_session=False)
+                )
+        await db.commit()
+    return len(values)
+
+
+async def get_portfolio_history(db, user_id: int, range_name: str, now: float = None) -> dict:
+    # Чтение по индексу (portfolio_id, resolution, bucket_start) - время запроса не зависит от длины диапазона
+    length, resolution = RANGES[range_name]
+    now = time.time() if now is None else now
+    query = (
+        select(PortfolioSnapshot.bucket_start, PortfolioSnapshot.value, PortfolioSnapshot.value_min, PortfolioSnapshot.value_max)
+        .join(Portfolio, Portfolio.id == PortfolioSnapshot.portfolio_id)
+        .where(Portfolio.user_id == user_id, PortfolioSnapshot.resolution == resolution)
+        .order_by(PortfolioSnapshot.bucket_start)
+    )
+    if length is not None:
+        query = query.where(PortfolioSnapshot.bucket_start >= now - length)
+    rows = (await db.execute(query)).all()
+    return {
+        "range": range_name,
+        "resolution": resolution,
+        "points": [{"t": t, "value": value, "min": low, "max": high} for t, value, low, high in rows],
+    }
+
+
+class SnapshotJob:
+    # Каждый воркер uvicorn запускает job, но снимок делает один: тот, кто взял flock на файле блокировки.
+    # Умер он - ядро снимает блокировку, на следующем тике ее берет другой воркер. На нескольких машинах снимки
+    # повторятся, но это безопасно: upsert в ту же корзину дает тот же результат.
+    def __init__(self, interval: float, lock_path: str):
+        self.interval = interval
+        self.lock_path = lock_path
+        self._lock_fd = None
+        self._task = None
+
+    def try_lock(self) -> bool:
+        if self._lock_fd is not None or fcntl is None:
+            return True # уже держим блокировку / Windows: один процесс, выбирать не из кого
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def unlock(self):
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.unlock()
+
+    async def _run(self):
+        while True:
+            # Выравниваемся по границе интервала, чтобы снимки попадали в свои корзины
+            await asyncio.sleep(self.interval - time.time() % self.interval)
+            if not self.try_lock():
+                continue # снимок делает другой воркер
+            try:
+                await take_snapshot()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Portfolio snapshot failed: {e}")
+
+
+snapshot_job = SnapshotJob(SNAPSHOT_INTERVAL_SECONDS, os.path.join(tempfile.gettempdir(), "portfolio_snapshot.lock"))
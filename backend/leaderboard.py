@@ -0,0 +1,189 @@
+# 🏆 Рейтинг портфелей: одна агрегирующая выборка + одна пакетная загрузка цен при пересборке,
+# дальше рейтинг обновляется по событиям - сделки (crud_async) и тики цен (price_table) - без пересчета на каждое чтение.
+# Порядок хранится в отсортированном списке (-стоимость, portfolio_id): одно изменение - bisect, много сразу - пересортировка.
+# Каждое изменение несет Portfolio.version после сделки: изменение, уже учтенное в снимке пересборки, не применяется второй раз.
+# Несколько воркеров uvicorn: рейтинг каждого процесса видит по событиям только свои сделки,
+# сделки других воркеров попадают в него при периодической пересборке (LEADERBOARD_REBUILD_SECONDS).
+import asyncio
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from sqlalchemy import select, func
+
+from config import LEADERBOARD_REBUILD_SECONDS
+from crypto_service import get_crypto_prices_async
+from database import AsyncSessionLocal
+from market_data import price_table
+from models import User, Portfolio, Asset
+from pnl import EPSILON
+
+RESORT_FRACTION = 1 / 32  # если за раз меняется больше этой доли портфелей - дешевле отсортировать заново
+
+
+async def load_positions(db) -> list:
+    # Количество по (портфель, символ) одним запросом: SUM + GROUP BY, портфели без активов тоже попадают (outer join)
+    return (await db.execute(
+        select(Portfolio.id, User.username, Portfolio.available_money, Portfolio.version, Asset.symbol, func.sum(Asset.quantity))
+        .join(User, User.id == Portfolio.user_id)
+        .outerjoin(Asset, Asset.portfolio_id == Portfolio.id)
+        .group_by(Portfolio.id, User.username, Portfolio.available_money, Portfolio.version, Asset.symbol)
+    )).all()
+
+
+class Leaderboard:
+    def __init__(self, table, rebuild_interval: float):
+        self.table = table
+        self.rebuild_interval = rebuild_interval
+        self.cash = {}  # portfolio_id -> свободные деньги
+        self.holdings = defaultdict(dict)  # portfolio_id -> {symbol: quantity}
+        self.holders = defaultdict(dict)  # symbol -> {portfolio_id: quantity} - кого затрагивает тик
+        self.prices = {}
+        self.values = {}  # portfolio_id -> стоимость
+        self.names = {}
+        self.versions = {}  # portfolio_id -> последняя учтенная версия портфеля
+        self._ranking = []  # [(-value, portfolio_id)] по возрастанию = по убыванию стоимости
+        self._pending = None  # изменения, пришедшие во время пересборки
+        self._task = None
+        self.updated_at = None
+        table.add_listener(self._on_tick)
+
+    # ---------- Порядок ----------
+    def _set_value(self, portfolio_id: int, value: float):
+        old = self.values.get(portfolio_id)
+        if old is not None:
+            index = bisect_left(self._ranking, (-old, portfolio_id))
+            del self._ranking[index]
+        self.values[portfolio_id] = value
+        insort(self._ranking, (-value, portfolio_id))
+
+    def _resort(self):
+        self._ranking = sorted((-value, portfolio_id) for portfolio_id, value in self.values.items())
+
+    def _value_of(self, portfolio_id: int) -> float:
+        return self.cash.get(portfolio_id, 0.0) + sum(
+            quantity * self.prices.get(symbol, 0.0) for symbol, quantity in self.holdings[portfolio_id].items()
+        )
+
+    # ---------- События ----------
+    def _on_tick(self, symbol: str, price: float, updated_at: float):
+        # O(держателей символа): стоимость меняется на quantity * (новая цена - старая)
+        old = self.prices.get(symbol)
+        self.prices[symbol] = price
+        holders = self.holders.get(symbol)
+        if not holders or old == price:
+            return
+        delta = price - (old or 0.0)
+        if len(holders) > len(self.values) * RESORT_FRACTION:
+            for portfolio_id, quantity in holders.items():
+                self.values[portfolio_id] += quantity * delta
+            self._resort()
+        else:
+            for portfolio_id, quantity in holders.items():
+                self._set_value(portfolio_id, self.values[portfolio_id] + quantity * delta)
+        self.updated_at = updated_at
+
+    def on_trade(self, portfolio_id: int, version: int, symbol: str = None, quantity: float = 0.0, cash: float = 0.0, price: float = None):
+        # Вызывается после commit сделки/пополнения: quantity и cash - изменения (+ покупка/пополнение, - продажа),
+        # version - Portfolio.version после этой транзакции
+        self.on_trades(portfolio_id, version, [(symbol, quantity, cash, price)])
+
+    def on_trades(self, portfolio_id: int, version: int, changes: list):
+        # Несколько изменений одной транзакции (ноги пакетной заявки): [(symbol, quantity, cash, price)]
+        if self._pending is not None:
+            self._pending.append((portfolio_id, version, changes))
+        self._apply(portfolio_id, version, changes)
+        self.updated_at = time.time()
+
+    def _apply(self, portfolio_id: int, version: int, changes: list):
+        if version <= self.versions.get(portfolio_id, 0):
+            return # транзакция уже учтена (попала в снимок пересборки)
+        self.versions[portfolio_id] = version
+        for symbol, quantity, cash, price in changes:
+            self.cash[portfolio_id] = self.cash.get(portfolio_id, 0.0) + cash
+            if symbol is not None and quantity:
+                held = self.holdings[portfolio_id]
+                remaining = held.get(symbol, 0.0) + quantity
+                if remaining > EPSILON:
+                    held[symbol] = self.holders[symbol][portfolio_id] = remaining
+                else:
+                    held.pop(symbol, None)
+                    self.holders[symbol].pop(portfolio_id, None)
+                if price is not None and symbol not in self.prices:
+                    self.prices[symbol] = price # цены символа еще нет - берем цену сделки
+        self._set_value(portfolio_id, self._value_of(portfolio_id))
+
+    # ---------- Пересборка ----------
+    async def rebuild(self, session_factory=AsyncSessionLocal):
+        # Полный пересчет: при старте и периодически, чтобы учесть изменения в обход crud_async (скрипты, импорт)
+        self._pending = []
+        try:
+            async with session_factory() as db:
+                rows = await load_positions(db)
+            symbols = sorted({symbol for _, _, _, _, symbol, _ in rows if symbol is not None})
+            prices = await get_crypto_prices_async(symbols) # одна пакетная загрузка цен на весь рейтинг
+
+            cash, names, versions = {}, {}, {}
+            holdings, holders = defaultdict(dict), defaultdict(dict)
+            for portfolio_id, username, available_money, version, symbol, quantity in rows:
+                cash[portfolio_id] = available_money or 0.0
+                names[portfolio_id] = username
+                versions[portfolio_id] = version or 0
+                if symbol is not None and quantity:
+                    holdings[portfolio_id][symbol] = holders[symbol][portfolio_id] = quantity
+
+            self.cash, self.names, self.holdings, self.holders, self.versions = cash, names, holdings, holders, versions
+            self.prices.update(prices)
+            self.values = {portfolio_id: self._value_of(portfolio_id) for portfolio_id in cash}
+            self._resort()
+            for change in self._pending: # сделки, прошедшие, пока шла выборка; уже попавшие в снимок пропускаются по версии
+                self._apply(*change)
+            self.updated_at = time.time()
+        finally:
+            self._pending = None
+        return len(self.values)
+
+    # ---------- Чтение ----------
+    async def top(self, db, limit: int) -> list:
+        entries = self._ranking[:limit]
+        unknown = [portfolio_id for _, portfolio_id in entries if portfolio_id not in self.names]
+        if unknown: # портфели, созданные после пересборки
+            rows = await db.execute(
+                select(Portfolio.id, User.username).join(User, User.id == Portfolio.user_id).where(Portfolio.id.in_(unknown))
+            )
+            self.names.update(rows.all())
+        return [
+            {
+                "rank": rank,
+                "username": self.names.get(portfolio_id),
+                "total_portfolio_value": -value,
+                "total_portfolio_value_display": f"{-value:,.2f}",
+            }
+            for rank, (value, portfolio_id) in enumerate(entries, start=1)
+        ]
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.rebuild()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Leaderboard rebuild failed: {e}")
+            await asyncio.sleep(self.rebuild_interval)
+
+
+leaderboard = Leaderboard(price_table, LEADERBOARD_REBUILD_SECONDS)
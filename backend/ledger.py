@@ -0,0 +1,125 @@
+# 📒 Журнал операций: строка журнала вставляется в той же транзакции, что и сама сделка -
+# сделка без записи в журнале (или запись без сделки) невозможна, лишнего commit нет.
+# Долговечность с group commit: SQLite работает с synchronous=NORMAL (commit без fsync), поэтому ответ на сделку
+# ждет общего fsync WAL файла. Ожидающие от параллельных запросов копятся до LEDGER_MAX_BATCH
+# или LEDGER_MAX_FLUSH_LATENCY_MS, один fsync делает долговечными все commit'ы пачки.
+# Серверные БД (PostgreSQL, MySQL) сами делают commit долговечным - там ожидание мгновенное.
+import asyncio
+import os
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.engine import make_url
+
+from config import LEDGER_MAX_BATCH, LEDGER_MAX_FLUSH_LATENCY_MS
+from database import ASYNC_SQLALCHEMY_DATABASE_URL
+from models import Transaction
+from storage import is_sqlite
+
+
+def ledger_row(portfolio_id: int, transaction_type: str, symbol, quantity: float, price: float) -> dict:
+    return {
+        "portfolio_id": portfolio_id,
+        "transaction_type": transaction_type,
+        "symbol": symbol,
+        "quantity": quantity,
+        "price": price,
+        "timestamp": datetime.utcnow(),
+    }
+
+
+def ledger_entry(portfolio_id: int, transaction_type: str, symbol, quantity: float, price: float):
+    # INSERT строки журнала - выполняется в транзакции сделки, до ее commit
+    return insert(Transaction).values(**ledger_row(portfolio_id, transaction_type, symbol, quantity, price))
+
+
+def wal_path(url: str):
+    # sqlite:///./database.db -> ./database.db-wal; None - не SQLite или база в памяти
+    if not is_sqlite(url):
+        return None
+    database = make_url(url).database
+    if not database or database == ":memory:":
+        return None
+    return f"{database}-wal"
+
+
+class LedgerSync:
+    def __init__(self, wal_path, max_batch: int, max_latency: float):
+        self.wal_path = wal_path
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        if self._task is None and self.wal_path is not None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self._queue.join() # дожидаемся fsync для всех, кто уже ждет
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _fsync(self):
+        # fsync файла сбрасывает на диск все записанные в него кадры WAL, кем бы они ни были записаны
+        try:
+            fd = os.open(self.wal_path, os.O_RDWR)
+        except FileNotFoundError:
+            return # WAL нет - все данные уже в файле БД, checkpoint сделал для него fsync
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    async def wait(self):
+        # Вызывается после commit сделки: возвращается, когда commit переживет и сбой питания
+        if self.wal_path is None:
+            return
+        if self._task is None:
+            await asyncio.to_thread(self._fsync) # синхронизация не запущена (скрипты) - fsync сразу
+            return
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(future)
+        await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await asyncio.to_thread(self._fsync)
+            except Exception as e:
+                for future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future in batch:
+                    if not future.done():
+                        future.set_result(None)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+ledger_sync = LedgerSync(
+    wal_path(ASYNC_SQLALCHEMY_DATABASE_URL),
+    max_batch=LEDGER_MAX_BATCH,
+    max_latency=LEDGER_MAX_FLUSH_LATENCY_MS / 1000,
+)
@@ -2,34 +2,79 @@
 # Все что связано с HTTP (токены, куки, headers) - в эндпоинтах.
 
 import uvicorn
-from fastapi import FastAPI, Request, HTTPException, Depends, Form, Response #(Response для создания cookie) | request - это вся информация о текущем HTTP запросе от пользователя.
+from fastapi import FastAPI, Request, HTTPException, Depends, Form, Response, Query #(Response для создания cookie) | request - это вся информация о текущем HTTP запросе от пользователя.
 from fastapi.responses import RedirectResponse #Чтобы перенаправлять на другую страницу вместо выброса ошибки
 from fastapi.responses import JSONResponse #"упаковка" ответа в понятный для JavaScript формат
 from fastapi.middleware.cors import CORSMiddleware #Разрешает браузеру делать запросы к вашему API с других доменов.
 from fastapi.templating import Jinja2Templates #Превращает HTML-шаблоны в готовые HTML-страницы с подставленными данными.
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm # PasswordBearer - Требует JWT токен в заголовках, PasswordReques - Автоматически читает данные формы, Ожидает поля username и password
-from starlette.responses import PlainTextResponse
+from starlette.responses import PlainTextResponse, StreamingResponse
 from starlette.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import json
 
 import requests
 from jose import jwt, ExpiredSignatureError
 
 from backend.schemas import AddMoney
-from database import get_db, engine
-from models import Base, User
-from schemas import UserCreate
-from crud import UserCRUD, PortfolioCRUD
-from crypto_service import get_crypto_price
-from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
-from auth import create_access_token, decode_token
+from database import get_async_db, engine, async_engine
+from models import User
+from migrate import run_migrations
+from schemas import UserCreate, BatchOrder, OrderCreate
+from crud_async import AsyncUserCRUD, AsyncPortfolioCRUD, AsyncOrderCRUD
+from crypto_service import get_crypto_price_async, get_crypto_prices_async, price_client, price_epoch, price_cache
+from etags import portfolio_etag, etag_matches, portfolio_response_cache
+from market_data import market_data_ingester
+from price_board import price_board
+from symbols import symbol_registry, normalize_symbol
+from ledger import ledger_sync
+from history import snapshot_job, get_portfolio_history, RANGES
+from broadcast import price_broadcaster, sse_event, portfolio_update
+from leaderboard import leaderboard
+from orders import order_engine
+from triggers import RestingOrder
+from passwords import password_pool
+from metrics import span, start_request, finish_request, route_of, server_timing, render_metrics, PROMETHEUS_CONTENT_TYPE
+from storage import pool_wait_stats
+from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, SSE_HEARTBEAT_SECONDS, BATCH_ORDER_MAX_LEGS, LEADERBOARD_MAX_SIZE
+from auth import create_access_token, decode_token_payload, cache_principal, get_cached_principal, invalidate_token
 
 
 #--------------
-# 🚀 Создаем таблицы в БД
-Base.metadata.create_all(bind=engine)
+# 🚀 Создаем/обновляем таблицы в БД через версионные миграции (migrate.py)
+run_migrations(engine)
 app = FastAPI()
 
+
+@app.on_event("startup")
+async def startup():
+    await price_client.start() # пул соединений к Binance живет вместе с приложением
+    market_data_ingester.start() # цены приходят из потока, эндпоинты читают их из памяти
+    price_board.start(price_client.fetch_prices) # один воркер обновляет общую доску цен, остальные только читают
+    symbol_registry.start(price_client.fetch_exchange_info) # снимок символов с диска, дальше обновление из exchangeInfo
+    ledger_sync.start() # один fsync WAL на пачку сделок (SQLite)
+    snapshot_job.start() # снимки стоимости портфелей для графика
+    price_broadcaster.start() # живые цены для SSE подписчиков
+    leaderboard.start() # рейтинг: пересборка при старте, дальше обновления по сделкам и тикам
+    await order_engine.start() # открытые limit/stop ордера из БД -> индекс порогов
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await order_engine.stop()
+    await leaderboard.stop()
+    await price_broadcaster.stop()
+    await snapshot_job.stop()
+    await ledger_sync.stop()
+    await symbol_registry.stop()
+    await price_board.stop()
+    await market_data_ingester.stop()
+    await price_client.close()
+    await async_engine.dispose()
+    password_pool.shutdown()
+
+
 #система безопасности (токены), защищает только те endpoints, где вы явно укажете зависимость от токена.
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -42,8 +87,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ⏱️ Время каждого запроса по фазам (БД, цены, шаблон) -> гистограммы для /metrics и заголовок Server-Timing
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    metrics, token = start_request()
+    status = 500
+    streaming = False
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        streaming = response.headers.get("content-type", "").startswith("text/event-stream") # SSE - не в гистограммы задержки
+    finally:
+        spans = finish_request(metrics, token, request.method, route_of(request.scope), status, streaming)
+    response.headers["Server-Timing"] = server_timing(spans)
+    return response
+
+class TimedJinja2Templates(Jinja2Templates):
+    # TemplateResponse рендерит шаблон сразу при создании ответа - это время и есть фаза "template"
+    def TemplateResponse(self, *args, **kwargs):
+        with span("template"):
+            return super().TemplateResponse(*args, **kwargs)
+
 app.mount("/static", StaticFiles(directory="../frontend/css"), name="static") # ✅ Настройка статических файлов (CSS, JS, изображения) # .. — значит «выйти на один уровень вверх» (из backend в корень Demo_Crypto_App)
-templates = Jinja2Templates(directory="../frontend/templates") # Настройка шаблонов
+templates = TimedJinja2Templates(directory="../frontend/templates") # Настройка шаблонов (время рендера попадает в метрики)
 
 
 @app.get("/")
@@ -54,7 +120,7 @@ async def root(request: Request):
 async def reg_page(request: Request):
     return templates.TemplateResponse("register.html", {"request": request})
 @app.post("/register")
-async def register(response: Response, username: str = Form(...), password: str = Form(...), email: str = Form(...), db: Session = Depends(get_db)):
+async def register(response: Response, username: str = Form(...), password: str = Form(...), email: str = Form(...), db: AsyncSession = Depends(get_async_db)):
 
     # Валидируем через Pydantic
     try:
@@ -62,7 +128,10 @@ async def register(response: Response, username: str = Form(...), password: str
     except ValueError as e:
         return RedirectResponse(url="/reg_page?error=validation_failed", status_code=303)
 
-    new_user = UserCRUD.create_user(db, user_data)
+    try:
+        new_user = await AsyncUserCRUD.create_user(db, user_data)
+    except HTTPException as e: # пул хэширования паролей переполнен - отказываем сразу
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
 
     if not new_user:
         print("User already exists")
@@ -79,10 +148,13 @@ async def register(response: Response, username: str = Form(...), password: str
 @app.post("/login")
 async def login(response: Response, #для передачи данных с сервера в браузер
                 form_data: OAuth2PasswordRequestForm = Depends(), #внутри уже настроены все поля
-                db: Session = Depends(get_db)
+                db: AsyncSession = Depends(get_async_db)
                 ):
 
-    user = UserCRUD.log_in_user(db, form_data.username, form_data.password)
+    try:
+        user = await AsyncUserCRUD.log_in_user(db, form_data.username, form_data.password)
+    except HTTPException as e: # пул проверки паролей переполнен - 503 сразу, без ожидания в очереди
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
     if not user:
         return RedirectResponse(url="/?error=auth_failed", status_code=303)
 
@@ -96,27 +168,42 @@ async def login(response: Response, #для передачи данных с с
 
 
 @app.post("/logout")
-def logout():
+def logout(request: Request):
+    token = request.cookies.get("access_token")
+    if token:
+        invalidate_token(token) # ⬅️ убираем токен и пользователя из кэша
     redirect = RedirectResponse(url="/", status_code=303)
     redirect.delete_cookie(key="access_token") # ⬅️ удаляем куки
     print("User logged out")
     return redirect
 
 #------ Dependency для проверки токена
-async def check_auth (request: Request, db: Session = Depends(get_db)) -> User: # request - переменная, которая будет содержать информацию о HTTP запросе #Request - класс из FastAPI, который описывает структуру HTTP запроса
+async def check_auth(request: Request, db: AsyncSession = Depends(get_async_db)) -> User:
+    with span("auth"): # время проверки токена и поиска пользователя - отдельная фаза в метриках
+        return await _authenticate(request, db)
+
+async def _authenticate(request: Request, db: AsyncSession) -> User: # request - переменная, которая будет содержать информацию о HTTP запросе #Request - класс из FastAPI, который описывает структуру HTTP запроса
     token = request.cookies.get("access_token") # Получаем токен из куки
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     try:
-        username = decode_token(token) # Декодируем токен
-        if username is None:
+        decoded = decode_token_payload(token) # Декодируем токен (повторные запросы - из кэша, без проверки HMAC)
+        if decoded is None:
             raise HTTPException(status_code=401, detail="Invalid token")
+        username, expires_at = decoded
+
+        # Повторные запросы берут пользователя из кэша и не ходят в БД
+        principal = get_cached_principal(username)
+        if principal is not None:
+            user_id, username, email = principal
+            return User(id=user_id, username=username, email=email) # отдельный объект, не привязанный к сессии
 
         # Ищем пользователя в БД
-        user = db.query(User).filter(User.username == username).first()
+        user = await AsyncUserCRUD.get_user_by_username(db, username)
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
 
+        cache_principal(username, (user.id, user.username, user.email), expires_at)
         return user # ← возвращаем User объект
 
     # ВАЖНО: выбрасываем исключение, а не просто печатаем!
@@ -126,22 +213,24 @@ async def check_auth (request: Request, db: Session = Depends(get_db)) -> User:
 
 # --- Защищенные эндпоинты ----
 @app.get("/user-profile")
-async def user_profile(request: Request, current_user: User = Depends(check_auth), db: Session = Depends(get_db)):
+async def user_profile(request: Request, current_user: User = Depends(check_auth), db: AsyncSession = Depends(get_async_db)):
 
     if not current_user:
         return RedirectResponse(url="/", status_code=303)
 
-    portfolio_data = PortfolioCRUD.get_user_portfolio_data(db, current_user.id)
+    valuation = await AsyncPortfolioCRUD.get_portfolio_valuation(db, current_user.id) # снимок считается один раз на запрос
+    if valuation is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
 
     return templates.TemplateResponse(
         "user-profile.html", {"request": request,
-                              "portfolio": portfolio_data["portfolio"], #объект портфеля пользователя, т.к принимаем return {"portfolio": portfolio,"assets": assets}
-                              "assets": portfolio_data["assets"],
-                              "user": current_user
+                              "valuation": valuation, #неизменяемый снимок: активы, цены, итоги и готовые строки
+                              "user": current_user,
+                              "symbols": symbol_registry.symbols() #список для покупки - из реестра, а не из шаблона
                               })
 
 @app.get("/payment")
-async def payment(request: Request, amount: float, current_user: User = Depends(check_auth), db: Session = Depends(get_db)):
+async def payment(request: Request, amount: float, current_user: User = Depends(check_auth), db: AsyncSession = Depends(get_async_db)):
     if not current_user:
         return RedirectResponse(url="/", status_code=302)
 
@@ -157,10 +246,10 @@ async def payment(request: Request, amount: float, current_user: User = Depends(
 # Без endpoint'а форма будет пытаться отправить данные на текущую страницу, которая не умеет обрабатывать добавление денег.
 
 @app.post("/api/add_money")
-async def add_money(amount: float = Form(...), current_user: User = Depends(check_auth), db: Session = Depends(get_db)):
+async def add_money(amount: float = Form(...), current_user: User = Depends(check_auth), db: AsyncSession = Depends(get_async_db)):
     try:
         added_money_data = AddMoney(amount = amount) # ✅ ← Pydantic валидация
-        portfolio_operation = PortfolioCRUD.add_money_to_portfolio(db, current_user.id, added_money_data.amount) # ✅ передача чистых данных
+        portfolio_operation = await AsyncPortfolioCRUD.add_money_to_portfolio(db, current_user.id, added_money_data.amount) # ✅ передача чистых данных
 
         if portfolio_operation:
             return RedirectResponse(url="/user-profile", status_code=303)
@@ -172,11 +261,13 @@ async def add_money(amount: float = Form(...), current_user: User = Depends(chec
 
 
 @app.post("/api/buy_asset")
-async def buy_asset(symbol: str = Form(...), quantity: float = Form(...), current_user: User = Depends(check_auth), db: Session = Depends(get_db)):
+async def buy_asset(symbol: str = Form(...), quantity: float = Form(...), current_user: User = Depends(check_auth), db: AsyncSession = Depends(get_async_db)):
     try:
         if current_user:
-            price = 10
-            portfolio_operation = PortfolioCRUD.buy_asset(db, current_user.id, symbol, quantity, price)
+            symbol = normalize_symbol(symbol)
+            symbol_registry.check(symbol) # неизвестный символ - 400 до любых запросов
+            price = await get_crypto_price_async(symbol) # рыночная цена, как при продаже и в пакетной заявке
+            portfolio_operation = await AsyncPortfolioCRUD.buy_asset(db, current_user.id, symbol, quantity, price)
 
             return RedirectResponse(url="/user-profile", status_code=303)
         else:
@@ -189,10 +280,12 @@ async def buy_asset(symbol: str = Form(...), quantity: float = Form(...), curren
         return JSONResponse({"detail": str(e)}, status_code=500)
 
 @app.post("/api/sell_asset")
-async def sell_asset(symbol: str = Form(...), quantity: float = Form(...), current_user: User = Depends(check_auth), db: Session = Depends(get_db)):
+async def sell_asset(symbol: str = Form(...), quantity: float = Form(...), current_user: User = Depends(check_auth), db: AsyncSession = Depends(get_async_db)):
     try:
         if current_user:
-            portfolio_operation = PortfolioCRUD.sell_asset(db, current_user.id, symbol, quantity)
+            symbol = normalize_symbol(symbol)
+            price = await get_crypto_price_async(symbol)
+            portfolio_operation = await AsyncPortfolioCRUD.sell_asset(db, current_user.id, symbol, quantity, price)
             return RedirectResponse(url="/user-profile", status_code=303)
         else:
             return JSONResponse({"Error": "Not authenticated"}, status_code=401)
@@ -200,12 +293,150 @@ async def sell_asset(symbol: str = Form(...), quantity: float = Form(...), curre
         return JSONResponse({"detail": e.detail}, status_code=e.status_code)
 
 
+@app.post("/api/orders/batch")
+async def batch_order(order: BatchOrder, current_user: User = Depends(check_auth), db: AsyncSession = Depends(get_async_db)):
+    # Ребалансировка одной заявкой: цены всех символов одним запросом, все ноги в одной транзакции - все или ничего
+    if not order.legs:
+        return JSONResponse({"detail": "At least one leg is required"}, status_code=400)
+    if len(order.legs) > BATCH_ORDER_MAX_LEGS:
+        return JSONResponse({"detail": f"At most {BATCH_ORDER_MAX_LEGS} legs per order"}, status_code=400)
+    if any(leg.quantity <= 0 for leg in order.legs):
+        return JSONResponse({"detail": "Quantity must be positive"}, status_code=400)
+    for leg in order.legs:
+        leg.symbol = normalize_symbol(leg.symbol)
+
+    try:
+        prices = await get_crypto_prices_async([leg.symbol for leg in order.legs])
+    except HTTPException as e:
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code)
+    unknown = [leg.symbol for leg in order.legs if leg.symbol not in prices] # неизвестные символы в ответ не попадают
+    if unknown:
+        return JSONResponse({"detail": f"Unknown symbol: {', '.join(dict.fromkeys(unknown))}"}, status_code=400)
+
+    filled, legs = await AsyncPortfolioCRUD.execute_batch(db, current_user.id, order.legs, prices)
+    if not filled:
+        return JSONResponse({"status": "rejected", "legs": legs}, status_code=400)
+    return {"status": "filled", "legs": legs}
+
+
+def order_as_dict(order) -> dict:
+    return {
+        "id": order.id,
+        "symbol": order.symbol,
+        "side": order.side,
+        "order_type": order.order_type,
+        "quantity": order.quantity,
+        "trigger_price": order.trigger_price,
+        "status": order.status,
+    }
+
+
+@app.post("/api/orders")
+async def create_order(order: OrderCreate, current_user: User = Depends(check_auth), db: AsyncSession = Depends(get_async_db)):
+    # Отложенный ордер: хранится в БД, исполняется движком, когда цена пересечет trigger_price
+    if order.quantity <= 0 or order.trigger_price <= 0:
+        return JSONResponse({"detail": "Quantity and trigger price must be positive"}, status_code=400)
+    order.symbol = normalize_symbol(order.symbol) # "btc" -> "BTC" до проверки по реестру
+    if not symbol_registry.is_known(order.symbol):
+        return JSONResponse({"detail": f"Unknown symbol: {order.symbol}"}, status_code=400)
+    new_order = await AsyncOrderCRUD.create_order(db, current_user.id, order)
+    order_engine.add(RestingOrder(
+        new_order.id, current_user.id, new_order.symbol, new_order.side, new_order.order_type, new_order.quantity, new_order.trigger_price
+    ))
+    return order_as_dict(new_order)
+
+
+@app.get("/api/orders")
+async def open_orders(current_user: User = Depends(check_auth), db: AsyncSession = Depends(get_async_db)):
+    return [order_as_dict(order) for order in await AsyncOrderCRUD.get_open_orders(db, current_user.id)]
+
+
+@app.delete("/api/orders/{order_id}")
+async def cancel_order(order_id: int, current_user: User = Depends(check_auth), db: AsyncSession = Depends(get_async_db)):
+    try:
+        result = await AsyncOrderCRUD.cancel_order(db, current_user.id, order_id)
+    except HTTPException as e:
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code)
+    order_engine.cancel(order_id)
+    return result
+
+
+@app.get("/api/portfolio")
+async def portfolio_api(request: Request, current_user: User = Depends(check_auth), db: AsyncSession = Depends(get_async_db)):
+    # Дашборды опрашивают этот адрес: если портфель и эпоха цен не менялись - 304 после одного дешевого запроса
+    current = await AsyncPortfolioCRUD.get_portfolio_version(db, current_user.id)
+    if current is None:
+        return JSONResponse({"detail": "Portfolio not found"}, status_code=404)
+
+    epoch = price_epoch()
+    etag = portfolio_etag(current.id, current.version, epoch)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    body = portfolio_response_cache.get(etag)
+    if body is None:
+        valuation = await AsyncPortfolioCRUD.get_portfolio_valuation(db, current_user.id)
+        etag = portfolio_etag(valuation.portfolio_id, valuation.version, epoch) # портфель мог измениться между запросами
+        headers["ETag"] = etag
+        body = json.dumps(valuation.as_dict()).encode()
+        portfolio_response_cache.set(etag, body)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/stream/portfolio")
+async def portfolio_stream(request: Request, current_user: User = Depends(check_auth), db: AsyncSession = Depends(get_async_db)):
+    # SSE: цены активов пользователя и пересчитанная стоимость портфеля, без опроса со стороны браузера
+    holdings = await AsyncPortfolioCRUD.get_holdings(db, current_user.id)
+    await db.close() # соединение с БД не держим все время, пока открыт поток
+    prices = await get_crypto_prices_async(list(holdings))
+    subscription = price_broadcaster.subscribe(holdings)
+
+    async def events():
+        try:
+            yield sse_event("portfolio", portfolio_update(holdings, prices, holdings))
+            while not await request.is_disconnected():
+                batch = await subscription.next_batch(SSE_HEARTBEAT_SECONDS)
+                if not batch:
+                    yield ": ping\n\n"
+                    continue
+                prices.update(batch)
+                yield sse_event("portfolio", portfolio_update(holdings, prices, batch))
+        finally:
+            price_broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/api/portfolio/history")
+async def portfolio_history(range_name: str = Query("1d", alias="range"), current_user: User = Depends(check_auth), db: AsyncSession = Depends(get_async_db)):
+    if range_name not in RANGES:
+        return JSONResponse({"detail": f"range must be one of: {', '.join(RANGES)}"}, status_code=400)
+    return await get_portfolio_history(db, current_user.id, range_name)
+
+
+@app.get("/api/leaderboard")
+async def leaderboard_api(limit: int = Query(10, ge=1, le=LEADERBOARD_MAX_SIZE), current_user: User = Depends(check_auth), db: AsyncSession = Depends(get_async_db)):
+    # Чтение готового рейтинга из памяти - без пересчета портфелей и запросов цен
+    return {"updated_at": leaderboard.updated_at, "portfolios": await leaderboard.top(db, limit)}
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # Prometheus text format: латентность по маршрутам, фазы, SQL запросов и запросов цен на запрос, пул БД, кэш цен
+    return Response(content=render_metrics(pool_wait_stats, price_cache.stats()), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 @app.get("/calculate_total", response_class=PlainTextResponse)
 async def calculate_total(symbol: str, quantity: float = 0):
     if not symbol or quantity <= 0:
         return "0.00$"
 
-    price = get_crypto_price(symbol)
+    try:
+        price = await get_crypto_price_async(normalize_symbol(symbol))
+    except HTTPException as e:
+        return PlainTextResponse(e.detail, status_code=e.status_code) # опечатка в символе - 400 без похода в Binance
     total = quantity * price
     return f"{total:.2f}$"
 
@@ -245,5 +476,5 @@ if __name__ == "__main__":
 
     # @app.get("/crypto/{symbol}")
     # async def get_crypto_data(symbol: str, db: Session = Depends(get_db)):
-    #     price = get_crypto_price(symbol)
+    #     price = await get_crypto_price_async(symbol)
     #     return {"symbol": symbol, "price": f"{price} USD"}
\ No newline at end of file
@@ -0,0 +1,131 @@
+# Фоновый прием рыночных данных: поток цен -> таблица последних цен в памяти
+import asyncio
+import json
+import time
+
+import websockets
+
+from config import MARKET_FEED, MARKET_FEED_WS_URL, MARKET_FEED_REPLAY_INTERVAL_SECONDS
+
+
+class PriceTable:
+    # Последняя цена и время обновления по символу. Чтение O(1) и без блокировок: запись - замена кортежа целиком
+    def __init__(self):
+        self._prices = {}  # symbol -> (price, updated_at)
+        self._listeners = []  # вызываются на каждом обновлении (в потоке event loop)
+
+    def add_listener(self, listener):
+        # listener(symbol, price, updated_at) - должен быть быстрым, он выполняется прямо в обработке тика
+        self._listeners.append(listener)
+
+    def update(self, symbol: str, price: float, updated_at: float = None):
+        updated_at = time.time() if updated_at is None else updated_at
+        self._prices[symbol] = (price, updated_at)
+        for listener in self._listeners:
+            listener(symbol, price, updated_at)
+
+    def get(self, symbol: str, max_age: float = None):
+        # -> цена или None, если символа нет в потоке или цена старше max_age секунд
+        entry = self._prices.get(symbol)
+        if entry is None:
+            return None
+        if max_age is not None and time.time() - entry[1] > max_age:
+            return None
+        return entry[0]
+
+    def staleness(self, symbol: str):
+        # -> сколько секунд назад обновлялась цена (None - символа нет в потоке)
+        entry = self._prices.get(symbol)
+        if entry is None:
+            return None
+        return max(0.0, time.time() - entry[1])
+
+    def symbols(self):
+        return list(self._prices)
+
+    def __len__(self):
+        return len(self._prices)
+
+
+async def binance_ticker_feed(url: str):
+    # Поток !miniTicker@arr: раз в секунду массив {"s": "BTCUSDT", "c": "65000.1", "E": 1700000000000, ...}
+    delay = 1
+    while True:
+        try:
+            async with websockets.connect(url, ping_interval=20) as ws:
+                delay = 1
+                async for message in ws:
+                    for ticker in json.loads(message):
+                        pair = ticker["s"]
+                        if pair.endswith("USDT"):
+                            yield pair[:-4], float(ticker["c"]), ticker["E"] / 1000
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Market feed disconnected: {e}")
+            await asyncio.sleep(delay) # переподключаемся с растущей паузой
+            delay = min(delay * 2, 30)
+
+
+async def file_replay_feed(path: str, interval: float = MARKET_FEED_REPLAY_INTERVAL_SECONDS):
+    # Локальная замена потока: JSONL со строками {"symbol": "BTC", "price": 65000.1, "ts": 1700000000.0}
+    # Время из файла задает паузы между строками, файл проигрывается по кругу
+    while True:
+        previous_ts = None
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                ts = row.get("ts")
+                if previous_ts is None or ts is None:
+                    pause = 0 if previous_ts is None else interval
+                else:
+                    pause = max(0.0, ts - previous_ts)
+                previous_ts = ts
+                if pause:
+                    await asyncio.sleep(pause)
+                yield row["symbol"], float(row["price"]), time.time()
+
+
+def feed_from_config(feed: str = MARKET_FEED):
+    if feed == "binance":
+        return binance_ticker_feed(MARKET_FEED_WS_URL)
+    if feed.startswith("file:"):
+        return file_replay_feed(feed[len("file:"):])
+    return None
+
+
+class MarketDataIngester:
+    # Фоновая задача, которая читает поток и обновляет таблицу цен
+    def __init__(self, table: PriceTable):
+        self.table = table
+        self._task = None
+
+    def start(self, feed=None):
+        feed = feed if feed is not None else feed_from_config()
+        if feed is None or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(feed))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, feed):
+        try:
+            async for symbol, price, updated_at in feed:
+                self.table.update(symbol, price, updated_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Market data ingester stopped: {e}") # эндпоинты продолжат работать через HTTP fallback
+
+
+price_table = PriceTable()
+market_data_ingester = MarketDataIngester(price_table)
@@ -0,0 +1,240 @@
+# 📊 Метрики запросов: фазы (БД, цены, шаблон), гистограммы по маршрутам и счетчики, текст для Prometheus (/metrics)
+# Текущий запрос хранится в contextvar - span()/count() из любого места (CRUD, crypto_service) пишут в него без передачи аргументов.
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PHASES = ("db", "price", "template", "auth")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestMetrics:
+    # Время по фазам и счетчики одного запроса. Фаза считается по настенным часам: пока открыт хотя бы один ее span.
+    # Параллельные span'ы (asyncio.gather по символам) и вложенные span'ы той же фазы не складываются.
+    # busy - время, когда открыта хоть какая-то фаза: auth включает свои запросы к БД, и "other" не вычитает их дважды
+    __slots__ = ("started", "spans", "counters", "busy", "_open", "_opened_at", "_busy_open", "_busy_since")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = dict.fromkeys(PHASES, 0.0)
+        self.counters = {"db_queries": 0, "price_fetches": 0}
+        self.busy = 0.0
+        self._open = dict.fromkeys(PHASES, 0)  # фаза -> сколько ее span'ов открыто сейчас
+        self._opened_at = {}
+        self._busy_open = 0
+        self._busy_since = 0.0
+
+    def enter(self, phase: str):
+        now = time.perf_counter()
+        if not self._open.get(phase):
+            self._opened_at[phase] = now
+        self._open[phase] = self._open.get(phase, 0) + 1
+        if not self._busy_open:
+            self._busy_since = now
+        self._busy_open += 1
+
+    def exit(self, phase: str):
+        now = time.perf_counter()
+        self._open[phase] -= 1
+        if not self._open[phase]:
+            self.spans[phase] = self.spans.get(phase, 0.0) + now - self._opened_at[phase]
+        self._busy_open -= 1
+        if not self._busy_open:
+            self.busy += now - self._busy_since
+
+
+_current = ContextVar("request_metrics", default=None)
+
+
+@contextmanager
+def span(phase: str):
+    # Время блока добавляется к фазе текущего запроса; вне запроса (фоновые задачи, скрипты) ничего не делает
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    metrics.enter(phase)
+    try:
+        yield
+    finally:
+        metrics.exit(phase)
+
+
+def count(counter: str, amount: int = 1):
+    totals.inc(counter, amount)
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.counters[counter] = metrics.counters.get(counter, 0) + amount
+
+
+class Histogram:
+    # Гистограмма с метками: {labels: (счетчики корзин, сумма, количество)}
+    def __init__(self, name: str, help_text: str, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self, label_names: tuple) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, (list(counts), total, n)) for labels, (counts, total, n) in self._series.items())
+        for labels, (counts, total, n) in series:
+            base = _labels(label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="+Inf"}} {n}')
+            lines.append(f"{self.name}_sum{{{base}}} {total}")
+            lines.append(f"{self.name}_count{{{base}}} {n}")
+        return lines
+
+
+class Counters:
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, key, amount: int = 1):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+request_duration = Histogram("http_request_duration_seconds", "Request latency by route", LATENCY_BUCKETS)
+phase_duration = Histogram("http_request_phase_seconds", "Time spent per phase within a request", LATENCY_BUCKETS)
+db_queries = Histogram("http_request_db_queries", "SQL statements executed per request", COUNT_BUCKETS)
+price_fetches = Histogram("http_request_price_fetches", "Upstream price API calls per request", COUNT_BUCKETS)
+requests_total = Counters()  # (method, route, status) -> количество
+totals = Counters()  # db_queries / price_fetches за все время, включая фоновые задачи
+
+
+def route_of(scope: dict) -> str:
+    # Шаблон маршрута (/api/portfolio/history), а не сам путь - метки не размножаются по id и параметрам
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def start_request():
+    # -> (метрики, токен для finish_request)
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def finish_request(metrics: RequestMetrics, token, method: str, route: str, status: int, streaming: bool = False) -> dict:
+    # Записывает запрос в гистограммы -> {фаза: секунды} для заголовка Server-Timing
+    # streaming - ответ-поток (SSE): живет минуты, в гистограммах задержки он только исказил бы хвост - там его нет
+    _current.reset(token)
+    elapsed = time.perf_counter() - metrics.started
+    spans = dict(metrics.spans)
+    spans["other"] = max(0.0, elapsed - metrics.busy) # все, что вне фаз (auth уже включает свои запросы к БД)
+    spans["total"] = elapsed
+
+    if not streaming:
+        request_duration.observe((method, route), elapsed)
+        for phase, seconds in spans.items():
+            if phase != "total":
+                phase_duration.observe((route, phase), seconds)
+    db_queries.observe((route,), metrics.counters["db_queries"])
+    price_fetches.observe((route,), metrics.counters["price_fetches"])
+    requests_total.inc((method, route, status))
+    return spans
+
+
+def server_timing(spans: dict) -> str:
+    return ", ".join(f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in spans.items())
+
+
+def instrument_engine(engine):
+    # Каждый SQL запрос: +1 к счетчику и его время в фазу "db" текущего запроса
+    # На соединении запоминаем метрики, в которые открыт span - запрос закрывается в них же
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        metrics = _current.get()
+        conn.info.setdefault("query_metrics", []).append(metrics)
+        if metrics is not None:
+            metrics.enter("db")
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        metrics = conn.info["query_metrics"].pop()
+        count("db_queries")
+        if metrics is not None:
+            metrics.exit("db")
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        # Упавший запрос не доходит до after_cursor_execute - закрываем его span здесь
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_metrics"):
+            metrics = connection.info["query_metrics"].pop()
+            if metrics is not None:
+                metrics.exit("db")
+
+
+def _gauge(name: str, help_text: str, value, kind: str = "gauge") -> list:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+
+def render_metrics(pool_waits: dict, price_cache_stats: dict) -> str:
+    lines = []
+    lines += request_duration.render(("method", "route"))
+    lines += phase_duration.render(("route", "phase"))
+    lines += db_queries.render(("route",))
+    lines += price_fetches.render(("route",))
+
+    lines += ["# HELP http_requests_total Requests by route and status", "# TYPE http_requests_total counter"]
+    for labels, value in sorted(requests_total.snapshot().items()):
+        lines.append(f"http_requests_total{{{_labels(('method', 'route', 'status'), labels)}}} {value}")
+
+    total = totals.snapshot()
+    lines += _gauge("db_queries_total", "SQL statements executed by the process", total.get("db_queries", 0), "counter")
+    lines += _gauge("price_fetches_total", "Upstream price API calls made by the process", total.get("price_fetches", 0), "counter")
+
+    # Ожидание соединения из пула (storage.PoolWaitStats хранит некумулятивные корзины)
+    lines += ["# HELP db_pool_wait_seconds Time waiting for a pooled connection", "# TYPE db_pool_wait_seconds histogram"]
+    for pool, stats in sorted(pool_waits.items()):
+        snapshot = stats.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(stats.BUCKETS, snapshot["buckets"].values()):
+            cumulative += bucket_count
+            lines.append(f'db_pool_wait_seconds_bucket{{pool="{pool}",le="{bound}"}} {cumulative}')
+        lines.append(f'db_pool_wait_seconds_bucket{{pool="{pool}",le="+Inf"}} {snapshot["checkouts"]}')
+        lines.append(f'db_pool_wait_seconds_sum{{pool="{pool}"}} {stats.total_wait}')
+        lines.append(f'db_pool_wait_seconds_count{{pool="{pool}"}} {snapshot["checkouts"]}')
+
+    lines += _gauge("price_cache_size", "Symbols held in the price cache", price_cache_stats["size"])
+    lines += _gauge("price_cache_in_flight", "Price loads in progress", price_cache_stats["in_flight"])
+    for key in ("hits", "misses", "stale_serves"):
+        lines += _gauge(f"price_cache_{key}_total", f"Price cache {key.replace('_', ' ')}", price_cache_stats[key], "counter")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,133 @@
+# 🧱 Версионные миграции схемы: migrations/mNNNN_*.py применяются по порядку, версия хранится в schema_version
+# Запуск: python migrate.py (применить новые) | python migrate.py --status
+import argparse
+import importlib
+import os
+import pkgutil
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import inspect, text, Table, Column, Integer, String, DateTime, MetaData, select, insert
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировки, миграции запускает один процесс
+    fcntl = None
+
+import migrations
+
+MIGRATION_LOCK_PATH = os.path.join(tempfile.gettempdir(), "schema_migrations.lock")
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime),
+)
+
+
+def load_migrations() -> list:
+    # -> [модуль с VERSION, DESCRIPTION, upgrade(connection)] по возрастанию версии
+    modules = [
+        importlib.import_module(f"migrations.{info.name}")
+        for info in pkgutil.iter_modules(migrations.__path__)
+        if info.name.startswith("m")
+    ]
+    modules.sort(key=lambda module: module.VERSION)
+    versions = [module.VERSION for module in modules]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f"Duplicate migration versions: {versions}")
+    return modules
+
+
+def applied_versions(connection) -> set:
+    schema_version.create(connection, checkfirst=True)
+    return set(connection.execute(select(schema_version.c.version)).scalars())
+
+
+@contextmanager
+def migration_lock(lock_path: str):
+    # Воркеры uvicorn стартуют одновременно и все вызывают run_migrations: flock пропускает по одному,
+    # остальные ждут и потом видят уже примененные версии. Умер процесс - ядро снимает блокировку
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def run_migrations(engine, lock_path: str = MIGRATION_LOCK_PATH) -> list:
+    # Каждая миграция - в своей транзакции вместе с записью версии; версия перепроверяется внутри нее
+    # (на серверной БД с другой машины flock не виден - там второй упадет на первичном ключе schema_version и откатится)
+    applied = []
+    with migration_lock(lock_path):
+        for module in load_migrations():
+            with engine.begin() as connection:
+                if module.VERSION in applied_versions(connection):
+                    continue
+                module.upgrade(connection)
+                connection.execute(insert(schema_version).values(
+                    version=module.VERSION, description=module.DESCRIPTION, applied_at=datetime.utcnow()
+                ))
+            print(f"Applied migration {module.VERSION:04d}: {module.DESCRIPTION}")
+            applied.append(module.VERSION)
+    return applied
+
+
+# --- Помощники для миграций: проверяют текущую схему, поэтому миграции можно безопасно применять к старым базам ---
+
+def has_table(connection, table: str) -> bool:
+    return inspect(connection).has_table(table)
+
+
+def has_column(connection, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(connection).get_columns(table))
+
+
+def has_index(connection, table: str, index: str) -> bool:
+    return any(i["name"] == index for i in inspect(connection).get_indexes(table))
+
+
+def is_unique_index(connection, table: str, index: str) -> bool:
+    return any(i["name"] == index and i["unique"] for i in inspect(connection).get_indexes(table))
+
+
+def add_column(connection, table: str, column_ddl: str):
+    # column_ddl: "cost_basis FLOAT DEFAULT 0"
+    column = column_ddl.split()[0]
+    if not has_column(connection, table, column):
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column_ddl}"))
+
+
+def create_index(connection, table: str, index: str, columns: list, unique: bool = False):
+    if not has_index(connection, table, index):
+        connection.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX {index} ON {table} ({', '.join(columns)})"))
+
+
+def drop_index(connection, table: str, index: str):
+    if has_index(connection, table, index):
+        connection.execute(text(f"DROP INDEX {index}"))
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--status", action="store_true", help="показать примененные и ожидающие миграции")
+    args = parser.parse_args()
+
+    if args.status:
+        with engine.begin() as connection:
+            done = applied_versions(connection)
+        for module in load_migrations():
+            print(f"{module.VERSION:04d} {'applied' if module.VERSION in done else 'pending':8} {module.DESCRIPTION}")
+    else:
+        applied = run_migrations(engine)
+        print(f"{len(applied)} migration(s) applied")
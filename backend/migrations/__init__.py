@@ -0,0 +1 @@
+# Миграции схемы: mNNNN_описание.py с VERSION, DESCRIPTION и upgrade(connection). Запускает migrate.py
@@ -0,0 +1,84 @@
+# Базовая схема: создает недостающие таблицы и дотягивает базы, созданные до журнала сделок и P&L
+# Таблицы описаны здесь явно, на момент версии 1 - изменения моделей сюда не попадают, для них есть следующие миграции
+from sqlalchemy import text, MetaData, Table, Column, Index, ForeignKey, Integer, String, Float, DateTime
+
+from migrate import has_table, add_column
+
+VERSION = 1
+DESCRIPTION = "baseline schema, ledger timestamp and cost basis columns"
+
+metadata = MetaData()
+
+Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String, unique=True, index=True),
+    Column("password", String),
+    Column("email", String, unique=True, index=True),
+)
+
+Table(
+    "portfolio", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), index=True, unique=True),
+    Column("total_added_money", Float),
+    Column("available_money", Float),
+)
+
+Table(
+    "assets", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("portfolio_id", Integer, ForeignKey("portfolio.id")),
+    Column("symbol", String),
+    Column("quantity", Float),
+    Column("cost_basis", Float),
+    Index("ix_assets_portfolio_symbol", "portfolio_id", "symbol", unique=True),
+)
+
+Table(
+    "asset_lots", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("portfolio_id", Integer, ForeignKey("portfolio.id"), nullable=False),
+    Column("symbol", String, nullable=False),
+    Column("quantity", Float, nullable=False),
+    Column("price", Float, nullable=False),
+    Column("opened_at", DateTime, nullable=False),
+    Index("ix_asset_lots_portfolio_symbol", "portfolio_id", "symbol", "id"),
+)
+
+Table(
+    "transactions", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("portfolio_id", Integer, ForeignKey("portfolio.id")),
+    Column("transaction_type", String),
+    Column("symbol", String),
+    Column("quantity", Float),
+    Column("price", Float),
+    Column("timestamp", DateTime, nullable=False),
+    Index("ix_transactions_portfolio_timestamp", "portfolio_id", "timestamp"),
+)
+
+Table(
+    "portfolio_snapshots", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("portfolio_id", Integer, ForeignKey("portfolio.id"), nullable=False),
+    Column("resolution", Integer, nullable=False),
+    Column("bucket_start", Integer, nullable=False),
+    Column("value", Float, nullable=False),
+    Column("value_min", Float, nullable=False),
+    Column("value_max", Float, nullable=False),
+    Index("ix_portfolio_snapshots_portfolio_bucket", "portfolio_id", "resolution", "bucket_start", unique=True),
+)
+
+
+def upgrade(connection):
+    legacy_transactions = has_table(connection, "transactions")
+    metadata.create_all(bind=connection) # только отсутствующие таблицы, существующие не меняются
+
+    # Базы, созданные до журнала: date (строка) -> timestamp
+    add_column(connection, "transactions", "timestamp DATETIME")
+    if legacy_transactions:
+        connection.execute(text("UPDATE transactions SET timestamp = CURRENT_TIMESTAMP WHERE timestamp IS NULL"))
+
+    # Базы, созданные до P&L: cost basis неизвестен (NULL) - на странице будет "****" до pnl_backfill.py
+    add_column(connection, "assets", "cost_basis FLOAT")
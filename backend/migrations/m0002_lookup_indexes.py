@@ -0,0 +1,43 @@
+# Индексы под поиск актива по (portfolio_id, symbol) и журнала по портфелю + уникальность
+from sqlalchemy import text
+
+from migrate import create_index, drop_index, is_unique_index
+
+VERSION = 2
+DESCRIPTION = "unique assets(portfolio_id, symbol), transactions(portfolio_id, timestamp), unique portfolio(user_id)"
+
+
+def _merge_duplicate_assets(connection):
+    # Дубликаты одного символа в портфеле сливаем в строку с меньшим id, иначе уникальный индекс не создать
+    # Cost basis хотя бы одной строки неизвестен (NULL) - неизвестен и у итоговой: SUM пропустил бы NULL и занизил его
+    duplicates = connection.execute(text(
+        "SELECT portfolio_id, symbol, MIN(id), SUM(quantity), "
+        "CASE WHEN COUNT(cost_basis) = COUNT(*) THEN SUM(cost_basis) END "
+        "FROM assets GROUP BY portfolio_id, symbol HAVING COUNT(*) > 1"
+    )).all()
+    for portfolio_id, symbol, keep_id, quantity, cost_basis in duplicates:
+        connection.execute(
+            text("UPDATE assets SET quantity = :quantity, cost_basis = :cost_basis WHERE id = :id"),
+            {"quantity": quantity, "cost_basis": cost_basis, "id": keep_id},
+        )
+        connection.execute(
+            text("DELETE FROM assets WHERE portfolio_id = :portfolio_id AND symbol = :symbol AND id != :id"),
+            {"portfolio_id": portfolio_id, "symbol": symbol, "id": keep_id},
+        )
+
+
+def upgrade(connection):
+    _merge_duplicate_assets(connection)
+    create_index(connection, "assets", "ix_assets_portfolio_symbol", ["portfolio_id", "symbol"], unique=True)
+
+    # Индекс с portfolio_id в начале обслуживает и поиск по портфелю, и историю по времени
+    create_index(connection, "transactions", "ix_transactions_portfolio_timestamp", ["portfolio_id", "timestamp"])
+
+    duplicate_users = connection.execute(text(
+        "SELECT user_id FROM portfolio GROUP BY user_id HAVING COUNT(*) > 1"
+    )).scalars().all()
+    if duplicate_users:
+        raise RuntimeError(f"Users with more than one portfolio, resolve manually: {duplicate_users}")
+    if not is_unique_index(connection, "portfolio", "ix_portfolio_user_id"):
+        drop_index(connection, "portfolio", "ix_portfolio_user_id") # обычный индекс меняем на уникальный
+        create_index(connection, "portfolio", "ix_portfolio_user_id", ["user_id"], unique=True)
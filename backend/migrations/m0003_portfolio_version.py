@@ -0,0 +1,9 @@
+# Версия портфеля для ETag в /api/portfolio
+from migrate import add_column
+
+VERSION = 3
+DESCRIPTION = "portfolio.version row counter"
+
+
+def upgrade(connection):
+    add_column(connection, "portfolio", "version INTEGER NOT NULL DEFAULT 0")
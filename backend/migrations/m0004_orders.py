@@ -0,0 +1,30 @@
+# Отложенные limit/stop ордера
+from sqlalchemy import MetaData, Table, Column, Index, ForeignKey, Integer, String, Float, DateTime
+
+VERSION = 4
+DESCRIPTION = "orders table for resting limit and stop orders"
+
+metadata = MetaData()
+Table("users", metadata, Column("id", Integer, primary_key=True)) # только для внешнего ключа, не создается
+
+orders = Table(
+    "orders", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("symbol", String, nullable=False),
+    Column("side", String, nullable=False),
+    Column("order_type", String, nullable=False),
+    Column("quantity", Float, nullable=False),
+    Column("trigger_price", Float, nullable=False),
+    Column("status", String, nullable=False),
+    Column("detail", String),
+    Column("fill_price", Float),
+    Column("created_at", DateTime, nullable=False),
+    Column("closed_at", DateTime),
+    Index("ix_orders_status_symbol", "status", "symbol"),
+    Index("ix_orders_user_status", "user_id", "status"),
+)
+
+
+def upgrade(connection):
+    orders.create(connection, checkfirst=True) # вместе с индексами
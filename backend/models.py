@@ -1,10 +1,10 @@
 # Описание структуры таблиц в базе данных
 
-from sqlalchemy import ForeignKey
-from sqlalchemy import Column, Integer, String, Float
+from datetime import datetime
+from sqlalchemy import ForeignKey, Index
+from sqlalchemy import Column, Integer, String, Float, DateTime
 from sqlalchemy.orm import relationship
 from  database import Base
-from crypto_service import get_crypto_price
 
 class User(Base):
     __tablename__ = "users"
@@ -20,9 +20,10 @@ class Portfolio(Base):
     __tablename__ = "portfolio"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, unique=True) # у пользователя ровно один портфель
     total_added_money = Column(Float, default=0)
     available_money = Column(Float, default=0)
+    version = Column(Integer, default=0, nullable=False) # растет при каждом изменении портфеля и его активов (для ETag)
 
     user = relationship("User", back_populates="portfolio")
     assets = relationship("Asset", back_populates="portfolio")
@@ -42,18 +43,6 @@ class Portfolio(Base):
             'user_id': f"{self.user_id}"
         }
 
-    @property
-    def total_portfolio_value(self):
-       total_val = 0
-       for asset in self.assets:
-           current_price = get_crypto_price(asset.symbol)
-           total_val += asset.quantity * current_price
-       return total_val
-
-    @property
-    def total_portfolio_value_display(self):
-        return f"{self.total_portfolio_value:,.2f}" #Возвращает отформатированное значение с разделителями
-
     @property
     def get_all_assets(self):
         return [asset.symbol for asset in self.assets]
@@ -62,15 +51,42 @@ class Portfolio(Base):
 
 class Asset(Base):
     __tablename__ = "assets"
+    __table_args__ = (
+        Index("ix_assets_portfolio_symbol", "portfolio_id", "symbol", unique=True), # поиск актива в сделках + защита от дублей
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     portfolio_id = Column(Integer, ForeignKey("portfolio.id"))
     symbol = Column(String)
     quantity = Column(Float)
+    cost_basis = Column(Float) # сколько заплачено за текущее количество (метод средней цены); NULL - неизвестен, без default 0
     portfolio = relationship("Portfolio", back_populates="assets")
 
+    @property
+    def average_cost(self):
+        return self.cost_basis / self.quantity if self.quantity else 0.0
+
+
+class AssetLot(Base):
+    # Лоты покупок для FIFO: при продаже закрываются от самого старого к новому
+    __tablename__ = "asset_lots"
+    __table_args__ = (
+        Index("ix_asset_lots_portfolio_symbol", "portfolio_id", "symbol", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    portfolio_id = Column(Integer, ForeignKey("portfolio.id"), nullable=False)
+    symbol = Column(String, nullable=False)
+    quantity = Column(Float, nullable=False) # остаток лота
+    price = Column(Float, nullable=False)
+    opened_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
 class Transaction(Base):
+    # Журнал операций (только добавление): deposit / buy / sell
     __tablename__ = "transactions"
+    __table_args__ = (
+        Index("ix_transactions_portfolio_timestamp", "portfolio_id", "timestamp"), # история портфеля по времени
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     portfolio_id = Column(Integer, ForeignKey("portfolio.id"))
@@ -78,6 +94,44 @@ class Transaction(Base):
     symbol = Column(String)
     quantity = Column(Float)
     price = Column(Float)
-    date = Column(String)
-
-    portfolio = relationship("Portfolio", back_populates="transactions")
\ No newline at end of file
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    portfolio = relationship("Portfolio", back_populates="transactions")
+
+
+class Order(Base):
+    # Отложенные ордера: limit (купить дешевле / продать дороже) и stop (stop-loss / покупка на пробое)
+    __tablename__ = "orders"
+    __table_args__ = (
+        Index("ix_orders_status_symbol", "status", "symbol"), # загрузка открытых ордеров при старте
+        Index("ix_orders_user_status", "user_id", "status"), # ордера пользователя
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    symbol = Column(String, nullable=False)
+    side = Column(String, nullable=False) # buy / sell
+    order_type = Column(String, nullable=False) # limit / stop
+    quantity = Column(Float, nullable=False)
+    trigger_price = Column(Float, nullable=False)
+    status = Column(String, nullable=False, default="open") # open / filled / rejected / cancelled
+    detail = Column(String) # причина отказа
+    fill_price = Column(Float)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    closed_at = Column(DateTime)
+
+
+class PortfolioSnapshot(Base):
+    # Стоимость портфеля (деньги + активы) во временной корзине: 60 - минута, 3600 - час, 86400 - день
+    __tablename__ = "portfolio_snapshots"
+    __table_args__ = (
+        Index("ix_portfolio_snapshots_portfolio_bucket", "portfolio_id", "resolution", "bucket_start", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    portfolio_id = Column(Integer, ForeignKey("portfolio.id"), nullable=False)
+    resolution = Column(Integer, nullable=False) # размер корзины в секундах
+    bucket_start = Column(Integer, nullable=False) # unix time начала корзины
+    value = Column(Float, nullable=False) # последнее значение в корзине
+    value_min = Column(Float, nullable=False)
+    value_max = Column(Float, nullable=False)
@@ -0,0 +1,104 @@
+# ⏳ Движок отложенных ордеров: индекс порогов в памяти (triggers.py) + исполнение сработавших через AsyncOrderCRUD
+# Тик цены (price_table) только снимает пересеченные пороги и ставит ордера в очередь - сделки выполняют фоновые воркеры.
+import asyncio
+
+from config import ORDER_EXECUTION_WORKERS, STREAM_POLL_INTERVAL_SECONDS
+from crud_async import AsyncOrderCRUD
+from crypto_service import get_crypto_prices_async, publish_polled_prices
+from database import AsyncSessionLocal
+from market_data import price_table
+from triggers import TriggerIndex, RestingOrder
+
+
+class OrderEngine:
+    def __init__(self, table, workers: int, poll_interval: float):
+        self.table = table
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.index = TriggerIndex()
+        self.executed = 0
+        self.rejected = 0
+        self._queue = asyncio.Queue()  # (RestingOrder, цена срабатывания)
+        self._tasks = []
+        table.add_listener(self._on_tick)
+
+    def _on_tick(self, symbol: str, price: float, updated_at: float):
+        # Выполняется прямо в обработке тика: только извлечение из куч, без await
+        for order in self.index.pop_triggered(symbol, price):
+            self._queue.put_nowait((order, price))
+
+    def add(self, order: RestingOrder):
+        self.index.add(order)
+        price = self.table.get(order.symbol, self.poll_interval)
+        if price is not None and order.crossed(price): # порог уже пересечен - не ждем следующего тика
+            self._on_tick(order.symbol, price, None)
+
+    def cancel(self, order_id: int):
+        self.index.remove(order_id)
+
+    async def load(self, session_factory=AsyncSessionLocal) -> int:
+        # Открытые ордера из БД -> индекс (при старте)
+        orders = []
+        async with session_factory() as db:
+            async for rows in AsyncOrderCRUD.stream_open_orders(db):
+                orders.extend(RestingOrder(*row) for row in rows)
+        self.index.load(orders)
+        return len(orders)
+
+    async def start(self):
+        if self._tasks:
+            return
+        loaded = await self.load()
+        print(f"Loaded {loaded} resting orders")
+        self._tasks = [asyncio.create_task(self._execute()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._poll()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _execute(self):
+        while True:
+            order, price = await self._queue.get()
+            try:
+                async with AsyncSessionLocal() as db:
+                    status = await AsyncOrderCRUD.execute_order(db, order, price)
+                if status == "filled":
+                    self.executed += 1
+                elif status == "rejected":
+                    self.rejected += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Ордер остался open в БД - возвращаем в индекс, сработает на следующем тике
+                print(f"Order {order.id} execution failed: {e}")
+                self.index.add(order)
+            finally:
+                self._queue.task_done()
+
+    async def _poll(self):
+        # Символы ордеров, которых нет в потоке рыночных данных, опрашиваются одним пакетным запросом
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            stale = []
+            for symbol in self.index.symbols():
+                staleness = self.table.staleness(symbol)
+                if staleness is None or staleness > self.poll_interval:
+                    stale.append(symbol)
+            if not stale:
+                continue
+            try:
+                prices = await get_crypto_prices_async(stale, max_age=self.poll_interval)
+            except Exception as e:
+                print(f"Order price poll failed: {e}")
+                continue
+            publish_polled_prices(prices) # запись в таблицу вызовет _on_tick
+
+
+order_engine = OrderEngine(price_table, ORDER_EXECUTION_WORKERS, STREAM_POLL_INTERVAL_SECONDS)
@@ -0,0 +1,120 @@
+# 🔑 Хэширование паролей: scrypt из стандартной библиотеки (memory-hard, без новых зависимостей)
+# Формат: scrypt$n$r$p$salt$hash (base64). Строки без префикса - старые пароли открытым текстом, при входе перехэшируются.
+# Один хэш ~ десятки-сотни мс CPU, поэтому в async эндпоинтах он выполняется в ограниченном пуле потоков
+# (hashlib.scrypt отпускает GIL), а при переполненной очереди запрос сразу получает 503 вместо ожидания.
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from config import PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE
+
+PREFIX = "scrypt"
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=HASH_BYTES, maxmem=256 * n * r + (1 << 20))
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def hash_password(password: str, n: int = PASSWORD_SCRYPT_N, r: int = PASSWORD_SCRYPT_R, p: int = PASSWORD_SCRYPT_P) -> str:
+    salt = os.urandom(SALT_BYTES)
+    return f"{PREFIX}${n}${r}${p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}"
+
+
+def is_hashed(stored: str) -> bool:
+    return stored is not None and stored.startswith(PREFIX + "$")
+
+
+def verify_password(password: str, stored: str) -> tuple:
+    # -> (пароль верный, нужно перехэшировать: старая строка открытым текстом или другие параметры scrypt)
+    if stored is None:
+        return False, False
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode(), stored.encode()), True
+    try:
+        _, n, r, p, salt, expected = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        ok = hmac.compare_digest(_scrypt(password, _unb64(salt), n, r, p), _unb64(expected))
+    except ValueError:
+        return False, False
+    return ok, ok and (n, r, p) != (PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P)
+
+
+# Хэш для несуществующего пользователя: время ответа не выдает, есть ли такой логин
+_DUMMY_HASH = None
+
+
+def _dummy_hash() -> str:
+    global _DUMMY_HASH
+    if _DUMMY_HASH is None:
+        _DUMMY_HASH = hash_password(os.urandom(8).hex())
+    return _DUMMY_HASH
+
+
+def _verify_or_dummy(password: str, stored: str) -> tuple:
+    if stored is None:
+        verify_password(password, _dummy_hash())
+        return False, False
+    return verify_password(password, stored)
+
+
+class PasswordHasherPool:
+    # Потоки для scrypt + лимит очереди: сверх workers + max_queue задач - HTTPException 503 без ожидания
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+        self._pending = 0  # в работе + в очереди; уменьшается, когда поток закончил хэш (под _lock)
+        self._lock = threading.Lock()
+        self.shed = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.shed += 1
+                raise HTTPException(status_code=503, detail="Authentication is busy, retry shortly", headers={"Retry-After": "1"})
+            self._pending += 1
+        # Место освобождается, когда задача в пуле завершилась или снята из очереди, а не когда запрос отменили:
+        # отмененный запрос не останавливает уже идущий scrypt, и поток пула все еще занят
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, password: str, stored: str) -> tuple:
+        return await self._run(_verify_or_dummy, password, stored)
+
+    def hash_many(self, passwords: list) -> list:
+        # Пакетный импорт (офлайн, не запрос): хэши всей пачки параллельно на потоках пула, без лимита очереди, порядок сохраняется
+        return list(self._executor.map(hash_password, passwords))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_pool = PasswordHasherPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
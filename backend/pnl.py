@@ -0,0 +1,29 @@
+# 📈 Прибыль/убыток: cost basis обновляется на каждой сделке, поэтому на странице ничего не пересчитывается по истории
+EPSILON = 1e-12
+
+
+def fifo_consume(lots, quantity: float):
+    # lots: [(id, quantity, price), ...] от старых к новым -> (закрытые id, (id, новый остаток) | None, стоимость закрытого)
+    closed = []
+    partial = None
+    consumed_cost = 0.0
+    remaining = quantity
+    for lot_id, lot_quantity, lot_price in lots:
+        if remaining <= EPSILON:
+            break
+        take = min(lot_quantity, remaining)
+        consumed_cost += take * lot_price
+        remaining -= take
+        if lot_quantity - take <= EPSILON:
+            closed.append(lot_id)
+        else:
+            partial = (lot_id, lot_quantity - take)
+    return closed, partial, consumed_cost
+
+
+def performance(total_value: float, cost_basis):
+    # -> (прибыль в $, прибыль в %) или (None, None), если cost basis неизвестен (старые записи)
+    if cost_basis is None or cost_basis <= 0:
+        return None, None
+    pnl_usd = total_value - cost_basis
+    return pnl_usd, pnl_usd / cost_basis * 100
@@ -0,0 +1,199 @@
+# 🧮 Пересборка cost basis из журнала операций сразу для многих портфелей (бэкфилл / аудит)
+# Метод средней цены считается векторно в NumPy, FIFO лоты - проходом по группам.
+# Можно запускать на работающем приложении: запись идет по группам, группы с параллельными сделками пропускаются.
+# Запуск: python pnl_backfill.py [--dry-run] [--chunk-size 500]
+import argparse
+from collections import defaultdict
+from itertools import count
+
+import numpy as np
+from sqlalchemy import select, delete, insert, update
+
+from database import SessionLocal
+from models import Asset, AssetLot, Transaction
+from pnl import fifo_consume, EPSILON
+
+QUANTITY_TOLERANCE = 1e-9  # относительная погрешность сверки пересобранного количества с Asset.quantity
+
+
+def _segment_cumsum(values, segment_starts, segment_ids):
+    # Накопительная сумма, которая обнуляется в начале каждого сегмента
+    total = np.cumsum(values)
+    offsets = (total - values)[segment_starts]
+    return total - offsets[segment_ids]
+
+
+def _affine_scan(a, b):
+    # C_t = a_t * C_{t-1} + b_t для всех t сразу: префиксный скан композиций x -> a*x + b за log2(n) векторных проходов.
+    # a_t = 0 обрывает цепочку (начало сегмента). Только умножения и сложения: произведения a уходят в 0, а не в inf/nan
+    a = a.copy()
+    cost = b.copy()
+    step = 1
+    while step < len(a):
+        cost[step:] = a[step:] * cost[:-step] + cost[step:]
+        a[step:] = a[step:] * a[:-step]
+        step *= 2
+    return cost
+
+
+def rebuild_average_cost(group_ids, is_buy, quantities, prices):
+    # Все массивы отсортированы по (группа, время). Группа = (portfolio_id, symbol).
+    # Рекуррентность для cost basis C: покупка C = C + q*p, продажа C = C * Q_t / Q_{t-1}.
+    # Это C_t = a_t * C_{t-1} + b_t (_affine_scan); количество и прибыль - накопительными суммами.
+    # -> (количество, cost basis, реализованная прибыль) на последней строке каждой группы
+    group_ids = np.asarray(group_ids)
+    is_buy = np.asarray(is_buy, dtype=bool)
+    quantities = np.asarray(quantities, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+    n = len(group_ids)
+    if n == 0:
+        empty = np.empty(0)
+        return np.empty(0, dtype=group_ids.dtype), empty, empty, empty
+
+    group_start = np.ones(n, dtype=bool)
+    group_start[1:] = group_ids[1:] != group_ids[:-1]
+    group_start_index = np.flatnonzero(group_start)
+    group_of_row = np.cumsum(group_start) - 1
+
+    signed = np.where(is_buy, quantities, -quantities)
+    position = _segment_cumsum(signed, group_start_index, group_of_row)
+    previous_position = position - signed
+
+    b = np.where(is_buy, quantities * prices, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = np.where(is_buy, 1.0, np.where(previous_position > EPSILON, position / previous_position, 0.0))
+    a = np.clip(a, 0.0, None)
+    closes = a <= EPSILON  # позиция закрыта полностью - cost basis обнуляется
+
+    # Сегменты: начало группы или строка сразу после полного закрытия позиции
+    segment_start = group_start.copy()
+    segment_start[1:] |= closes[:-1]
+
+    cost = _affine_scan(np.where(segment_start, 0.0, a), b)
+    cost[closes] = 0.0
+
+    previous_cost = np.empty(n)
+    previous_cost[0] = 0.0
+    previous_cost[1:] = cost[:-1]
+    previous_cost[segment_start] = 0.0
+    realized = np.where(is_buy, 0.0, quantities * prices - (previous_cost - cost))
+    realized_total = _segment_cumsum(realized, group_start_index, group_of_row)
+
+    last = np.append(group_start_index[1:], n) - 1
+    return group_ids[last], position[last], cost[last], realized_total[last]
+
+
+def rebuild_fifo_lots(rows):
+    # rows: [(portfolio_id, symbol, transaction_type, quantity, price), ...] по времени -> {(portfolio_id, symbol): [(qty, price), ...]}
+    lots = defaultdict(list)
+    lot_ids = count()
+    for portfolio_id, symbol, transaction_type, quantity, price in rows:
+        key = (portfolio_id, symbol)
+        if transaction_type == "buy":
+            lots[key].append([next(lot_ids), quantity, price])
+            continue
+        closed, partial, _ = fifo_consume(lots[key], quantity)
+        closed = set(closed)
+        remaining = [lot for lot in lots[key] if lot[0] not in closed]
+        if partial:
+            for lot in remaining:
+                if lot[0] == partial[0]:
+                    lot[1] = partial[1]
+        lots[key] = remaining
+    return {key: [(quantity, price) for _, quantity, price in group] for key, group in lots.items() if group}
+
+
+def load_trades(db):
+    # Только сделки, отсортированные по (портфель, символ, время)
+    return db.execute(
+        select(Transaction.portfolio_id, Transaction.symbol, Transaction.transaction_type, Transaction.quantity, Transaction.price)
+        .where(Transaction.transaction_type.in_(("buy", "sell")))
+        .order_by(Transaction.portfolio_id, Transaction.symbol, Transaction.timestamp, Transaction.id)
+    ).all()
+
+
+def load_assets(db) -> dict:
+    # -> {(portfolio_id, symbol): quantity} - текущие позиции, с которыми сверяется пересборка
+    return {(portfolio_id, symbol): quantity for portfolio_id, symbol, quantity in db.execute(
+        select(Asset.portfolio_id, Asset.symbol, Asset.quantity)
+    ).all()}
+
+
+def matches(rebuilt: float, quantity: float) -> bool:
+    return abs(rebuilt - quantity) <= QUANTITY_TOLERANCE * max(1.0, abs(quantity))
+
+
+def backfill(db, dry_run: bool = False, chunk_size: int = 500) -> dict:
+    rows = load_trades(db)
+    if not rows:
+        return {"groups": 0, "trades": 0}
+
+    keys = {}
+    group_ids = np.fromiter((keys.setdefault((r[0], r[1]), len(keys)) for r in rows), dtype=np.int64, count=len(rows))
+    is_buy = np.fromiter((r[2] == "buy" for r in rows), dtype=bool, count=len(rows))
+    quantities = np.fromiter((r[3] for r in rows), dtype=np.float64, count=len(rows))
+    prices = np.fromiter((r[4] for r in rows), dtype=np.float64, count=len(rows))
+
+    groups, positions, costs, realized = rebuild_average_cost(group_ids, is_buy, quantities, prices)
+    key_of = {index: key for key, index in keys.items()}
+    lots = rebuild_fifo_lots(rows)
+
+    # Журнал полон, только если из него получается текущее количество. Актив куплен до журнала или пришел bulk импортом -
+    # история неполная, пересобранный cost basis был бы занижен: такой актив не трогаем (NULL остается NULL) и сообщаем о нем
+    assets = load_assets(db)
+    rebuilt, partial = [], []
+    for group, position, cost in zip(groups.tolist(), positions.tolist(), costs.tolist()):
+        key = key_of[group]
+        quantity = assets.get(key)
+        if quantity is None:
+            if position > EPSILON:
+                partial.append({"portfolio_id": key[0], "symbol": key[1], "rebuilt": position, "quantity": None})
+            continue # позиция закрыта - строки актива нет, писать некуда
+        if matches(position, quantity):
+            rebuilt.append((key, quantity, cost))
+        else:
+            partial.append({"portfolio_id": key[0], "symbol": key[1], "rebuilt": position, "quantity": quantity})
+
+    changed = []
+    if not dry_run:
+        # Пишем по группам короткими транзакциями, без глобального delete: сделки идут параллельно. UPDATE с условием
+        # "количество то же, что при чтении" блокирует строку актива до commit - продажа этого символа подождет;
+        # если сделка успела раньше, группа пропускается (ее журнал уже длиннее прочитанного)
+        for start in range(0, len(rebuilt), chunk_size):
+            for (portfolio_id, symbol), quantity, cost in rebuilt[start:start + chunk_size]:
+                updated = db.execute(
+                    update(Asset)
+                    .where(Asset.portfolio_id == portfolio_id, Asset.symbol == symbol, Asset.quantity == quantity)
+                    .values(cost_basis=cost)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                if not updated:
+                    changed.append({"portfolio_id": portfolio_id, "symbol": symbol})
+                    continue
+                db.execute(delete(AssetLot).where(AssetLot.portfolio_id == portfolio_id, AssetLot.symbol == symbol))
+                lot_rows = [
+                    {"portfolio_id": portfolio_id, "symbol": symbol, "quantity": lot_quantity, "price": price}
+                    for lot_quantity, price in lots.get((portfolio_id, symbol), [])
+                ]
+                if lot_rows:
+                    db.execute(insert(AssetLot), lot_rows)
+            db.commit()
+
+    return {
+        "groups": len(groups),
+        "trades": len(rows),
+        "rebuilt": len(rebuilt),
+        "partial_history": partial,
+        "changed_during_run": changed,
+        "realized_pnl": float(realized.sum()),
+        "open_lots": sum(len(group) for group in lots.values()),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--chunk-size", type=int, default=500, help="групп (портфель, символ) в одной транзакции")
+    args = parser.parse_args()
+    with SessionLocal() as db:
+        print(backfill(db, dry_run=args.dry_run, chunk_size=args.chunk_size))
@@ -0,0 +1,293 @@
+# 🧮 Общая для всех воркеров uvicorn доска цен в shared memory: один выбранный процесс пишет, все читают без блокировок
+# Раскладка (little-endian):
+#   заголовок 64 байта: magic "PRICEBRD", версия, число слотов, число слотов запросов
+#   слоты по 64 байта:  seq (u64) | symbol (16 байт ASCII) | price (f64) | updated_at (f64)
+#   слоты запросов:     symbol (16 байт) | requested_at (f64) - читатели отмечают символы, которые им нужны
+# Слот символа выбирается crc32(symbol) с линейным пробированием; занятый слот не освобождается, поэтому поиск стабилен.
+# Seqlock: писатель делает seq нечетным, пишет поля, делает seq четным. Читатель повторяет чтение, если seq нечетный
+# или изменился за время чтения - разорванная пара (цена от одного обновления, время от другого) не возвращается.
+# Писатель выбирается через flock на файле блокировки: умер писатель - ядро снимает блокировку, ее берет другой воркер.
+import asyncio
+import os
+import struct
+import tempfile
+import time
+import zlib
+from multiprocessing import shared_memory
+
+try:
+    import fcntl
+except ImportError:  # Windows: доска работает только на чтение из уже созданного сегмента
+    fcntl = None
+
+from config import PRICE_BOARD_NAME, PRICE_BOARD_SLOTS, PRICE_BOARD_REFRESH_SECONDS, PRICE_BOARD_WANT_TTL_SECONDS
+from config import PRICE_BOARD_RENEW_SECONDS
+from market_data import price_table
+from symbols import symbol_registry
+
+MAGIC = b"PRICEBRD"
+LAYOUT_VERSION = 1
+HEADER = struct.Struct("<8sIII")
+HEADER_SIZE = 64
+SEQ = struct.Struct("<Q")
+FIELDS = struct.Struct("<16sdd")  # symbol, price, updated_at - сразу после seq
+SLOT_SIZE = 64  # одна строка кэша на символ
+WANT = struct.Struct("<16sd")
+SYMBOL_BYTES = 16
+READ_RETRIES = 64
+
+
+def _fits(symbol: str) -> bool:
+    return 0 < len(symbol) <= SYMBOL_BYTES and symbol.isascii()
+
+
+def _encode(symbol: str) -> bytes:
+    return symbol.encode("ascii").ljust(SYMBOL_BYTES, b"\0")
+
+
+def board_size(slots: int, want_slots: int) -> int:
+    return HEADER_SIZE + slots * SLOT_SIZE + want_slots * WANT.size
+
+
+def _open_segment(name: str, size: int):
+    # -> (SharedMemory, создан ли сегмент этим процессом)
+    try:
+        segment = _shared_memory(name, True, size)
+        return segment, True
+    except FileExistsError:
+        return _shared_memory(name, False, 0), False
+
+
+def _shared_memory(name: str, create: bool, size: int):
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:  # Python < 3.13: отписываемся от resource_tracker, иначе он удалит сегмент при выходе любого воркера
+        segment = shared_memory.SharedMemory(name=name, create=create, size=size)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class PriceBoard:
+    def __init__(self, name: str, slots: int, want_slots: int = None, lock_path: str = None):
+        self.name = name
+        self.slots = slots
+        self.want_slots = want_slots or max(16, slots // 4)
+        self.lock_path = lock_path or os.path.join(tempfile.gettempdir(), f"{name or 'price_board'}.lock")
+        self.segment = None
+        self.buf = None
+        self.is_writer = False
+        self._lock_fd = None
+        self._slot_of = {}  # symbol -> индекс слота (только у писателя)
+        self._requested = {}  # symbol -> когда этот процесс последний раз отметил интерес к символу
+        self._task = None
+        self.torn_retries = 0  # сколько раз чтение пришлось повторить из-за параллельной записи
+
+    @property
+    def enabled(self) -> bool:
+        return self.buf is not None
+
+    def open(self):
+        if self.buf is not None:
+            return
+        self.segment, _ = _open_segment(self.name, board_size(self.slots, self.want_slots))
+        self.buf = self.segment.buf
+        magic, version, slots, want_slots = HEADER.unpack_from(self.buf, 0)
+        if magic == MAGIC:
+            if version != LAYOUT_VERSION:
+                raise RuntimeError(f"Price board {self.name} has layout version {version}, expected {LAYOUT_VERSION}")
+            self.slots, self.want_slots = slots, want_slots # раскладку задает тот, кто создал сегмент
+
+    def close(self):
+        self.release()
+        if self.segment is not None:
+            self.buf = None
+            self.segment.close()
+            self.segment = None
+
+    def unlink(self):
+        shared_memory.SharedMemory(name=self.name).unlink()
+
+    def _slot_offset(self, index: int) -> int:
+        return HEADER_SIZE + index * SLOT_SIZE
+
+    def _ready(self) -> bool:
+        return self.buf is not None and bytes(self.buf[0:8]) == MAGIC
+
+    # ---------- Чтение (любой процесс) ----------
+    def read_slot(self, index: int):
+        # -> (symbol bytes, price, updated_at) одного обновления или None, если писатель все время мешал
+        buf = self.buf
+        offset = self._slot_offset(index)
+        for _ in range(READ_RETRIES):
+            before = SEQ.unpack_from(buf, offset)[0]
+            if before & 1:
+                self.torn_retries += 1
+                continue
+            fields = FIELDS.unpack_from(buf, offset + SEQ.size)
+            if SEQ.unpack_from(buf, offset)[0] == before:
+                return fields
+            self.torn_retries += 1
+        return None
+
+    def entry(self, symbol: str):
+        # -> (price, updated_at) или None, если символа нет на доске
+        if not self._ready() or not _fits(symbol):
+            return None
+        key = _encode(symbol)
+        start = zlib.crc32(key) % self.slots
+        for step in range(self.slots):
+            fields = self.read_slot((start + step) % self.slots)
+            if fields is None:
+                return None
+            slot_symbol, price, updated_at = fields
+            if slot_symbol == key:
+                return price, updated_at
+            if slot_symbol == b"\0" * SYMBOL_BYTES:
+                return None
+        return None
+
+    def get(self, symbol: str, max_age: float = None):
+        # -> цена или None (символа нет на доске или цена старше max_age); промах отмечается в слотах запросов
+        entry = self.entry(symbol)
+        if entry is not None and (max_age is None or time.time() - entry[1] <= max_age):
+            self._renew(symbol) # символ читают - писатель должен продолжать его обновлять
+            return entry[0]
+        if self._ready() and _fits(symbol):
+            self.request(_encode(symbol))
+        return None
+
+    def _renew(self, symbol: str):
+        # Запрос истекает через PRICE_BOARD_WANT_TTL_SECONDS: продлеваем не на каждом чтении, а раз в PRICE_BOARD_RENEW_SECONDS
+        now = time.time()
+        if now - self._requested.get(symbol, 0.0) >= PRICE_BOARD_RENEW_SECONDS:
+            self.request(_encode(symbol), now)
+
+    def request(self, key: bytes, now: float = None):
+        # Без блокировок: слот по хэшу, последний записавший побеждает; писатель проверяет символ перед запросом цены
+        now = time.time() if now is None else now
+        offset = HEADER_SIZE + self.slots * SLOT_SIZE + zlib.crc32(key) % self.want_slots * WANT.size
+        WANT.pack_into(self.buf, offset, key, now)
+        self._requested[key.rstrip(b"\0").decode()] = now
+
+    # ---------- Запись (только выбранный процесс) ----------
+    def try_elect(self) -> bool:
+        if self.is_writer or fcntl is None or self.buf is None:
+            return self.is_writer
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        self.is_writer = True
+        if not self._ready():
+            HEADER.pack_into(self.buf, 0, MAGIC, LAYOUT_VERSION, self.slots, self.want_slots)
+        self._slot_of = {} # доска могла остаться от прошлого писателя - восстанавливаем карту слотов
+        for index in range(self.slots):
+            fields = self.read_slot(index)
+            if fields is not None and fields[0] != b"\0" * SYMBOL_BYTES:
+                self._slot_of[fields[0]] = index
+        return True
+
+    def release(self):
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.is_writer = False
+
+    def _claim_slot(self, key: bytes):
+        index = self._slot_of.get(key)
+        if index is not None:
+            return index
+        start = zlib.crc32(key) % self.slots
+        for step in range(self.slots):
+            index = (start + step) % self.slots
+            if self.read_slot(index)[0] == b"\0" * SYMBOL_BYTES:
+                self._slot_of[key] = index
+                return index
+        return None # доска заполнена
+
+    def put(self, symbol: str, price: float, updated_at: float = None):
+        if not _fits(symbol):
+            return False
+        key = _encode(symbol)
+        index = self._claim_slot(key)
+        if index is None:
+            return False
+        offset = self._slot_offset(index)
+        seq = SEQ.unpack_from(self.buf, offset)[0]
+        SEQ.pack_into(self.buf, offset, seq + 1) # нечетный - запись идет
+        FIELDS.pack_into(self.buf, offset + SEQ.size, key, price, time.time() if updated_at is None else updated_at)
+        SEQ.pack_into(self.buf, offset, seq + 2)
+        return True
+
+    def wanted(self, ttl: float) -> list:
+        # Символы, которые читатели запрашивали за последние ttl секунд
+        now = time.time()
+        symbols = set()
+        base = HEADER_SIZE + self.slots * SLOT_SIZE
+        for index in range(self.want_slots):
+            key, requested_at = WANT.unpack_from(self.buf, base + index * WANT.size)
+            symbol = key.rstrip(b"\0")
+            if symbol and now - requested_at <= ttl and symbol.isalnum() and symbol.isascii():
+                symbols.add(symbol.decode())
+        return sorted(symbols)
+
+    def stale(self, symbols, max_age: float) -> list:
+        now = time.time()
+        result = []
+        for symbol in symbols:
+            index = self._slot_of.get(_encode(symbol))
+            fields = self.read_slot(index) if index is not None else None
+            if fields is None or now - fields[2] > max_age:
+                result.append(symbol)
+        return result
+
+    # ---------- Жизненный цикл ----------
+    def _on_tick(self, symbol: str, price: float, updated_at: float):
+        if self.is_writer:
+            self.put(symbol, price, updated_at) # поток рыночных данных писателя сразу виден всем воркерам
+
+    def start(self, fetch_prices):
+        # fetch_prices(list[symbol]) -> {symbol: price} - пакетный запрос к Binance
+        if not self.name or self._task is not None:
+            return
+        self.open()
+        price_table.add_listener(self._on_tick)
+        self._task = asyncio.create_task(self._run(fetch_prices))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.close()
+
+    async def _run(self, fetch_prices):
+        while True:
+            if not self.try_elect():
+                await asyncio.sleep(PRICE_BOARD_REFRESH_SECONDS * 5) # писатель есть - проверяем, жив ли он
+                continue
+            try:
+                # Мусор из want-слотов (любой воркер мог записать туда опечатку) до Binance не доходит
+                known, _ = symbol_registry.partition(self.wanted(PRICE_BOARD_WANT_TTL_SECONDS))
+                stale = self.stale(known, PRICE_BOARD_REFRESH_SECONDS)
+                if stale:
+                    fetched_at = time.time() # момент запроса, а не записи: ожидание ответа не делает цену свежее
+                    for symbol, price in (await fetch_prices(stale)).items():
+                        self.put(symbol, price, fetched_at)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Price board refresh failed: {e}")
+            await asyncio.sleep(PRICE_BOARD_REFRESH_SECONDS)
+
+
+# PRICE_BOARD_NAME="" - доска выключена (один процесс): start() ничего не делает, get() сразу возвращает None
+price_board = PriceBoard(PRICE_BOARD_NAME, PRICE_BOARD_SLOTS)
@@ -1,4 +1,6 @@
 #Формат аутентификации данных для API (Pydantic)
+from typing import List, Literal
+
 from pydantic import BaseModel
 
 class UserCreate(BaseModel):
@@ -12,4 +14,21 @@ class AddMoney(BaseModel):
 
 class TradeAsset(BaseModel):
     symbol: str
-    quantity: float
\ No newline at end of file
+    quantity: float
+
+# Пакетный ордер: несколько покупок/продаж в одной транзакции
+class OrderLeg(BaseModel):
+    side: Literal["buy", "sell"]
+    symbol: str
+    quantity: float
+
+class BatchOrder(BaseModel):
+    legs: List[OrderLeg]
+
+# Отложенный ордер: limit - купить не дороже / продать не дешевле trigger_price, stop - сработать при пересечении
+class OrderCreate(BaseModel):
+    side: Literal["buy", "sell"]
+    order_type: Literal["limit", "stop"]
+    symbol: str
+    quantity: float
+    trigger_price: float
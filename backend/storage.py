@@ -0,0 +1,134 @@
+# 🗄️ Профиль хранилища: URL из окружения, PRAGMA для SQLite, настройки пула для серверных БД, время ожидания соединения
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects import sqlite, postgresql, mysql
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+from config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE_SECONDS, DB_POOL_TIMEOUT_SECONDS
+from config import SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE_BYTES, SQLITE_BUSY_TIMEOUT_MS
+
+# Асинхронные драйверы для тех же баз
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+# INSERT ... ON CONFLICT DO UPDATE (upsert) есть не у всех диалектов; у MySQL это ON DUPLICATE KEY UPDATE
+UPSERT_DIALECTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert, "mysql": mysql.insert}
+
+
+def upsert(dialect_name: str, model, index_elements: list, set_for):
+    # -> INSERT ... ON CONFLICT (index_elements) DO UPDATE / ON DUPLICATE KEY UPDATE или None, если диалект не умеет upsert
+    # set_for(new) -> {колонка: выражение}, new - значения вставляемой строки (excluded / inserted). Значения - через .values()
+    insert_for_dialect = UPSERT_DIALECTS.get(dialect_name)
+    if insert_for_dialect is None:
+        return None
+    statement = insert_for_dialect(model)
+    if dialect_name == "mysql":
+        # Конфликт MySQL определяет сам по уникальному индексу таблицы - тому же, что в index_elements
+        return statement.on_duplicate_key_update(set_for(statement.inserted))
+    return statement.on_conflict_do_update(index_elements=index_elements, set_=set_for(statement.excluded))
+
+
+class PoolWaitStats:
+    # Сколько запросы ждут свободное соединение из пула - по этим цифрам подбираем DB_POOL_SIZE
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.bucket_counts = [0] * (len(self.BUCKETS) + 1)
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    self.bucket_counts[i] += 1
+                    break
+            else:
+                self.bucket_counts[-1] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+                "buckets": dict(zip([f"le_{bound}s" for bound in self.BUCKETS] + ["inf"], self.bucket_counts)),
+            }
+
+
+pool_wait_stats = {"sync": PoolWaitStats(), "async": PoolWaitStats()}
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool, который замеряет ожидание соединения при checkout
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait_stats["sync"].observe(time.perf_counter() - started)
+
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait_stats["async"].observe(time.perf_counter() - started)
+
+
+def async_url(url: str) -> str:
+    # sqlite:///./database.db -> sqlite+aiosqlite:///./database.db
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS[parsed.get_backend_name()]
+    if parsed.drivername == driver:
+        return url
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def engine_options(url: str, is_async: bool) -> dict:
+    options = {
+        "poolclass": TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_SECONDS,
+    }
+    if is_sqlite(url):
+        if not is_async:
+            options["connect_args"] = {"check_same_thread": False} # ✅ Разрешает использовать одно соединение из разных потоков
+    else:
+        options["pool_recycle"] = DB_POOL_RECYCLE_SECONDS
+        options["pool_pre_ping"] = True # проверяем соединение перед выдачей, если сервер его закрыл
+    return options
+
+
+def apply_sqlite_pragmas(engine):
+    # Выполняется на каждом новом соединении: WAL - читатели не ждут писателя, NORMAL - fsync только на checkpoint
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}") # отрицательное значение - размер в КБ
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_BYTES}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
@@ -0,0 +1,137 @@
+# 📇 Реестр торгуемых символов: снимок /api/v3/exchangeInfo Binance в файле + периодическое обновление
+# Неизвестный символ отклоняется сразу (проверка по set, O(1)), без запроса к Binance и без 500.
+# Файл снимка позволяет работать без сети: при старте реестр читается с диска - сначала снимок последнего обновления,
+# если его нет - исходный снимок из репозитория (он только читается). Обновление пишет свой файл атомарно.
+# Отрицательный кэш - символы, на которые Binance ответил "нет такого" (реестр еще не загружен или устарел).
+import asyncio
+import json
+import os
+import re
+
+from fastapi import HTTPException
+
+from cache import TTLCache
+from config import SYMBOL_SNAPSHOT_PATH, SYMBOL_SEED_SNAPSHOT_PATH, SYMBOL_QUOTE_ASSET, SYMBOL_REFRESH_SECONDS
+from config import SYMBOL_NEGATIVE_TTL_SECONDS, SYMBOL_NEGATIVE_CACHE_MAX_SIZE
+
+SYMBOL_PATTERN = re.compile(r"[A-Z0-9]{1,16}")  # формат тикера Binance: отсекает мусор, даже если реестр пуст
+
+
+def normalize_symbol(symbol: str) -> str:
+    # " btc" -> "BTC": ввод пользователя приводится к виду тикера до проверки и до записи в БД
+    return symbol.strip().upper()
+
+
+def parse_exchange_info(payload: dict, quote: str) -> frozenset:
+    # {"symbols": [{"baseAsset": "BTC", "quoteAsset": "USDT", "status": "TRADING"}, ...]} -> {"BTC", ...}
+    return frozenset(
+        item["baseAsset"] for item in payload.get("symbols", [])
+        if item.get("quoteAsset") == quote and item.get("status") == "TRADING"
+    )
+
+
+class SymbolRegistry:
+    def __init__(self, snapshot_path: str, seed_path: str, quote: str, refresh_interval: float, negative_ttl: float, negative_max_size: int):
+        self.snapshot_path = snapshot_path
+        self.seed_path = seed_path
+        self.quote = quote
+        self.refresh_interval = refresh_interval
+        self._symbols = frozenset()  # заменяется целиком при обновлении - читатели без блокировок
+        self._sorted = []
+        self._unknown = TTLCache(max_size=negative_max_size, default_ttl=negative_ttl)
+        self._task = None
+
+    def __len__(self):
+        return len(self._symbols)
+
+    def symbols(self) -> list:
+        # Отсортированный список для выпадающего списка в шаблоне
+        return self._sorted
+
+    def _replace(self, symbols: frozenset):
+        if symbols:
+            self._symbols = symbols
+            self._sorted = sorted(symbols)
+            self._unknown.clear() # новый снимок - отрицательные записи могли устареть
+
+    def load_snapshot(self) -> bool:
+        for path in (self.snapshot_path, self.seed_path):
+            try:
+                with open(path, encoding="utf-8") as file:
+                    self._replace(parse_exchange_info(json.load(file), self.quote))
+                return True
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                print(f"Symbol snapshot {path} not loaded: {e}")
+        return False
+
+    def save_snapshot(self, payload: dict):
+        # Атомарная запись: временный файл + os.replace, читающие процессы не видят половину файла
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(payload, file)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def is_known(self, symbol: str) -> bool:
+        if not SYMBOL_PATTERN.fullmatch(symbol) or self._unknown.get(symbol):
+            return False
+        return not self._symbols or symbol in self._symbols # реестр не загружен - пропускаем, решит Binance
+
+    def check(self, symbol: str):
+        if not self.is_known(symbol):
+            raise HTTPException(status_code=400, detail=f"Unknown symbol: {symbol}")
+
+    def partition(self, symbols) -> tuple:
+        # -> ([известные], [неизвестные]): для оценки портфелей - один снятый с торгов актив не ломает остальные
+        known, unknown = [], []
+        for symbol in dict.fromkeys(symbols):
+            (known if self.is_known(symbol) else unknown).append(symbol)
+        return known, unknown
+
+    def mark_unknown(self, symbol: str):
+        # Binance не знает символ - следующие запросы отклоняются локально до истечения TTL или нового снимка
+        self._unknown.set(symbol, True)
+
+    async def refresh(self, fetch_exchange_info):
+        payload = await fetch_exchange_info()
+        symbols = parse_exchange_info(payload, self.quote)
+        if not symbols:
+            raise ValueError(f"exchangeInfo has no {self.quote} symbols")
+        self._replace(symbols)
+        await asyncio.to_thread(self.save_snapshot, payload)
+
+    def start(self, fetch_exchange_info):
+        # fetch_exchange_info() -> dict (ответ /api/v3/exchangeInfo)
+        if self._task is None:
+            self.load_snapshot()
+            self._task = asyncio.create_task(self._run(fetch_exchange_info))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, fetch_exchange_info):
+        while True:
+            try:
+                await self.refresh(fetch_exchange_info)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Symbol registry refresh failed, keeping {len(self)} symbols: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+
+symbol_registry = SymbolRegistry(
+    snapshot_path=SYMBOL_SNAPSHOT_PATH,
+    seed_path=SYMBOL_SEED_SNAPSHOT_PATH,
+    quote=SYMBOL_QUOTE_ASSET,
+    refresh_interval=SYMBOL_REFRESH_SECONDS,
+    negative_ttl=SYMBOL_NEGATIVE_TTL_SECONDS,
+    negative_max_size=SYMBOL_NEGATIVE_CACHE_MAX_SIZE,
+)
@@ -0,0 +1,160 @@
+# 💱 Исполнение сделок условными UPDATE: проверка баланса/количества и изменение - одна SQL команда
+# Два параллельных запроса не могут потратить одни и те же деньги или продать одно и то же количество дважды.
+# Команды общие для sync Session (crud.py) и AsyncSession (crud_async.py, через run_sync).
+from sqlalchemy import select, update, insert, delete
+
+from models import Portfolio, Asset, AssetLot
+from storage import upsert
+
+NO_SYNC = {"synchronize_session": False}  # объекты в сессии не трогаем - после сделки их никто не читает
+# Каждая сделка меняет деньги портфеля, поэтому Portfolio.version растет при любом изменении портфеля или его активов
+
+
+def returning(session, statement, columns: tuple, *key):
+    # UPDATE ... RETURNING columns -> первая строка или None, если условие UPDATE не выполнилось.
+    # Без UPDATE ... RETURNING (MySQL): тот же UPDATE, затем SELECT строки по key в той же транзакции -
+    # UPDATE уже держит блокировку строки, между ними ее никто не изменит
+    if session.get_bind().dialect.update_returning:
+        return session.execute(statement.returning(*columns)).first()
+    if session.execute(statement).rowcount == 0:
+        return None
+    return session.execute(select(*columns).where(*key)).first()
+
+
+def debit(session, user_id: int, cost: float):
+    # -> (portfolio_id, новая версия) или None (нет портфеля или не хватает денег)
+    return returning(session, debit_cash(user_id, cost), (Portfolio.id, Portfolio.version), Portfolio.user_id == user_id)
+
+
+def deposit(session, user_id: int, amount: float):
+    # -> (portfolio_id, новая версия) или None (нет портфеля)
+    return returning(session, deposit_cash(user_id, amount), (Portfolio.id, Portfolio.version), Portfolio.user_id == user_id)
+
+
+def credit(session, user_id: int, amount: float):
+    # -> (portfolio_id, новая версия) или None (нет портфеля)
+    return returning(session, credit_cash(user_id, amount), (Portfolio.id, Portfolio.version), Portfolio.user_id == user_id)
+
+
+def take(session, portfolio_id: int, symbol: str, quantity: float):
+    # -> (asset_id, остаток) или None (актива нет или его меньше quantity)
+    return returning(
+        session, take_quantity(portfolio_id, symbol, quantity), (Asset.id, Asset.quantity),
+        Asset.portfolio_id == portfolio_id, Asset.symbol == symbol,
+    )
+
+
+def debit_cash(user_id: int, cost: float):
+    # UPDATE portfolio SET available_money = available_money - :cost WHERE user_id = :user_id AND available_money >= :cost
+    return (
+        update(Portfolio)
+        .where(Portfolio.user_id == user_id, Portfolio.available_money >= cost)
+        .values(available_money=Portfolio.available_money - cost, version=Portfolio.version + 1)
+        .execution_options(**NO_SYNC)
+    )
+
+
+def deposit_cash(user_id: int, amount: float):
+    # UPDATE portfolio SET available_money = available_money + :a, total_added_money = ..., version = version + 1
+    # Атомарно относительно параллельных сделок: без чтения портфеля в Python и записи обратно
+    return (
+        update(Portfolio)
+        .where(Portfolio.user_id == user_id)
+        .values(
+            available_money=Portfolio.available_money + amount,
+            total_added_money=Portfolio.total_added_money + amount,
+            version=Portfolio.version + 1,
+        )
+        .execution_options(**NO_SYNC)
+    )
+
+
+def credit_cash(user_id: int, amount: float):
+    # Продажа начинается с этой команды: блокировка строки портфеля берется раньше строки актива, как и в покупке
+    # (debit_cash -> актив) - встречные покупка и продажа не ждут друг друга по кругу (deadlock)
+    return (
+        update(Portfolio)
+        .where(Portfolio.user_id == user_id)
+        .values(available_money=Portfolio.available_money + amount, version=Portfolio.version + 1)
+        .execution_options(**NO_SYNC)
+    )
+
+
+def add_quantity(portfolio_id: int, symbol: str, quantity: float, cost: float):
+    # Вместе с количеством растет и стоимость покупки (cost basis). NULL (старая запись без cost basis) остается NULL:
+    # прибавив покупку к неизвестной стоимости, получили бы заниженный cost basis и завышенную прибыль
+    return (
+        update(Asset)
+        .where(Asset.portfolio_id == portfolio_id, Asset.symbol == symbol)
+        .values(quantity=Asset.quantity + quantity, cost_basis=Asset.cost_basis + cost)
+        .execution_options(**NO_SYNC)
+    )
+
+
+def insert_asset(portfolio_id: int, symbol: str, quantity: float, cost: float):
+    return insert(Asset).values(portfolio_id=portfolio_id, symbol=symbol, quantity=quantity, cost_basis=cost)
+
+
+def upsert_asset(dialect_name: str, portfolio_id: int, symbol: str, quantity: float, cost: float):
+    # INSERT ... ON CONFLICT (portfolio_id, symbol) DO UPDATE - одна команда вместо UPDATE + INSERT
+    # -> None, если диалект не умеет upsert (тогда add_quantity + insert_asset)
+    statement = upsert(dialect_name, Asset, ["portfolio_id", "symbol"], lambda new: {
+        "quantity": Asset.quantity + new.quantity,
+        "cost_basis": Asset.cost_basis + new.cost_basis, # NULL остается NULL, как в add_quantity
+    })
+    if statement is None:
+        return None
+    return statement.values(portfolio_id=portfolio_id, symbol=symbol, quantity=quantity, cost_basis=cost)
+
+
+def take_quantity(portfolio_id: int, symbol: str, quantity: float):
+    # UPDATE assets SET quantity = quantity - :q WHERE portfolio_id = :p AND symbol = :s AND quantity >= :q
+    return (
+        update(Asset)
+        .where(Asset.portfolio_id == portfolio_id, Asset.symbol == symbol, Asset.quantity >= quantity)
+        # средняя цена при продаже не меняется: cost basis уменьшается пропорционально проданной доле.
+        # cost_basis присваивается первым: MySQL выполняет SET слева направо, и иначе делил бы на уже уменьшенное количество
+        .ordered_values(
+            (Asset.cost_basis, Asset.cost_basis - Asset.cost_basis * quantity / Asset.quantity),
+            (Asset.quantity, Asset.quantity - quantity),
+        )
+        .execution_options(**NO_SYNC)
+    )
+
+
+def delete_asset(asset_id: int):
+    return delete(Asset).where(Asset.id == asset_id).execution_options(**NO_SYNC)
+
+
+def insert_lot(portfolio_id: int, symbol: str, quantity: float, price: float):
+    return insert(AssetLot).values(portfolio_id=portfolio_id, symbol=symbol, quantity=quantity, price=price)
+
+
+def open_lots(portfolio_id: int, symbol: str):
+    # FIFO: самые старые лоты первыми
+    return (
+        select(AssetLot.id, AssetLot.quantity, AssetLot.price)
+        .where(AssetLot.portfolio_id == portfolio_id, AssetLot.symbol == symbol)
+        .order_by(AssetLot.id)
+    )
+
+
+def set_lot_quantity(lot_id: int, quantity: float):
+    return update(AssetLot).where(AssetLot.id == lot_id).values(quantity=quantity).execution_options(**NO_SYNC)
+
+
+def delete_lots(lot_ids: list):
+    return delete(AssetLot).where(AssetLot.id.in_(lot_ids)).execution_options(**NO_SYNC)
+
+
+def delete_all_lots(portfolio_id: int, symbol: str):
+    return (
+        delete(AssetLot)
+        .where(AssetLot.portfolio_id == portfolio_id, AssetLot.symbol == symbol)
+        .execution_options(**NO_SYNC)
+    )
+
+
+def portfolio_exists(user_id: int):
+    # Только на пути ошибки: отличить "нет портфеля" (404) от "не хватает денег/актива" (400)
+    return select(Portfolio.id).where(Portfolio.user_id == user_id)
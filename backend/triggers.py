@@ -0,0 +1,121 @@
+# 🎯 Индекс срабатывания отложенных ордеров: по символу две кучи с ключом цены срабатывания
+# "Падение" (цена <= trigger): buy limit и sell stop - max-куча, сверху самый высокий порог.
+# "Рост" (цена >= trigger): sell limit и buy stop - min-куча, сверху самый низкий порог.
+# Тик снимает с вершин только пересеченные пороги: O(k log n) на k сработавших, остальные ордера не просматриваются.
+# Отмена - ленивая: ордер убирается из словаря, запись в куче пропускается при извлечении.
+import heapq
+
+FALLING = {("buy", "limit"), ("sell", "stop")}
+RISING = {("sell", "limit"), ("buy", "stop")}
+
+
+class RestingOrder:
+    __slots__ = ("id", "user_id", "symbol", "side", "order_type", "quantity", "trigger_price")
+
+    def __init__(self, id: int, user_id: int, symbol: str, side: str, order_type: str, quantity: float, trigger_price: float):
+        self.id = id
+        self.user_id = user_id
+        self.symbol = symbol
+        self.side = side
+        self.order_type = order_type
+        self.quantity = quantity
+        self.trigger_price = trigger_price
+
+    @property
+    def falling(self) -> bool:
+        return (self.side, self.order_type) in FALLING
+
+    def crossed(self, price: float) -> bool:
+        return price <= self.trigger_price if self.falling else price >= self.trigger_price
+
+
+class _SymbolBook:
+    __slots__ = ("falling", "rising")
+
+    def __init__(self):
+        self.falling = []  # (-trigger_price, order_id)
+        self.rising = []  # (trigger_price, order_id)
+
+
+class TriggerIndex:
+    def __init__(self):
+        self._books = {}  # symbol -> _SymbolBook
+        self._orders = {}  # order_id -> RestingOrder (только живые)
+        self._dead = 0  # отмененные записи, еще лежащие в кучах
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self._orders
+
+    def symbols(self):
+        return [symbol for symbol, book in self._books.items() if book.falling or book.rising]
+
+    def _book(self, symbol: str) -> _SymbolBook:
+        book = self._books.get(symbol)
+        if book is None:
+            book = self._books[symbol] = _SymbolBook()
+        return book
+
+    def add(self, order: RestingOrder):
+        self._orders[order.id] = order
+        book = self._book(order.symbol)
+        if order.falling:
+            heapq.heappush(book.falling, (-order.trigger_price, order.id))
+        else:
+            heapq.heappush(book.rising, (order.trigger_price, order.id))
+
+    def load(self, orders):
+        # Массовая загрузка (старт приложения): списки + heapify - O(n) вместо n вставок
+        for order in orders:
+            if order.id in self._orders:
+                continue # уже добавлен через add (ордер создан во время загрузки)
+            self._orders[order.id] = order
+            book = self._book(order.symbol)
+            if order.falling:
+                book.falling.append((-order.trigger_price, order.id))
+            else:
+                book.rising.append((order.trigger_price, order.id))
+        for book in self._books.values():
+            heapq.heapify(book.falling)
+            heapq.heapify(book.rising)
+
+    def remove(self, order_id: int):
+        # -> RestingOrder или None; запись в куче остается до извлечения
+        order = self._orders.pop(order_id, None)
+        if order is not None:
+            self._dead += 1
+            if self._dead > len(self._orders):
+                self._compact()
+        return order
+
+    def _compact(self):
+        # Отмененных больше, чем живых - пересобираем кучи, чтобы не держать мусор
+        for book in self._books.values():
+            book.falling = [entry for entry in book.falling if entry[1] in self._orders]
+            book.rising = [entry for entry in book.rising if entry[1] in self._orders]
+            heapq.heapify(book.falling)
+            heapq.heapify(book.rising)
+        self._dead = 0
+
+    def pop_triggered(self, symbol: str, price: float) -> list:
+        # -> ордера, чей порог пересечен ценой; они удаляются из индекса
+        book = self._books.get(symbol)
+        if book is None:
+            return []
+        triggered = []
+        falling, rising = book.falling, book.rising
+        while falling and -falling[0][0] >= price:
+            order = self._orders.pop(heapq.heappop(falling)[1], None)
+            if order is None:
+                self._dead -= 1
+            else:
+                triggered.append(order)
+        while rising and rising[0][0] <= price:
+            order = self._orders.pop(heapq.heappop(rising)[1], None)
+            if order is None:
+                self._dead -= 1
+            else:
+                triggered.append(order)
+        return triggered
@@ -0,0 +1,100 @@
+# Снимок оценки портфеля: считается один раз за запрос и дальше только читается (шаблон, JSON)
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from pnl import performance
+
+
+@dataclass(frozen=True)
+class HoldingValuation:
+    symbol: str
+    quantity: float
+    current_price: float
+    total_value: float
+    performance_usd: str = "****"
+    performance_percent: str = "****"
+
+    def as_dict(self) -> dict:
+        return {
+            "symbol": self.symbol,
+            "quantity": self.quantity,
+            "current_price": self.current_price,
+            "total_value": self.total_value,
+            "performance_usd": self.performance_usd,
+            "performance_percent": self.performance_percent,
+        }
+
+
+@dataclass(frozen=True)
+class PortfolioValuation:
+    portfolio_id: int
+    user_id: int
+    version: int  # Portfolio.version, из которой посчитан снимок
+    available_money: float
+    total_added_money: float
+    holdings: tuple  # (HoldingValuation, ...)
+    prices: MappingProxyType  # symbol -> цена, по которой считали
+    total_portfolio_value: float  # стоимость всех активов по текущим ценам
+
+    # Готовые строки для шаблона - форматируем один раз
+    total_portfolio_value_display: str
+    available_money_display: str
+    total_added_money_display: str
+
+    @property
+    def symbols(self) -> list:
+        return [holding.symbol for holding in self.holdings]
+
+    def as_dict(self) -> dict:
+        return {
+            "portfolio_id": self.portfolio_id,
+            "user_id": self.user_id,
+            "version": self.version,
+            "available_money": self.available_money,
+            "total_added_money": self.total_added_money,
+            "total_portfolio_value": self.total_portfolio_value,
+            "assets": [holding.as_dict() for holding in self.holdings],
+        }
+
+
+def _format_performance(total_value: float, cost_basis):
+    pnl_usd, pnl_percent = performance(total_value, cost_basis)
+    if pnl_usd is None:
+        return "****", "****" # для старых записей без cost basis
+    return f"{pnl_usd:+,.2f}$", f"{pnl_percent:+.2f}%"
+
+
+def _holding(asset, price) -> HoldingValuation:
+    if price is None:
+        # Цены нет (символ снят с торгов или неизвестен Binance): актив показывается, в стоимость не входит
+        return HoldingValuation(symbol=asset.symbol, quantity=asset.quantity, current_price=0.0, total_value=0.0)
+    total_value = asset.quantity * price
+    performance_usd, performance_percent = _format_performance(total_value, asset.cost_basis)
+    return HoldingValuation(
+        symbol=asset.symbol,
+        quantity=asset.quantity,
+        current_price=price,
+        total_value=total_value,
+        performance_usd=performance_usd,
+        performance_percent=performance_percent,
+    )
+
+
+def build_portfolio_valuation(portfolio, assets, prices: dict) -> PortfolioValuation:
+    # Прибыль считается из cost basis в строке актива - история сделок не читается
+    holdings = tuple(_holding(asset, prices.get(asset.symbol)) for asset in assets)
+    total_value = sum(holding.total_value for holding in holdings)
+
+    return PortfolioValuation(
+        portfolio_id=portfolio.id,
+        user_id=portfolio.user_id,
+        version=portfolio.version,
+        available_money=portfolio.available_money,
+        total_added_money=portfolio.total_added_money,
+        holdings=holdings,
+        prices=MappingProxyType(dict(prices)),
+        total_portfolio_value=total_value,
+        total_portfolio_value_display=f"{total_value:,.2f}",
+        available_money_display=f"{portfolio.available_money:.2f}",
+        total_added_money_display=f"{portfolio.total_added_money:.2f}",
+    )
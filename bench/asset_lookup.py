@@ -0,0 +1,83 @@
+# Бенчмарк: поиск актива по (portfolio_id, symbol) на 1M строк до и после миграции с индексами
+# Запуск: python bench/asset_lookup.py --rows 1000000 --lookups 2000
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from sqlalchemy import create_engine, text
+
+from migrate import run_migrations
+
+SYMBOLS = ["BTC", "ETH", "SOL", "ADA", "DOT", "LTC", "XRP", "BNB", "DOGE", "TRX"]
+
+# Схема, которую создавал Base.metadata.create_all до миграций (без индексов на assets)
+LEGACY_SCHEMA = [
+    "CREATE TABLE users (id INTEGER NOT NULL PRIMARY KEY, username VARCHAR, password VARCHAR, email VARCHAR)",
+    "CREATE TABLE portfolio (id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES users (id), total_added_money FLOAT, available_money FLOAT)",
+    "CREATE INDEX ix_portfolio_user_id ON portfolio (user_id)",
+    "CREATE TABLE assets (id INTEGER NOT NULL PRIMARY KEY, portfolio_id INTEGER REFERENCES portfolio (id), symbol VARCHAR, quantity FLOAT)",
+    "CREATE TABLE transactions (id INTEGER NOT NULL PRIMARY KEY, portfolio_id INTEGER REFERENCES portfolio (id), transaction_type VARCHAR, symbol VARCHAR, quantity FLOAT, price FLOAT, date VARCHAR)",
+]
+
+
+def measure(engine, portfolios: int, lookups: int) -> float:
+    rng = random.Random(42)
+    with engine.connect() as connection:
+        started = time.perf_counter()
+        for _ in range(lookups):
+            connection.execute(
+                text("SELECT id, quantity FROM assets WHERE portfolio_id = :p AND symbol = :s"),
+                {"p": rng.randint(1, portfolios), "s": rng.choice(SYMBOLS)},
+            ).first()
+        return (time.perf_counter() - started) / lookups * 1000
+
+
+def main(args):
+    path = os.path.join(tempfile.mkdtemp(), "lookup.db")
+    engine = create_engine(f"sqlite:///{path}")
+    portfolios = args.rows // len(SYMBOLS)
+
+    with engine.begin() as connection:
+        for ddl in LEGACY_SCHEMA:
+            connection.execute(text(ddl))
+        connection.execute(
+            text("INSERT INTO portfolio (id, user_id, total_added_money, available_money) VALUES (:id, :id, 0, 0)"),
+            [{"id": i} for i in range(1, portfolios + 1)],
+        )
+        chunk = []
+        for i in range(args.rows):
+            chunk.append({"p": i // len(SYMBOLS) + 1, "s": SYMBOLS[i % len(SYMBOLS)]})
+            if len(chunk) == 50_000:
+                connection.execute(text("INSERT INTO assets (portfolio_id, symbol, quantity) VALUES (:p, :s, 1.0)"), chunk)
+                chunk = []
+        if chunk:
+            connection.execute(text("INSERT INTO assets (portfolio_id, symbol, quantity) VALUES (:p, :s, 1.0)"), chunk)
+
+    before = measure(engine, portfolios, args.lookups)
+    started = time.perf_counter()
+    run_migrations(engine)
+    migration_seconds = time.perf_counter() - started
+    after = measure(engine, portfolios, args.lookups)
+    engine.dispose()
+
+    print(json.dumps({
+        "rows": args.rows,
+        "lookups": args.lookups,
+        "before_ms_per_lookup": round(before, 4),
+        "after_ms_per_lookup": round(after, 4),
+        "speedup": round(before / after, 1) if after else None,
+        "migration_seconds": round(migration_seconds, 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    main(parser.parse_args())
@@ -0,0 +1,92 @@
+# Бенчмарк: потоковый импорт N позиций и экспорт обратно (строк в секунду, пиковая память)
+# Запуск: python bench/bulk_import.py --positions 1000000 --per-user 10
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from sqlalchemy import create_engine, select, func
+
+from database import Base
+from models import Asset, Transaction
+from storage import apply_sqlite_pragmas
+from bulk_io import import_positions, iter_positions
+from passwords import hash_password
+
+SYMBOLS = ["BTC", "ETH", "SOL", "ADA", "DOT", "LTC", "XRP", "BNB", "DOGE", "TRX"]
+PASSWORD_HASH = hash_password("secret") # готовый хэш переносится как есть - бенчмарк меряет строки, а не scrypt
+
+
+def generate(positions: int, per_user: int):
+    # Записи генерируются на лету - как чтение большого файла построчно
+    for index in range(positions):
+        user = index // per_user
+        yield {
+            "username": f"user{user}",
+            "email": f"user{user}@example.com",
+            "password": PASSWORD_HASH,
+            "available_money": 1000,
+            "total_added_money": 1000,
+            "symbol": SYMBOLS[index % per_user % len(SYMBOLS)],
+            "quantity": 1 + index % 7,
+            "price": 10 + index % 13,
+        }
+
+
+def main(args):
+    path = os.path.join(tempfile.mkdtemp(), "bulk.db")
+    engine = create_engine(f"sqlite:///{path}")
+    apply_sqlite_pragmas(engine)
+    Base.metadata.create_all(engine)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    stats = import_positions(engine, generate(args.positions, args.per_user), args.chunk_size)
+    import_seconds = time.perf_counter() - started
+    _, import_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+
+    started = time.perf_counter()
+    sink = io.StringIO()
+    exported = 0
+    for record in iter_positions(engine, args.chunk_size):
+        sink.write(json.dumps(record) + "\n")
+        exported += 1
+        if sink.tell() > 1 << 20: # данные не копим - как запись в файл
+            sink.seek(0)
+            sink.truncate()
+    export_seconds = time.perf_counter() - started
+    _, export_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    with engine.connect() as connection:
+        assets = connection.execute(select(func.count()).select_from(Asset)).scalar_one()
+        transactions = connection.execute(select(func.count()).select_from(Transaction)).scalar_one()
+
+    print(json.dumps({
+        "positions": args.positions,
+        "chunks": stats["chunks"],
+        "assets": assets,
+        "transactions": transactions,
+        "import_seconds": round(import_seconds, 2),
+        "import_rows_per_second": round(args.positions / import_seconds),
+        "import_peak_mb": round(import_peak / 2**20, 1),
+        "exported_rows": exported,
+        "export_seconds": round(export_seconds, 2),
+        "export_rows_per_second": round(exported / export_seconds) if export_seconds else None,
+        "export_peak_mb": round(export_peak / 2**20, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--positions", type=int, default=100000)
+    parser.add_argument("--per-user", type=int, default=10)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    main(parser.parse_args())
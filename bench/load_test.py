@@ -0,0 +1,316 @@
+# Нагрузочный тест приложения целиком: uvicorn main:app + локальная заглушка Binance (задержка и доля ошибок настраиваются)
+# Заполняет БД: N пользователей по M активов, прогоняет /login, /user-profile, /calculate_total, /api/buy_asset, /api/sell_asset
+# с заданной параллельностью и сохраняет пропускную способность и p50/p95/p99 по каждому эндпоинту в JSON.
+# Запуск: python bench/load_test.py --users 200 --assets 10 --requests 2000 --concurrency 50 --stub-latency-ms 50 --output results.json
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BACKEND = os.path.join(ROOT, "backend")
+sys.path.insert(0, BACKEND)
+
+import httpx
+
+SYMBOLS = ["BTC", "ETH", "SOL", "ADA", "DOT", "LTC", "XRP", "BNB", "DOGE", "TRX", "LINK", "AVAX"]
+PASSWORD = "bench-password"
+ENDPOINTS = ["login", "user_profile", "calculate_total", "buy_asset", "sell_asset"]
+
+
+# ---------- Заглушка Binance: /api/v3/ticker/price?symbol=... и ?symbols=[...] ----------
+def stub_price(pair: str) -> float:
+    return 1.0 + sum(map(ord, pair)) % 1000 # стабильная цена - результаты повторяемы
+
+
+def make_stub_handler(latency: float, jitter: float, error_rate: float, seed: int):
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # keep-alive, как у настоящего API
+        requests_served = 0
+
+        def do_GET(self):
+            with lock:
+                delay = max(0.0, rng.gauss(latency, jitter)) if jitter else latency
+                fail = rng.random() < error_rate
+                StubHandler.requests_served += 1
+            if delay:
+                time.sleep(delay)
+
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path != "/api/v3/ticker/price":
+                return self._reply(404, {"code": -1, "msg": "Not found"})
+            if fail:
+                return self._reply(500, {"code": -1000, "msg": "Injected error"})
+            if "symbols" in query:
+                pairs = json.loads(query["symbols"][0])
+                return self._reply(200, [{"symbol": pair, "price": f"{stub_price(pair):.8f}"} for pair in pairs])
+            pair = query.get("symbol", [""])[0]
+            return self._reply(200, {"symbol": pair, "price": f"{stub_price(pair):.8f}"})
+
+        def _reply(self, status: int, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def start_stub(args):
+    handler = make_stub_handler(args.stub_latency_ms / 1000, args.stub_jitter_ms / 1000, args.stub_error_rate, args.seed)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, handler
+
+
+# ---------- База и приложение ----------
+def seed_database(database_url: str, users: int, assets: int):
+    # Отдельный процесс: модули backend читают DATABASE_URL при импорте
+    script = (
+        "import sys; from database import engine; from migrate import run_migrations; from bulk_io import import_positions\n"
+        "users, assets, password, symbols = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3], sys.argv[4].split(',')\n"
+        "run_migrations(engine)\n"
+        "def records():\n"
+        "    for i in range(users):\n"
+        "        base = {'username': f'load{i}', 'email': f'load{i}@example.com', 'password': password,\n"
+        "                'available_money': 1e9, 'total_added_money': 1e9}\n"
+        "        if not assets:\n"
+        "            yield {**base, 'symbol': ''}\n"
+        "        for j in range(assets):\n"
+        "            yield {**base, 'symbol': symbols[j % len(symbols)], 'quantity': 1e6, 'price': 1.0}\n"
+        "print(import_positions(engine, records()))\n"
+    )
+    env = {**app_env(), "DATABASE_URL": database_url}
+    subprocess.run([sys.executable, "-c", script, str(users), str(assets), PASSWORD, ",".join(SYMBOLS)], cwd=BACKEND, env=env, check=True)
+
+
+def app_env() -> dict:
+    # main.py импортирует backend.schemas - нужен корень репозитория в PYTHONPATH, не только cwd=backend
+    pythonpath = os.pathsep.join(filter(None, [os.path.abspath(ROOT), os.environ.get("PYTHONPATH")]))
+    return {**os.environ, "PYTHONPATH": pythonpath}
+
+
+def start_app(args, database_url: str, stub_url: str):
+    env = {
+        **app_env(),
+        "DATABASE_URL": database_url,
+        "BINANCE_API_URL": stub_url,
+        "MARKET_FEED": "", # только HTTP путь к заглушке, без WebSocket потока
+    }
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+               "--workers", str(args.workers), "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=BACKEND, env=env)
+
+
+async def wait_ready(client: httpx.AsyncClient, process, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"app exited with code {process.returncode}")
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("app did not start in time")
+
+
+# ---------- Нагрузка ----------
+def percentile(sorted_values: list, q: float) -> float:
+    # nearest-rank
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values), math.ceil(q / 100 * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    total = len(latencies)
+    return {
+        "requests": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / total * 1000, 2) if total else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if total else 0.0,
+    }
+
+
+async def login(client: httpx.AsyncClient, username: str) -> httpx.Response:
+    return await client.post("/login", data={"username": username, "password": PASSWORD})
+
+
+def scenarios(rng: random.Random, assets: int):
+    # endpoint -> (запрос(client, заголовки сессии, i), ожидаемые статусы)
+    held = SYMBOLS[:max(1, min(assets, len(SYMBOLS)))]
+
+    async def do_login(client, session, i):
+        return await login(client, f"load{i}")
+
+    async def do_profile(client, session, i):
+        return await client.get("/user-profile", headers=session)
+
+    async def do_calculate(client, session, i):
+        return await client.get("/calculate_total", params={"symbol": rng.choice(SYMBOLS), "quantity": rng.randint(1, 100)})
+
+    async def do_buy(client, session, i):
+        return await client.post("/api/buy_asset", data={"symbol": rng.choice(held), "quantity": "0.001"}, headers=session)
+
+    async def do_sell(client, session, i):
+        return await client.post("/api/sell_asset", data={"symbol": rng.choice(held), "quantity": "0.001"}, headers=session)
+
+    return {
+        "login": (do_login, {303}),
+        "user_profile": (do_profile, {200}),
+        "calculate_total": (do_calculate, {200}),
+        "buy_asset": (do_buy, {303}),
+        "sell_asset": (do_sell, {303}),
+    }
+
+
+async def run_phase(client, request, expected: set, sessions: list, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal errors
+        user = i % len(sessions)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await request(client, sessions[user], user)
+                ok = response.status_code in expected
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def drive(args, base_url: str, process) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout, follow_redirects=False) as client:
+        await wait_ready(client, process)
+
+        # Куки для всех пользователей заранее - фазы ниже измеряют только свой эндпоинт
+        sessions = []
+        for i in range(args.users):
+            response = await login(client, f"load{i}")
+            token = response.cookies.get("access_token")
+            if token is None:
+                raise RuntimeError(f"login failed for load{i}: {response.status_code}")
+            sessions.append({"Cookie": f"access_token={token}"}) # явный заголовок - cookie jar клиента не мешает
+
+        rng = random.Random(args.seed)
+        plans = scenarios(rng, args.assets)
+        results = {}
+        for name in args.endpoints:
+            request, expected = plans[name]
+            if args.warmup:
+                await run_phase(client, request, expected, sessions, args.warmup, args.concurrency)
+            results[name] = await run_phase(client, request, expected, sessions, args.requests, args.concurrency)
+            print(f"{name:16} {json.dumps(results[name])}", file=sys.stderr)
+        return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    stub, handler = start_stub(args)
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+
+    process = None
+    if args.app_url:
+        base_url = args.app_url # уже запущенное приложение: заполнение БД и заглушка на стороне пользователя
+    else:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}"
+        seed_database(database_url, args.users, args.assets)
+        process = start_app(args, database_url, stub_url)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        results = asyncio.run(drive(args, base_url, process))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        stub.shutdown()
+
+    report = {
+        "revision": git_revision(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "config": {
+            "users": args.users,
+            "assets": args.assets,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "stub_latency_ms": args.stub_latency_ms,
+            "stub_jitter_ms": args.stub_jitter_ms,
+            "stub_error_rate": args.stub_error_rate,
+        },
+        "stub_requests": handler.requests_served,
+        "endpoints": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--assets", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=1000, help="запросов на каждый эндпоинт")
+    parser.add_argument("--warmup", type=int, default=50, help="запросов на прогрев перед каждой фазой (не входят в результат)")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--stub-latency-ms", type=float, default=30.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url", help="по умолчанию - временная SQLite база")
+    parser.add_argument("--app-url", help="нагружать уже запущенное приложение вместо запуска своего")
+    parser.add_argument("--output", help="куда сохранить JSON с результатами")
+    main(parser.parse_args())
@@ -0,0 +1,107 @@
+# Бенчмарк: пропускная способность проверки паролей в зависимости от стоимости scrypt (n)
+# Для каждого n: время одного хэша, проверки в секунду через пул (passwords.PasswordHasherPool), p50/p99,
+# число отказов 503 при переполненной очереди и задержка event loop - проверка inline (блокирует loop) против пула.
+# Запуск: python bench/login_hashing.py --costs 4096 16384 65536 --logins 400 --concurrency 200
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from fastapi import HTTPException
+
+from config import PASSWORD_SCRYPT_R
+from passwords import PasswordHasherPool, hash_password, verify_password
+
+PASSWORD = "correct horse battery staple"
+
+
+async def loop_lag(stop: asyncio.Event, samples: list, interval: float = 0.005):
+    # Насколько позже срабатывает sleep(interval) - столько ждут все остальные запросы
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+async def run(verify, logins: int, concurrency: int) -> dict:
+    latencies = []
+    shed = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal shed
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                ok, _ = await verify()
+                assert ok
+            except HTTPException:
+                shed += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    lags = []
+    lag_task = asyncio.create_task(loop_lag(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+
+    latencies.sort()
+    lags.sort()
+    return {
+        "verified": len(latencies),
+        "shed_503": shed,
+        "logins_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1) if latencies else None,
+        "loop_lag_max_ms": round(lags[-1] * 1000, 1) if lags else None,
+    }
+
+
+async def main(args):
+    results = []
+    for n in args.costs:
+        stored = hash_password(PASSWORD, n=n)
+        started = time.perf_counter()
+        for _ in range(3):
+            verify_password(PASSWORD, stored)
+        single_ms = (time.perf_counter() - started) / 3 * 1000
+
+        async def inline():
+            return verify_password(PASSWORD, stored) # прямо в event loop, как было бы без пула
+
+        pool = PasswordHasherPool(args.workers, args.max_queue)
+        inline_logins = max(1, args.logins // 10)
+        results.append({
+            "n": n,
+            "memory_mb": round(128 * n * PASSWORD_SCRYPT_R / 2**20, 1),
+            "single_hash_ms": round(single_ms, 1),
+            "inline": await run(inline, inline_logins, args.concurrency),
+            "pool": await run(lambda: pool.verify(PASSWORD, stored), args.logins, args.concurrency),
+        })
+        pool.shutdown()
+        print(json.dumps(results[-1]), file=sys.stderr)
+
+    print(json.dumps({
+        "workers": args.workers,
+        "max_queue": args.max_queue,
+        "concurrency": args.concurrency,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--costs", type=int, nargs="+", default=[2 ** 12, 2 ** 14, 2 ** 15])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--max-queue", type=int, default=64)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,122 @@
+# Бенчмарк индекса срабатывания ордеров: 1M отложенных ордеров, поток тиков со случайным блужданием цены
+# Сравнивает кучи по символу (triggers.TriggerIndex) с полным просмотром ордеров символа на каждом тике.
+# Сработавшие ордера заменяются новыми около текущей цены - число ожидающих ордеров не падает.
+# Запуск: python bench/order_triggers.py --orders 1000000 --ticks 200000
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from triggers import TriggerIndex, RestingOrder
+
+SYMBOLS = ["BTC", "ETH", "SOL", "ADA", "DOT", "LTC", "XRP", "BNB", "DOGE", "TRX"]
+KINDS = [("buy", "limit"), ("sell", "stop"), ("sell", "limit"), ("buy", "stop")]
+
+
+def make_order(rng: random.Random, order_id: int, symbol: str, price: float, spread: float) -> RestingOrder:
+    side, order_type = rng.choice(KINDS)
+    # Пороги "на падение" ниже текущей цены, "на рост" - выше, как у реальных ордеров
+    offset = price * rng.uniform(0.0005, spread)
+    falling = (side, order_type) in {("buy", "limit"), ("sell", "stop")}
+    trigger = price - offset if falling else price + offset
+    return RestingOrder(order_id, order_id % 50000, symbol, side, order_type, 1.0, trigger)
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q / 100))]
+
+
+def naive_tick(orders_by_symbol: dict, symbol: str, price: float) -> list:
+    # Базовый вариант: проверить каждый ордер символа
+    triggered = [order for order in orders_by_symbol[symbol].values() if order.crossed(price)]
+    for order in triggered:
+        del orders_by_symbol[symbol][order.id]
+    return triggered
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    prices = {symbol: 100.0 * (i + 1) for i, symbol in enumerate(SYMBOLS)}
+    orders = [make_order(rng, i, SYMBOLS[i % len(SYMBOLS)], prices[SYMBOLS[i % len(SYMBOLS)]], args.spread) for i in range(args.orders)]
+    next_id = args.orders
+
+    index = TriggerIndex()
+    started = time.perf_counter()
+    index.load(orders)
+    load_seconds = time.perf_counter() - started
+
+    orders_by_symbol = {symbol: {} for symbol in SYMBOLS}
+    for order in orders:
+        orders_by_symbol[order.symbol][order.id] = order
+    del orders
+
+    # Один и тот же поток тиков для обоих вариантов
+    ticks = []
+    walk = dict(prices)
+    for _ in range(args.ticks):
+        symbol = rng.choice(SYMBOLS)
+        walk[symbol] *= 1 + rng.gauss(0, args.volatility)
+        ticks.append((symbol, walk[symbol]))
+
+    latencies = []
+    triggered_total = 0
+    cancelled = 0
+    started = time.perf_counter()
+    for symbol, price in ticks:
+        tick_started = time.perf_counter()
+        triggered = index.pop_triggered(symbol, price)
+        latencies.append(time.perf_counter() - tick_started)
+        triggered_total += len(triggered)
+        for _ in triggered:
+            index.add(make_order(rng, next_id, symbol, price, args.spread))
+            next_id += 1
+        if args.cancel_rate and rng.random() < args.cancel_rate:
+            if index.remove(rng.randrange(next_id)) is not None:
+                cancelled += 1
+    heap_seconds = time.perf_counter() - started
+    latencies.sort()
+
+    # Полный просмотр на первых тиках - он на порядки медленнее, весь поток не прогоняем
+    naive_ticks = ticks[:args.naive_ticks]
+    started = time.perf_counter()
+    naive_triggered = 0
+    for symbol, price in naive_ticks:
+        naive_triggered += len(naive_tick(orders_by_symbol, symbol, price))
+    naive_seconds = time.perf_counter() - started
+
+    print(json.dumps({
+        "resting_orders": args.orders,
+        "symbols": len(SYMBOLS),
+        "load_seconds": round(load_seconds, 3),
+        "heap": {
+            "ticks": len(ticks),
+            "ticks_per_second": round(len(ticks) / heap_seconds),
+            "p50_us": round(percentile(latencies, 50) * 1e6, 2),
+            "p99_us": round(percentile(latencies, 99) * 1e6, 2),
+            "max_us": round(latencies[-1] * 1e6, 2),
+            "triggered": triggered_total,
+            "cancelled": cancelled,
+            "resting_after": len(index),
+        },
+        "full_scan": {
+            "ticks": len(naive_ticks),
+            "ticks_per_second": round(len(naive_ticks) / naive_seconds, 1) if naive_seconds else None,
+            "triggered": naive_triggered,
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=1000000)
+    parser.add_argument("--ticks", type=int, default=200000)
+    parser.add_argument("--naive-ticks", type=int, default=200)
+    parser.add_argument("--volatility", type=float, default=0.0005, help="стандартное отклонение изменения цены за тик")
+    parser.add_argument("--spread", type=float, default=0.05, help="насколько далеко от цены ставятся пороги (доля)")
+    parser.add_argument("--cancel-rate", type=float, default=0.01, help="доля тиков, на которых отменяется случайный ордер")
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
@@ -0,0 +1,70 @@
+# Бенчмарк: стоимость загрузки страницы (оценка портфеля с P&L) при росте числа сделок
+# Cost basis хранится в строке актива, поэтому время оценки не должно расти вместе с историей.
+# Для сравнения меряется и пересборка из журнала (pnl_backfill).
+# Запуск: python bench/pnl_page_load.py --trades 10 100 1000 10000
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from models import User, Portfolio
+from crud import PortfolioCRUD
+from market_data import price_table
+from pnl_backfill import backfill
+
+SYMBOLS = ["BTC", "ETH", "SOL", "ADA", "DOT"]
+
+
+def run(trades: int, loads: int) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "pnl.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+
+    with Session() as db:
+        user = User(username="pnl", email="pnl@example.com", password="pnl")
+        db.add(user)
+        db.flush()
+        db.add(Portfolio(user_id=user.id, total_added_money=1e12, available_money=1e12))
+        db.commit()
+        user_id = user.id
+
+        for i in range(trades):
+            symbol = SYMBOLS[i % len(SYMBOLS)]
+            price = 100.0 + i % 17
+            if i % 3 == 2:
+                PortfolioCRUD.sell_asset(db, user_id, symbol, 0.5, price)
+            else:
+                PortfolioCRUD.buy_asset(db, user_id, symbol, 1.0, price)
+
+    started = time.perf_counter()
+    for _ in range(loads):
+        with Session() as db:
+            PortfolioCRUD.get_portfolio_valuation(db, user_id)
+    page_ms = (time.perf_counter() - started) / loads * 1000
+
+    with Session() as db:
+        started = time.perf_counter()
+        backfill(db, dry_run=True)
+        replay_ms = (time.perf_counter() - started) * 1000
+
+    engine.dispose()
+    return {"trades": trades, "page_load_ms": round(page_ms, 3), "full_replay_ms": round(replay_ms, 3)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trades", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--loads", type=int, default=200)
+    args = parser.parse_args()
+    for symbol in SYMBOLS:
+        price_table.update(symbol, 120.0) # цены из памяти - меряем только БД и расчет P&L
+    print(json.dumps([run(trades, args.loads) for trades in args.trades], indent=2))
@@ -0,0 +1,138 @@
+# Проверка общей доски цен (price_board.PriceBoard) на разорванные чтения при параллельной записи
+# Писатель в отдельном процессе без пауз переписывает слоты значениями, где price == updated_at == номер обновления.
+# Читатели в других процессах читают те же слоты: пара из разных обновлений (price != updated_at) - разорванное чтение,
+# номер меньше уже виденного - чтение "назад во времени". Оба счетчика должны быть 0; при ошибке код выхода 1.
+# Режим --raw читает поля без seqlock - показывает, что проверка вообще способна поймать разрыв.
+# Запуск: python bench/price_board_torn_reads.py --readers 4 --seconds 5 --symbols 8
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from price_board import PriceBoard, FIELDS, SEQ
+
+
+RESULT_TIMEOUT_SECONDS = 30
+
+
+def writer(name: str, slots: int, lock_path: str, symbols: list, seconds: float, ready, result):
+    board = PriceBoard(name, slots, lock_path=lock_path)
+    board.open()
+    assert board.try_elect(), "lock file is held by another writer"
+    for symbol in symbols:
+        board.put(symbol, 0.0, 0.0)
+    ready.set()
+    updates = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for symbol in symbols:
+            updates += 1
+            board.put(symbol, float(updates), float(updates))
+    result.put({"updates": updates})
+    board.close()
+
+
+def find_slot(board: PriceBoard, symbol: str) -> int:
+    # Писатель уже крутится: read_slot может сдаться (None) - повторяем, пока не прочитаем слот целиком
+    key = symbol.encode()
+    for index in range(board.slots):
+        fields = None
+        while fields is None:
+            fields = board.read_slot(index)
+        if fields[0].rstrip(b"\0") == key:
+            return index
+    raise AssertionError(f"{symbol} is not on the board")
+
+
+def reader(name: str, slots: int, symbols: list, seconds: float, raw: bool, ready, result):
+    board = PriceBoard(name, slots)
+    board.open()
+    ready.wait()
+    indexes = [find_slot(board, symbol) for symbol in symbols]
+    last = [0.0] * len(indexes)
+    reads = torn = backwards = gave_up = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for position, index in enumerate(indexes):
+            if raw:
+                fields = FIELDS.unpack_from(board.buf, board._slot_offset(index) + SEQ.size)
+            else:
+                fields = board.read_slot(index)
+                if fields is None:
+                    gave_up += 1
+                    continue
+            reads += 1
+            _, price, updated_at = fields
+            if price != updated_at:
+                torn += 1
+            elif price < last[position]:
+                backwards += 1
+            else:
+                last[position] = price
+    result.put({"reads": reads, "torn": torn, "backwards": backwards, "gave_up": gave_up, "retries": board.torn_retries})
+    board.close()
+
+
+def run(readers: int, seconds: float, symbols: int, slots: int, raw: bool = False) -> dict:
+    name = f"price_board_check_{os.getpid()}"
+    lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+    symbol_names = [f"SYM{i}" for i in range(symbols)]
+    context = multiprocessing.get_context("spawn") # как воркеры uvicorn: отдельные интерпретаторы, общий только сегмент
+    board = PriceBoard(name, slots, lock_path=lock_path)
+    board.open()
+    ready = context.Event()
+    result = context.Queue()
+    processes = [context.Process(target=writer, args=(name, slots, lock_path, symbol_names, seconds, ready, result))]
+    processes += [
+        context.Process(target=reader, args=(name, slots, symbol_names, seconds, raw, ready, result))
+        for _ in range(readers)
+    ]
+    try:
+        for process in processes:
+            process.start()
+        results = [result.get(timeout=seconds + RESULT_TIMEOUT_SECONDS) for _ in processes] # упавший процесс не подвешивает проверку
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        board.close()
+        board.unlink()
+        os.remove(lock_path)
+
+    reader_results = [r for r in results if "reads" in r]
+    return {
+        "mode": "raw" if raw else "seqlock",
+        "readers": readers,
+        "symbols": symbols,
+        "seconds": seconds,
+        "writer_updates_per_second": round(sum(r.get("updates", 0) for r in results) / seconds),
+        "reads_per_second": round(sum(r["reads"] for r in reader_results) / seconds),
+        "torn": sum(r["torn"] for r in reader_results),
+        "backwards": sum(r["backwards"] for r in reader_results),
+        "gave_up": sum(r["gave_up"] for r in reader_results),
+        "retries": sum(r["retries"] for r in reader_results),
+    }
+
+
+def main(args):
+    summary = run(args.readers, args.seconds, args.symbols, args.slots, args.raw)
+    print(json.dumps(summary, indent=2))
+    if not args.raw and (summary["torn"] or summary["backwards"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--symbols", type=int, default=8)
+    parser.add_argument("--slots", type=int, default=64)
+    parser.add_argument("--raw", action="store_true", help="читать без seqlock (контроль: разрывы должны находиться)")
+    main(parser.parse_args())
@@ -0,0 +1,100 @@
+# Бенчмарк: параллельная загрузка /user-profile (оценка портфеля) через sync Session и через AsyncSession
+# Запуск: python bench/profile_load.py --users 200 --assets 10 --requests 2000 --concurrency 50
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database import Base
+from models import User, Portfolio, Asset
+from crud import PortfolioCRUD
+from crud_async import AsyncPortfolioCRUD
+from market_data import price_table
+
+SYMBOLS = ["BTC", "ETH", "SOL", "ADA", "DOT", "LTC", "XRP", "BNB", "DOGE", "TRX", "LINK", "AVAX"]
+
+
+def seed(session_factory, users: int, assets: int):
+    with session_factory() as db:
+        for i in range(users):
+            user = User(username=f"bench{i}", email=f"bench{i}@example.com", password="bench")
+            db.add(user)
+            db.flush()
+            portfolio = Portfolio(user_id=user.id, total_added_money=1_000_000, available_money=1_000_000)
+            db.add(portfolio)
+            db.flush()
+            for j in range(assets):
+                db.add(Asset(portfolio_id=portfolio.id, symbol=SYMBOLS[j % len(SYMBOLS)], quantity=1.0, cost_basis=1.0))
+        db.commit()
+
+
+async def drive(load_one, requests: int, concurrency: int, users: int) -> dict:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            await load_one(i % users + 1)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+async def main(args):
+    for symbol in SYMBOLS:
+        price_table.update(symbol, 100.0) # цены из памяти - меряем только слой БД
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    SessionLocal = sessionmaker(bind=engine, autoflush=False)
+    Base.metadata.create_all(bind=engine)
+    seed(SessionLocal, args.users, args.assets)
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def load_sync(user_id):
+        # как было: синхронная сессия внутри async def блокирует event loop
+        with SessionLocal() as db:
+            PortfolioCRUD.get_portfolio_valuation(db, user_id)
+
+    async def load_async(user_id):
+        async with AsyncSessionLocal() as db:
+            await AsyncPortfolioCRUD.get_portfolio_valuation(db, user_id)
+
+    results = {
+        "users": args.users,
+        "assets_per_user": args.assets,
+        "concurrency": args.concurrency,
+        "sync_session": await drive(load_sync, args.requests, args.concurrency, args.users),
+        "async_session": await drive(load_async, args.requests, args.concurrency, args.users),
+    }
+    await async_engine.dispose()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--assets", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,88 @@
+# Бенчмарк раздачи цен SSE: N подписчиков на одном источнике цен
+# Меряет память на подключение (подписка + задача клиента) и задержку от тика до получения клиентом
+# Запуск: python bench/sse_fanout.py --clients 5000 --ticks 200 --symbols 5
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from broadcast import PriceBroadcaster, portfolio_update, sse_event
+from market_data import PriceTable
+
+SYMBOLS = ["BTC", "ETH", "SOL", "ADA", "DOT", "LTC", "XRP", "BNB"]
+
+
+async def main(args):
+    table = PriceTable()
+    broadcaster = PriceBroadcaster(table, poll_interval=3600)
+    symbols = SYMBOLS[:args.symbols]
+    sent_at = {}
+    latencies = []
+    received = 0
+
+    async def client(holdings):
+        nonlocal received
+        subscription = broadcaster.subscribe(holdings)
+        prices = {symbol: 1.0 for symbol in holdings}
+        try:
+            while True:
+                batch = await subscription.next_batch(60)
+                now = time.perf_counter()
+                prices.update(batch)
+                sse_event("portfolio", portfolio_update(holdings, prices, batch)) # та же работа, что и в эндпоинте
+                for symbol in batch:
+                    latencies.append(now - sent_at[symbol])
+                received += 1
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tasks = [
+        asyncio.create_task(client({symbol: 1.0 + i % 7 for symbol in symbols[i % len(symbols):] + symbols[:1]}))
+        for i in range(args.clients)
+    ]
+    await asyncio.sleep(0) # даем клиентам подписаться
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    memory = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+    started = time.perf_counter()
+    for i in range(args.ticks):
+        symbol = symbols[i % len(symbols)]
+        sent_at[symbol] = time.perf_counter()
+        table.update(symbol, 100.0 + i)
+        await asyncio.sleep(args.tick_interval)
+    await asyncio.sleep(0.5)
+    elapsed = time.perf_counter() - started
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies.sort()
+    print(json.dumps({
+        "clients": args.clients,
+        "ticks": args.ticks,
+        "bytes_per_connection": round(memory / args.clients),
+        "deliveries": received,
+        "deliveries_per_second": round(received / elapsed, 1),
+        "fanout_latency_ms": {
+            "p50": round(latencies[len(latencies) // 2] * 1000, 3) if latencies else None,
+            "p99": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3) if latencies else None,
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--symbols", type=int, default=5)
+    parser.add_argument("--tick-interval", type=float, default=0.01)
+    asyncio.run(main(parser.parse_args()))
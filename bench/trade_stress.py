@@ -0,0 +1,102 @@
+# Стресс-проверка сделок: сотни параллельных покупок/продаж в один портфель
+# Проверяет, что деньги не уходят в минус и актив не продается дважды, и считает сделки в секунду
+# Запуск: python bench/trade_stress.py --trades 500 --concurrency 100
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database import Base
+from models import User, Portfolio, Asset
+from crud_async import AsyncPortfolioCRUD
+from storage import apply_sqlite_pragmas
+
+PRICE = 10.0
+QUANTITY = 1.0
+
+
+async def fire(session_factory, trade, count: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    accepted = 0
+    rejected = 0
+
+    async def one():
+        nonlocal accepted, rejected
+        async with semaphore:
+            async with session_factory() as db:
+                try:
+                    await trade(db)
+                    accepted += 1
+                except HTTPException as e:
+                    if e.status_code != 400:
+                        raise
+                    rejected += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(count)))
+    return accepted, rejected, time.perf_counter() - started
+
+
+async def main(args):
+    path = os.path.join(tempfile.mkdtemp(), "stress.db")
+    sync_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=sync_engine)
+    sync_engine.dispose()
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", pool_size=args.concurrency, max_overflow=0)
+    apply_sqlite_pragmas(engine.sync_engine)
+    Session = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+    # Денег хватает ровно на половину покупок - вторая половина обязана получить отказ
+    cash = args.trades // 2 * PRICE * QUANTITY
+    async with Session() as db:
+        user = User(username="stress", email="stress@example.com", password="stress")
+        db.add(user)
+        await db.flush()
+        db.add(Portfolio(user_id=user.id, total_added_money=cash, available_money=cash))
+        await db.commit()
+        user_id = user.id
+
+    buys, buy_rejects, buy_seconds = await fire(
+        Session, lambda db: AsyncPortfolioCRUD.buy_asset(db, user_id, "BTC", QUANTITY, PRICE), args.trades, args.concurrency)
+    # Продаем больше, чем куплено - лишние продажи обязаны получить отказ
+    sells, sell_rejects, sell_seconds = await fire(
+        Session, lambda db: AsyncPortfolioCRUD.sell_asset(db, user_id, "BTC", QUANTITY, PRICE), args.trades, args.concurrency)
+
+    async with Session() as db:
+        portfolio = await db.scalar(select(Portfolio).where(Portfolio.user_id == user_id))
+        asset_rows = (await db.scalars(select(Asset).where(Asset.portfolio_id == portfolio.id))).all()
+    await engine.dispose()
+
+    held = sum(asset.quantity for asset in asset_rows)
+    checks = {
+        "no_overdraft": buys == args.trades // 2 and portfolio.available_money >= 0,
+        "no_double_sell": sells == buys and held == 0,
+        "cash_conserved": abs(portfolio.available_money - (cash - buys * PRICE + sells * PRICE)) < 1e-6,
+        "single_asset_row": len(asset_rows) <= 1,
+    }
+    print(json.dumps({
+        "trades": args.trades,
+        "concurrency": args.concurrency,
+        "buys": {"accepted": buys, "rejected": buy_rejects, "trades_per_second": round(args.trades / buy_seconds, 1)},
+        "sells": {"accepted": sells, "rejected": sell_rejects, "trades_per_second": round(args.trades / sell_seconds, 1)},
+        "checks": checks,
+    }, indent=2))
+    if not all(checks.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trades", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,53 @@
+# Пакетный ордер: упала одна нога - откатывается весь пакет, и ответ не говорит "filled" про откаченные ноги
+# Запуск: python -m pytest tests
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database import Base
+from models import User, Portfolio, Asset, AssetLot, Transaction
+from crud_async import AsyncPortfolioCRUD
+
+
+async def _rejected_batch(url: str):
+    engine = create_async_engine(url)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with sessions() as db:
+        user = User(username="trader", password="x", email="trader@example.com")
+        db.add(user)
+        await db.flush()
+        db.add(Portfolio(user_id=user.id, available_money=100.0, total_added_money=100.0))
+        await db.commit()
+        user_id = user.id
+
+    legs = [SimpleNamespace(side="buy", symbol="BTC", quantity=1.0), SimpleNamespace(side="buy", symbol="ETH", quantity=1.0)]
+    async with sessions() as db:
+        filled, results = await AsyncPortfolioCRUD.execute_batch(db, user_id, legs, {"BTC": 60.0, "ETH": 50.0})
+
+    async with sessions() as db:
+        rows = {
+            model.__name__: await db.scalar(select(func.count()).select_from(model))
+            for model in (Asset, AssetLot, Transaction)
+        }
+        cash = await db.scalar(select(Portfolio.available_money).where(Portfolio.user_id == user_id))
+    await engine.dispose()
+    return filled, results, rows, cash
+
+
+def test_failed_leg_rolls_back_earlier_legs(tmp_path):
+    filled, results, rows, cash = asyncio.run(_rejected_batch(f"sqlite+aiosqlite:///{tmp_path / 'batch.db'}"))
+
+    assert filled is False
+    assert [result["status"] for result in results] == ["rolled_back", "rejected"]
+    assert results[1]["detail"] == "Not enough money"
+    assert rows == {"Asset": 0, "AssetLot": 0, "Transaction": 0} # ни актива, ни лота, ни строки журнала
+    assert cash == 100.0
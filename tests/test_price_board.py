@@ -0,0 +1,15 @@
+# Доска цен под параллельной записью из другого процесса: ни разорванных, ни "назад во времени" чтений
+# Запуск: python -m pytest tests
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bench"))
+
+from price_board_torn_reads import run
+
+
+def test_seqlock_reads_are_never_torn_or_backwards():
+    summary = run(readers=2, seconds=1, symbols=4, slots=64)
+    assert summary["reads_per_second"] > 0
+    assert summary["torn"] == 0
+    assert summary["backwards"] == 0